@@ -0,0 +1,563 @@
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+import etl_engine
+from etl_metrics import RunMetrics
+
+if os.name == "nt":
+    resource = None  # no getrusage on Windows: peak RSS is not recorded
+else:
+    import resource
+
+# --- ETL BENCHMARK SUITE ---
+# Generates a synthetic master and update queue at a given scale, runs
+# process_all_updates on it in a scratch project directory and records the
+# run's own per-phase wall time (and optionally traced memory) plus its peak
+# RSS. Each scale runs in a fresh worker process so the peak RSS of
+# one scale does not leak into the next. Results are appended as JSON lines to
+# Benchmarks/benchmark_results.jsonl, so runs from different versions of the
+# engine can be compared.
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(script_dir)
+results_path = os.path.join(project_root, "Benchmarks", "benchmark_results.jsonl")
+
+# Share of the queue rows that goes to each transaction sheet
+DEFAULT_MIX = {
+    "Remove_Employee": 0.05,
+    "Remove_Skill": 0.01,
+    "Remove_Team": 0.01,
+    "Add_Team": 0.01,
+    "Update_Team": 0.01,
+    "Add_Employee": 0.25,
+    "Update_Employee": 0.15,
+    "Add_Skill": 0.02,
+    "Update_Skill": 0.02,
+    "Add_Training_Map": 0.47,
+}
+
+# The RunMetrics phases of a run, in the order they are reported
+PHASES = [
+    "read_queue",
+    "load_master",
+    "build_index",
+    "apply_updates",
+    "write_master",
+    "write_rejections",
+    "archive",
+    "expiry_report",
+]
+# apply_updates is also reported split into these subtotals of its sheet steps
+APPLY_SPLIT = ["removals", "additions"]
+
+
+# --- SYNTHETIC DATA GENERATORS ---
+
+
+def _ids(prefix, start, count):
+    return [f"{prefix}{i:07d}" for i in range(start, start + count)]
+
+
+def _dates(rng, count):
+    days = rng.integers(0, 5 * 365, count)
+    return pd.Timestamp(2021, 1, 1) + pd.to_timedelta(days, unit="D")
+
+
+def generate_master(n_employees, skills_per_employee=3, seed=0):
+    """Builds the 4 master tables for `n_employees` employees.
+
+    Teams and skills scale with the headcount (about 50 employees per team and
+    20 per skill); a tenth of the teams is left empty so Remove_Team can succeed.
+    """
+    rng = np.random.default_rng(seed)
+    n_teams = max(4, n_employees // 50)
+    n_empty_teams = max(1, n_teams // 10)
+    n_skills = max(4, n_employees // 20)
+
+    team_ids = np.array(_ids("T", 0, n_teams + n_empty_teams))
+    teams = pd.DataFrame(
+        {
+            "Team_ID": team_ids,
+            "Team_Name": [f"Team {i}" for i in range(len(team_ids))],
+            "Manager": [f"Manager {i}" for i in range(len(team_ids))],
+        }
+    )
+
+    employee_ids = np.array(_ids("E", 0, n_employees))
+    employees = pd.DataFrame(
+        {
+            "ACF2_ID": employee_ids,
+            "First_Name": [f"First{i}" for i in range(n_employees)],
+            "Last_Name": [f"Last{i}" for i in range(n_employees)],
+            "Team_ID": team_ids[rng.integers(0, n_teams, n_employees)],
+            "Status": "Active",
+        }
+    )
+
+    skill_ids = np.array(_ids("S", 0, n_skills))
+    skills = pd.DataFrame(
+        {
+            "Skill_ID": skill_ids,
+            "Skill_Name": [f"Skill {i}" for i in range(n_skills)],
+            "Team_ID": team_ids[rng.integers(0, n_teams, n_skills)],
+        }
+    )
+
+    n_map = n_employees * skills_per_employee
+    skill_map = pd.DataFrame(
+        {
+            "ACF2_ID": np.repeat(employee_ids, skills_per_employee),
+            "Skill_ID": skill_ids[rng.integers(0, n_skills, n_map)],
+            "Proficiency_Level": rng.integers(1, 6, n_map),
+            "Certification_Date": _dates(rng, n_map),
+        }
+    ).drop_duplicates(subset=["ACF2_ID", "Skill_ID"], ignore_index=True)
+
+    return {
+        "Employees": employees,
+        "Skills": skills,
+        "Teams": teams,
+        "Employee_Skills_Map": skill_map,
+    }
+
+
+def generate_queue(master, queue_rows, mix=None, reject_rate=0.05, seed=1):
+    """Builds an update queue of about `queue_rows` rows split across sheets by `mix`.
+
+    A `reject_rate` share of the rows of every Add_*/Update_* sheet (and of
+    Remove_Team) is made invalid: duplicate or unknown keys, unknown teams.
+    """
+    rng = np.random.default_rng(seed)
+    mix = mix or DEFAULT_MIX
+    total = sum(mix.values())
+    counts = {
+        sheet: int(round(queue_rows * share / total)) for sheet, share in mix.items()
+    }
+
+    employees = master["Employees"]["ACF2_ID"].to_numpy()
+    skills = master["Skills"]["Skill_ID"].to_numpy()
+    teams = master["Teams"]["Team_ID"].to_numpy()
+    staffed = master["Employees"]["Team_ID"].unique()
+    empty_teams = np.setdiff1d(teams, staffed)
+
+    def pick(values, count):
+        return values[rng.integers(0, len(values), count)]
+
+    def split(count):
+        bad = int(rng.binomial(count, reject_rate)) if count else 0
+        return count - bad, bad
+
+    queue = {}
+
+    count = counts.get("Remove_Employee", 0)
+    queue["Remove_Employee"] = pd.DataFrame(
+        {"ACF2_ID": rng.choice(employees, min(count, len(employees)), replace=False)}
+    )
+
+    count = counts.get("Remove_Skill", 0)
+    queue["Remove_Skill"] = pd.DataFrame(
+        {"Skill_ID": rng.choice(skills, min(count, len(skills)), replace=False)}
+    )
+
+    # Valid removals target empty teams; a single staffed team in the batch
+    # makes the engine skip every team removal of the run
+    good, bad = split(counts.get("Remove_Team", 0))
+    queue["Remove_Team"] = pd.DataFrame(
+        {
+            "Team_ID": np.concatenate(
+                [
+                    rng.choice(empty_teams, min(good, len(empty_teams)), replace=False),
+                    pick(staffed, bad),
+                ]
+            )
+        }
+    )
+
+    good, bad = split(counts.get("Add_Team", 0))
+    new_teams = np.array(_ids("TN", 0, good))
+    queue["Add_Team"] = pd.DataFrame(
+        {
+            "Team_ID": np.concatenate([new_teams, pick(teams, bad)]),
+            "Team_Name": "New team",
+            "Manager": "New manager",
+        }
+    )
+    valid_teams = np.concatenate([staffed, new_teams])
+
+    good, bad = split(counts.get("Update_Team", 0))
+    queue["Update_Team"] = pd.DataFrame(
+        {
+            "Team_ID": np.concatenate([pick(teams, good), _ids("TX", 0, bad)]),
+            "Manager": "Updated manager",
+        }
+    )
+
+    good, bad = split(counts.get("Add_Employee", 0))
+    new_employees = np.array(_ids("EN", 0, good + bad))
+    queue["Add_Employee"] = pd.DataFrame(
+        {
+            "ACF2_ID": new_employees,
+            "First_Name": "New",
+            "Last_Name": "Hire",
+            "Team_ID": np.concatenate([pick(valid_teams, good), _ids("TX", 0, bad)]),
+            "Status": "Active",
+        }
+    )
+
+    good, bad = split(counts.get("Update_Employee", 0))
+    queue["Update_Employee"] = pd.DataFrame(
+        {
+            "ACF2_ID": np.concatenate([pick(employees, good), _ids("EX", 0, bad)]),
+            "Status": "Inactive",
+        }
+    )
+
+    good, bad = split(counts.get("Add_Skill", 0))
+    new_skills = np.array(_ids("SN", 0, good))
+    queue["Add_Skill"] = pd.DataFrame(
+        {
+            "Skill_ID": np.concatenate([new_skills, pick(skills, bad)]),
+            "Skill_Name": "New skill",
+            "Team_ID": pick(valid_teams, good + bad),
+        }
+    )
+
+    good, bad = split(counts.get("Update_Skill", 0))
+    queue["Update_Skill"] = pd.DataFrame(
+        {
+            "Skill_ID": np.concatenate([pick(skills, good), _ids("SX", 0, bad)]),
+            "Skill_Name": "Renamed skill",
+        }
+    )
+
+    good, bad = split(counts.get("Add_Training_Map", 0))
+    queue["Add_Training_Map"] = pd.DataFrame(
+        {
+            "ACF2_ID": np.concatenate([pick(employees, good), _ids("EX", 0, bad)]),
+            "Skill_ID": pick(np.concatenate([skills, new_skills]), good + bad),
+            "Proficiency_Level": rng.integers(1, 6, good + bad),
+            "Certification_Date": _dates(rng, good + bad),
+        }
+    )
+
+    return {sheet: df for sheet, df in queue.items() if sheet in mix}
+
+
+def write_queue(queue, queue_path, queue_format):
+    """Writes the queue as an xlsx workbook or a directory of CSV/Parquet files."""
+    if queue_format == "xlsx":
+        with pd.ExcelWriter(queue_path, engine="openpyxl") as writer:
+            for sheet, df in queue.items():
+                df.to_excel(writer, sheet_name=sheet, index=False)
+        return
+    os.makedirs(queue_path, exist_ok=True)
+    for sheet, df in queue.items():
+        if queue_format == "csv":
+            df.to_csv(os.path.join(queue_path, f"{sheet}.csv"), index=False)
+        else:
+            df.to_parquet(os.path.join(queue_path, f"{sheet}.parquet"), index=False)
+
+
+# --- PHASE RUNNER ---
+
+
+class PhaseMemory:
+    """RunMetrics hook recording the traced peak memory of every finished phase.
+
+    Tracing runs for the whole run and its peak is reset as each phase ends,
+    so a phase's peak also covers the engine code run since the phase before.
+    """
+
+    def __init__(self):
+        self.peak_mb = {}
+
+    def __call__(self, kind, name, record):
+        if kind != "phase":
+            return
+        peak = round(tracemalloc.get_traced_memory()[1] / 2**20, 3)
+        self.peak_mb[name] = max(self.peak_mb.get(name, 0.0), peak)
+        tracemalloc.reset_peak()
+
+
+def _peak_rss_mb():
+    """Peak resident memory of this process (None where `resource` is missing)."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    return round(peak / (2**20 if sys.platform == "darwin" else 2**10), 1)
+
+
+def apply_split(sheets):
+    """Seconds of the removal sheets and of the addition/update sheets of a run."""
+    split = dict.fromkeys(APPLY_SPLIT, 0.0)
+    for spec in etl_engine.schema["sheets"]:
+        if spec["sheet"] in sheets:
+            part = "removals" if spec["op"] == "remove" else "additions"
+            split[part] += sheets[spec["sheet"]]["seconds"]
+    return {part: round(seconds, 6) for part, seconds in split.items()}
+
+
+def run_scale(params):
+    """Runs process_all_updates once for one scale and returns its result record.
+
+    The timings are the run's own RunMetrics phases, so the journal, lock,
+    history and report steps of a real commit are measured with the rest.
+    """
+    work_dir = tempfile.mkdtemp(prefix="etl_benchmark_")
+    try:
+        for folder in ("Data", "Archive", "Scripts"):
+            os.makedirs(os.path.join(work_dir, folder))
+        etl_engine.parse_workers = params["parse_workers"]
+        etl_engine.configure_paths(work_dir, params["backend"])
+
+        master = generate_master(
+            params["scale"], params["skills_per_employee"], params["seed"]
+        )
+        queue = generate_queue(
+            master,
+            int(params["scale"] * params["queue_fraction"]),
+            params["mix"],
+            params["reject_rate"],
+            params["seed"] + 1,
+        )
+        extension = ".xlsx" if params["queue_format"] == "xlsx" else ""
+        queue_path = os.path.join(work_dir, "Data", f"update_queue{extension}")
+        write_queue(queue, queue_path, params["queue_format"])
+        queue_rows = sum(len(df) for df in queue.values())
+
+        # The engine logs with print; keep the benchmark output readable
+        engine_log = io.StringIO()
+        with contextlib.redirect_stdout(engine_log):
+            etl_engine.save_master_data(master)
+        master_rows = {name: len(df) for name, df in master.items()}
+        del master, queue
+
+        memory = PhaseMemory()
+        metrics = RunMetrics(hooks=[memory] if params["trace_memory"] else [])
+        if params["trace_memory"]:
+            tracemalloc.start()
+        try:
+            with contextlib.redirect_stdout(engine_log):
+                etl_engine.process_all_updates(queue_path, metrics=metrics)
+        finally:
+            if params["trace_memory"]:
+                tracemalloc.stop()
+        if metrics.status != "success":
+            raise RuntimeError(
+                f"Benchmark run failed: {metrics.error}\n{engine_log.getvalue()}"
+            )
+
+        run = metrics.to_dict()
+        seconds = {name: record["seconds"] for name, record in run["phases"].items()}
+        return {
+            **{key: value for key, value in params.items() if key != "mix"},
+            "mix": params["mix"],
+            "store": run["store"],
+            "master_rows": master_rows,
+            "queue_rows": queue_rows,
+            "rejected_rows": sum(
+                sheet["rows_rejected"] for sheet in run["sheets"].values()
+            ),
+            "seconds": seconds,
+            "apply_seconds": apply_split(run["sheets"]),
+            "sheets": run["sheets"],
+            "total_seconds": round(sum(seconds.values()), 6),
+            "traced_peak_mb": memory.peak_mb,
+            "peak_rss_mb": _peak_rss_mb(),
+        }
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+# --- RESULTS ---
+
+
+def _git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=script_dir,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def _same_setup(a, b):
+    keys = (
+        "scale",
+        "backend",
+        "queue_format",
+        "queue_fraction",
+        "reject_rate",
+        "skills_per_employee",
+        "mix",
+        "trace_memory",
+        "parse_workers",
+    )
+    return all(a.get(key) == b.get(key) for key in keys)
+
+
+def load_results(path=results_path):
+    """Reads all previously recorded benchmark results."""
+    if not os.path.exists(path):
+        return []
+    with open(path) as handle:
+        return [json.loads(line) for line in handle if line.strip()]
+
+
+def append_results(results, path=results_path):
+    """Appends result records to the JSON-lines history."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "a") as handle:
+        for result in results:
+            handle.write(json.dumps(result) + "\n")
+
+
+def print_result(result, previous=None):
+    """Prints one result, with the change against the last comparable run."""
+    print(
+        f"\n--- scale {result['scale']:,} | {result['store']} | "
+        f"{result['queue_format']} queue of {result['queue_rows']:,} rows "
+        f"({result['rejected_rows']:,} rejected) ---"
+    )
+    for phase in PHASES:
+        if phase not in result["seconds"]:
+            continue
+        seconds = result["seconds"][phase]
+        line = f"  - {phase:<17}{seconds:>10.3f}s"
+        if phase in result["traced_peak_mb"]:
+            line += f"{result['traced_peak_mb'][phase]:>10.1f} MB traced"
+        if previous and previous["seconds"].get(phase):
+            change = seconds / previous["seconds"][phase] - 1
+            line += f"  ({change:+.0%} vs {previous.get('revision') or 'previous'})"
+        print(line)
+        if phase == "apply_updates":
+            for part, seconds in result.get("apply_seconds", {}).items():
+                line = f"    {part:<17}{seconds:>10.3f}s"
+                before = (previous or {}).get("apply_seconds", {}).get(part)
+                if before:
+                    change = seconds / before - 1
+                    line += (
+                        f"  ({change:+.0%} vs {previous.get('revision') or 'previous'})"
+                    )
+                print(line)
+    print(f"  - {'total':<17}{result['total_seconds']:>10.3f}s")
+    for sheet, counts in result.get("sheets", {}).items():
+        print(
+            f"    {sheet:<17}{counts['seconds']:>10.3f}s  {counts['rows_in']:,} in, "
+            f"{counts['rows_out']:,} out, {counts['rows_rejected']:,} rejected"
+        )
+    if result["peak_rss_mb"] is not None:
+        print(f"  - peak RSS: {result['peak_rss_mb']:.1f} MB")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the Master Roshi ETL.")
+    parser.add_argument(
+        "--scales",
+        type=int,
+        nargs="+",
+        default=[10**3, 10**4, 10**5],
+        help="Employee counts to generate (e.g. 1000 10000 100000 1000000).",
+    )
+    parser.add_argument(
+        "--backend",
+        default=etl_engine.master_store_backend,
+        choices=["parquet", "sqlite", "excel"],
+    )
+    parser.add_argument(
+        "--queue-format", default="xlsx", choices=["xlsx", "csv", "parquet"]
+    )
+    parser.add_argument(
+        "--queue-fraction",
+        type=float,
+        default=0.1,
+        help="Queue rows as a share of the employee count.",
+    )
+    parser.add_argument(
+        "--mix",
+        type=json.loads,
+        default=None,
+        help="JSON object of sheet shares, e.g. '{\"Add_Employee\": 1}'.",
+    )
+    parser.add_argument("--reject-rate", type=float, default=0.05)
+    parser.add_argument("--skills-per-employee", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--parse-workers",
+        type=int,
+        default=None,
+        help="Parse workbook sheets in this many processes (default: serially).",
+    )
+    parser.add_argument(
+        "--trace-memory",
+        action="store_true",
+        help="Record tracemalloc peaks per phase (slows every phase down).",
+    )
+    parser.add_argument("--results", default=results_path)
+    parser.add_argument(
+        "--no-save", action="store_true", help="Do not append to the results file."
+    )
+    args = parser.parse_args(argv)
+
+    history = load_results(args.results)
+    revision = _git_revision()
+    results = []
+    context = multiprocessing.get_context("spawn")
+    for scale in args.scales:
+        params = {
+            "scale": scale,
+            "backend": args.backend,
+            "queue_format": args.queue_format,
+            "queue_fraction": args.queue_fraction,
+            "mix": args.mix or DEFAULT_MIX,
+            "reject_rate": args.reject_rate,
+            "skills_per_employee": args.skills_per_employee,
+            "seed": args.seed,
+            "trace_memory": args.trace_memory,
+            "parse_workers": args.parse_workers,
+        }
+        # A fresh process per scale keeps peak RSS and caches independent
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            result = pool.submit(run_scale, params).result()
+        result.update(
+            {
+                "revision": revision,
+                "timestamp": datetime.now().isoformat(timespec="seconds"),
+                "python": platform.python_version(),
+                "pandas": pd.__version__,
+            }
+        )
+        previous = next(
+            (old for old in reversed(history) if _same_setup(old, result)), None
+        )
+        print_result(result, previous)
+        results.append(result)
+
+    if not args.no_save:
+        append_results(results, args.results)
+        print(f"\nResults appended to {args.results}")
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+import json
+import os
+import shutil
+from datetime import datetime
+
+# --- CRASH-SAFE COMMIT ---
+# A run never rewrites the master in place. Every output file (master tables,
+# rejection reports) is first written next to its target as "<name>.staged<ext>"
+# (the extension is kept so the Excel/Parquet writers accept it) and fsynced.
+# The run records its outputs and queue archive moves in a write-ahead journal
+# before applying anything, marks the journal once every output is staged, and
+# only then renames the staged files over their targets (an atomic os.replace)
+# and archives the queues.
+# Journal states:
+# - "applying": nothing is committed yet. An interrupted run is rolled back by
+#   deleting its staged files; its queue is still in Data/ and is applied again.
+# - "staged": the commit point for file stores. An interrupted run is rolled
+#   forward by replaying the renames and archive moves, which are idempotent.
+# Stores that commit in their own transaction (SQLite) record the journal id
+# with the data instead, and that record decides between the two.
+
+JOURNAL_VERSION = 1
+STAGED_SUFFIX = ".staged"
+
+
+def staged_path(path):
+    """Where the next version of `path` is written before it is committed."""
+    root, extension = os.path.splitext(path)
+    return f"{root}{STAGED_SUFFIX}{extension}"
+
+
+def fsync_path(path):
+    """Flushes a written file (or a directory entry) to disk."""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        # Directories cannot be opened on Windows; NTFS renames are journaled
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def commit_files(files):
+    """Renames staged files over their targets; safe to repeat after a crash."""
+    directories = set()
+    for staged, final in files:
+        if os.path.exists(staged):
+            os.replace(staged, final)
+            directories.add(os.path.dirname(os.path.abspath(final)))
+    for directory in directories:
+        fsync_path(directory)
+
+
+def write_atomic(path, text):
+    """Writes a small text file through a staged copy and an atomic rename."""
+    staged = staged_path(path)
+    with open(staged, "w") as handle:
+        handle.write(text)
+        handle.flush()
+        os.fsync(handle.fileno())
+    commit_files([(staged, path)])
+
+
+class CommitJournal:
+    """Write-ahead journal of one run's commit, kept as a small JSON file.
+
+    `outputs` are the files (or report directories) the run may replace, each
+    written to its staged path first, and `queues` the (queue path, archive
+    path) moves done after the commit.
+    """
+
+    def __init__(self, path, outputs=(), queues=(), commit_id=None):
+        self.path = path
+        self.commit_id = commit_id or (
+            f"{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}_{os.getpid()}"
+        )
+        self.outputs = list(outputs)
+        self.queues = [list(move) for move in queues]
+        self.state = "applying"
+
+    @property
+    def files(self):
+        """(staged, final) pairs of every output."""
+        return [(staged_path(path), path) for path in self.outputs]
+
+    def _write(self):
+        write_atomic(
+            self.path,
+            json.dumps(
+                {
+                    "version": JOURNAL_VERSION,
+                    "commit_id": self.commit_id,
+                    "state": self.state,
+                    "written_at": datetime.now().isoformat(timespec="seconds"),
+                    "outputs": self.outputs,
+                    "queues": self.queues,
+                },
+                indent=1,
+            ),
+        )
+
+    # --- Run side ---
+
+    def begin(self):
+        """Records the run before anything is applied; returns self."""
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        # Leftovers of an older crash must never be committed with this run
+        self.roll_back()
+        self._write()
+        return self
+
+    def staged(self):
+        """Marks every output as staged and fsynced: the run now rolls forward."""
+        self.state = "staged"
+        self._write()
+
+    def commit(self):
+        """Renames the staged outputs over their targets and archives the queues.
+
+        Every step is skipped if already done, so it is also the roll-forward.
+        """
+        commit_files(self.files)
+        for source, target in self.queues:
+            if os.path.exists(source) and not os.path.exists(target):
+                os.replace(source, target)
+        for directory in {os.path.dirname(target) for _, target in self.queues}:
+            fsync_path(directory)
+
+    def roll_back(self):
+        """Deletes the staged outputs of a run that did not reach its commit point."""
+        for staged, _ in self.files:
+            if os.path.isdir(staged):
+                shutil.rmtree(staged)
+            elif os.path.exists(staged):
+                os.remove(staged)
+
+    def finish(self):
+        """Removes the journal once the run is fully committed or rolled back."""
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        fsync_path(os.path.dirname(os.path.abspath(self.path)))
+
+    # --- Recovery side ---
+
+    @classmethod
+    def load(cls, path):
+        """The journal left behind by an interrupted run, or None."""
+        if not os.path.exists(path):
+            return None
+        with open(path) as handle:
+            data = json.load(handle)
+        journal = cls(path, data["outputs"], data["queues"], data["commit_id"])
+        journal.state = data["state"]
+        return journal
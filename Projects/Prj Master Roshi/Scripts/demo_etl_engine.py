@@ -2,6 +2,8 @@ import pandas as pd
 import os
 from datetime import datetime, date
 
+import etl_engine
+
 # --- CONFIGURATION FOR PORTABILITY (Relative Paths) ---
 # This block automatically finds the project folders regardless of the drive/location.
 try:
@@ -14,17 +16,147 @@ except NameError:
     print("Warning: __file__ not defined. Set BASE_DIR manually.")
     BASE_DIR = "C:/temp/SkillTracker_Project"  # Replace with actual ABSOLUTE path if necessary!
 
-DATA_DIR = os.path.join(BASE_DIR, "Data")
-ARCHIVE_DIR = os.path.join(BASE_DIR, "Archive")
+# Every file of this deployment lives in Data/Demo/ and Archive/Demo/, apart
+# from the etl_engine deployment sharing the project directory
+DEPLOYMENT = "Demo"
+DATA_DIR = os.path.join(BASE_DIR, "Data", DEPLOYMENT)
+ARCHIVE_DIR = os.path.join(BASE_DIR, "Archive", DEPLOYMENT)
 MASTER_DB_PATH = os.path.join(DATA_DIR, "Master_Database.xlsx")
 UPDATE_QUEUE_PATH = os.path.join(DATA_DIR, "Update_Queue.xlsx")
 
 print(f"Project Base Directory set to: {BASE_DIR}")
 
+# --- SCHEMA CONFIGURATION ---
+# This deployment runs the shared ETL engine (etl_engine.py); only its tables,
+# keys, dtypes, foreign keys and queue sheets differ. See master_schema.py for
+# the meaning of every entry.
+MASTER_SCHEMA = {
+    "tables": {
+        "Employees": {
+            "key": ["Employee_ID"],
+            "label": "employee",
+            "dtypes": {
+                "Employee_ID": "str",
+                "Name": "str",
+                "Team_ID": "int32",
+                "Status": "category",
+            },
+            "not_null": ["Name", "Team_ID"],
+            "references": {
+                "Team_ID": {
+                    "table": "Team_Data",
+                    "on_delete": "restrict",
+                    "missing": "Team ID does not exist in Master Team Data.",
+                },
+            },
+        },
+        "Team_Data": {
+            "key": ["Team_ID"],
+            "label": "team",
+            "dtypes": {"Team_ID": "int32", "Team_Name": "str", "Manager": "str"},
+            "not_null": ["Team_Name"],
+        },
+        "Skills": {
+            "key": ["Skill_Code"],
+            "label": "skill",
+            "dtypes": {
+                "Skill_Code": "int32",
+                "Skill_Name": "str",
+                "Category": "category",
+                "Required_Ops_Area": "category",
+            },
+            "not_null": ["Skill_Name"],
+        },
+        "Employee_Skills_Map": {
+            "key": ["Employee_ID", "Skill_Code"],
+            "label": "training record",
+            "dtypes": {
+                "Employee_ID": "str",
+                "Skill_Code": "int32",
+                "Certification_Date": "datetime64[ns]",
+                "Expiration_Date": "datetime64[ns]",
+                "Trainer": "str",
+            },
+            "not_null": ["Employee_ID", "Skill_Code", "Certification_Date"],
+            "references": {
+                "Employee_ID": {
+                    "table": "Employees",
+                    "on_delete": "cascade",
+                    "missing": "Employee ID does not exist in Master Employees.",
+                },
+                "Skill_Code": {
+                    "table": "Skills",
+                    "on_delete": "cascade",
+                    "missing": "Skill Code does not exist in Master Skills.",
+                },
+            },
+        },
+    },
+    # Teams are removed before employees here, so a team whose employees leave
+    # in the same queue is only removed by the next one
+    "sheets": [
+        {"sheet": "Remove_Team", "op": "remove", "table": "Team_Data"},
+        {"sheet": "Remove_Employee", "op": "remove", "table": "Employees"},
+        {"sheet": "Remove_Skill", "op": "remove", "table": "Skills"},
+        {
+            "sheet": "Add_Team",
+            "op": "add",
+            "table": "Team_Data",
+            "required": ["Team_ID", "Team_Name"],
+            "duplicate": "Duplicate Team ID",
+        },
+        {
+            "sheet": "Add_Employee",
+            "op": "add",
+            "table": "Employees",
+            "required": ["Employee_ID", "Name", "Team_ID"],
+            "duplicate": "Duplicate Employee ID.",
+        },
+        {
+            "sheet": "Add_Skill",
+            "op": "add",
+            "table": "Skills",
+            "required": ["Skill_Code", "Skill_Name"],
+            "duplicate": "Duplicate Skill Code",
+        },
+        {
+            "sheet": "Add_Training_Map",
+            "op": "upsert",
+            "table": "Employee_Skills_Map",
+            "required": ["Employee_ID", "Skill_Code", "Certification_Date"],
+        },
+    ],
+    # Certifications carry no proficiency level and skills have no owning team
+    "skill_matrix": {
+        "table": "Employee_Skills_Map",
+        "employee": "Employee_ID",
+        "skill": "Skill_Code",
+        "level": None,
+        "team": "Team_ID",
+        "manager": "Manager",
+        "skill_team": None,
+        "status": "Status",
+        "inactive": ["Inactive"],
+        "expires": "Expiration_Date",
+    },
+}
+
 
 # --- UTILITY FUNCTIONS ---
 
 
+def configure_engine():
+    """Points the shared engine at this deployment's schema and files.
+
+    The demo keeps its master in the single Master_Database.xlsx workbook.
+    Called by main(), not on import, so importing this module leaves the
+    engine's own configuration alone.
+    """
+    etl_engine.configure_paths(
+        BASE_DIR, backend="excel", master_schema=MASTER_SCHEMA, deployment=DEPLOYMENT
+    )
+
+
 def initialize_master_database():
     """Creates the Master_Database.xlsx with all four required sheets and initial data."""
     print("Master Database not found. Creating a template file with initial data...")
@@ -74,276 +206,31 @@ def initialize_master_database():
     }
     map_df = pd.DataFrame(map_data)
 
-    # Write all four DataFrames
+    # Write all four DataFrames to the engine's master store
     try:
-        with pd.ExcelWriter(MASTER_DB_PATH, engine="openpyxl") as writer:
-            employees_df.to_excel(writer, sheet_name="Employees", index=False)
-            team_df.to_excel(writer, sheet_name="Team_Data", index=False)
-            skills_df.to_excel(writer, sheet_name="Skills", index=False)
-            map_df.to_excel(writer, sheet_name="Employee_Skills_Map", index=False)
+        etl_engine.save_master_data(
+            {
+                "Employees": employees_df,
+                "Team_Data": team_df,
+                "Skills": skills_df,
+                "Employee_Skills_Map": map_df,
+            }
+        )
         print(f"SUCCESS: Master Database created with 4 sheets.")
     except Exception as e:
         print(f"ERROR: Failed to write the database file: {e}")
 
 
-def load_master_data():
-    """Loads all four sheets from the Master Database for processing."""
-    try:
-        master_dfs = pd.read_excel(
-            MASTER_DB_PATH,
-            sheet_name=["Employees", "Team_Data", "Skills", "Employee_Skills_Map"],
-        )
-        return master_dfs
-    except FileNotFoundError:
-        print("ERROR: Master Database file not found during load.")
-        return None
-    except Exception as e:
-        print(f"ERROR: An error occurred while loading data: {e}")
-        return None
-
-
 # --- CORE ETL LOGIC ---
 
 
 def process_all_updates():
-    """Reads all update sheets, processes removals first, then additions, and updates the master database."""
-    print("\n--- Starting Comprehensive ETL Process ---")
+    """Applies Update_Queue.xlsx with the shared engine: removals first, then additions.
 
-    # 1. Load Master and Update Data
-    try:
-        master = load_master_data()
-        # Read all sheets in the Update Queue, treating potential missing sheets gracefully
-        update_sheets = pd.read_excel(UPDATE_QUEUE_PATH, sheet_name=None)
-    except FileNotFoundError:
-        print(
-            f"ERROR: Update Queue file not found at {UPDATE_QUEUE_PATH}. Please ensure it exists."
-        )
-        return
-    except Exception as e:
-        print(f"ERROR during initial data load: {e}")
-        return
-
-    # Initialize list to hold rejected records
-    rejected_records = []
-
-    # --- Step 2: PROCESS REMOVALS (Prioritized for data hygiene) ---
-    print("\n[STEP 2/4] Processing REMOVALS...")
-
-    # a. Remove Teams
-    if "Remove_Team" in update_sheets and not update_sheets["Remove_Team"].empty:
-        df_rem_team = update_sheets["Remove_Team"].dropna(subset=["Team_ID"])
-        remove_team_ids = df_rem_team["Team_ID"].astype(int).unique()
-
-        # Validation: Check if any active employees belong to these teams
-        active_employees_on_team = master["Employees"][
-            master["Employees"]["Team_ID"].isin(remove_team_ids)
-        ]
-
-        if not active_employees_on_team.empty:
-            print(
-                f"  - WARNING: Cannot remove {len(remove_team_ids)} team(s) as {len(active_employees_on_team)} active employees are still linked."
-            )
-            # In a real-world scenario, you might reassign or reject. Here, we skip the removal.
-        else:
-            master["Team_Data"] = master["Team_Data"][
-                ~master["Team_Data"]["Team_ID"].isin(remove_team_ids)
-            ]
-            print(f"  - Removed {len(remove_team_ids)} team(s).")
-
-    # b. Remove Employees (Requires cascade removal from map)
-    if (
-        "Remove_Employee" in update_sheets
-        and not update_sheets["Remove_Employee"].empty
-    ):
-        df_rem_emp = update_sheets["Remove_Employee"].dropna(subset=["Employee_ID"])
-        remove_ids = df_rem_emp["Employee_ID"].astype(str).unique()
-
-        # Remove employee from master Employees sheet
-        master["Employees"] = master["Employees"][
-            ~master["Employees"]["Employee_ID"].isin(remove_ids)
-        ]
-
-        # CASCADE: Remove training records for removed employees (Crucial integrity step!)
-        master["Employee_Skills_Map"] = master["Employee_Skills_Map"][
-            ~master["Employee_Skills_Map"]["Employee_ID"].isin(remove_ids)
-        ]
-        print(
-            f"  - Removed {len(remove_ids)} employee(s) and their associated training records."
-        )
-
-    # c. Remove Skills (Requires cascade removal from map)
-    if "Remove_Skill" in update_sheets and not update_sheets["Remove_Skill"].empty:
-        df_rem_skill = update_sheets["Remove_Skill"].dropna(subset=["Skill_Code"])
-        remove_codes = df_rem_skill["Skill_Code"].astype(int).unique()
-
-        # Remove skill from master Skills sheet
-        master["Skills"] = master["Skills"][
-            ~master["Skills"]["Skill_Code"].isin(remove_codes)
-        ]
-
-        # CASCADE: Remove training records for removed skills
-        master["Employee_Skills_Map"] = master["Employee_Skills_Map"][
-            ~master["Employee_Skills_Map"]["Skill_Code"].isin(remove_codes)
-        ]
-        print(
-            f"  - Removed {len(remove_codes)} skill(s) and their associated training records."
-        )
-
-    # --- Step 3: PROCESS ADDITIONS & UPDATES (Including validation) ---
-    print("\n[STEP 3/4] Processing ADDITIONS & UPDATES...")
-
-    # a. Add Teams
-    if "Add_Team" in update_sheets and not update_sheets["Add_Team"].empty:
-        new_teams = update_sheets["Add_Team"].dropna(subset=["Team_ID", "Team_Name"])
-        new_teams["Team_ID"] = new_teams["Team_ID"].astype(int)
-        existing_ids = set(master["Team_Data"]["Team_ID"].astype(int).values)
-
-        valid_adds = new_teams[~new_teams["Team_ID"].isin(existing_ids)]
-        rejected_records.extend(
-            new_teams[new_teams["Team_ID"].isin(existing_ids)]
-            .assign(Reason="Duplicate Team ID")
-            .to_dict("records")
-        )
-
-        master["Team_Data"] = pd.concat(
-            [master["Team_Data"], valid_adds], ignore_index=True
-        )
-        print(
-            f"  - Added {len(valid_adds)} new team(s). Rejected {len(new_teams) - len(valid_adds)} duplicates."
-        )
-
-    # b. Add New Employees (Validation: Employee ID unique, Team ID exists)
-    if "Add_Employee" in update_sheets and not update_sheets["Add_Employee"].empty:
-        new_employees = update_sheets["Add_Employee"].dropna(
-            subset=["Employee_ID", "Name", "Team_ID"]
-        )
-        new_employees["Team_ID"] = new_employees["Team_ID"].astype(int)
-        existing_ids = set(master["Employees"]["Employee_ID"].values)
-        current_team_ids = set(master["Team_Data"]["Team_ID"].astype(int).values)
-
-        valid_adds = []
-
-        for index, row in new_employees.iterrows():
-            if row["Employee_ID"] in existing_ids:
-                row["Reason"] = "Duplicate Employee ID."
-                rejected_records.append(row.to_dict())
-                continue
-            # VALIDATION: Team_ID must exist
-            if row["Team_ID"] not in current_team_ids:
-                row["Reason"] = "Team ID does not exist in Master Team Data."
-                rejected_records.append(row.to_dict())
-                continue
-
-            valid_adds.append(row)
-
-        if valid_adds:
-            df_valid_adds = pd.DataFrame(valid_adds)
-            master["Employees"] = pd.concat(
-                [master["Employees"], df_valid_adds], ignore_index=True
-            )
-            print(f"  - Added {len(df_valid_adds)} new employee(s).")
-        print(
-            f"  - Rejected {len(new_employees) - len(valid_adds)} duplicates/invalid entries."
-        )
-
-    # c. Add New Skills (Validation: Skill Code unique)
-    if "Add_Skill" in update_sheets and not update_sheets["Add_Skill"].empty:
-        new_skills = update_sheets["Add_Skill"].dropna(
-            subset=["Skill_Code", "Skill_Name"]
-        )
-        new_skills["Skill_Code"] = new_skills["Skill_Code"].astype(int)
-        existing_codes = set(master["Skills"]["Skill_Code"].astype(int).values)
-
-        valid_adds = new_skills[~new_skills["Skill_Code"].isin(existing_codes)]
-        rejected_records.extend(
-            new_skills[new_skills["Skill_Code"].isin(existing_codes)]
-            .assign(Reason="Duplicate Skill Code")
-            .to_dict("records")
-        )
-
-        master["Skills"] = pd.concat([master["Skills"], valid_adds], ignore_index=True)
-        print(
-            f"  - Added {len(valid_adds)} new skill(s). Rejected {len(new_skills) - len(valid_adds)} duplicates."
-        )
-
-    # d. Add New Training to Map (Validation: Employee ID & Skill Code must exist; Overwrite)
-    if (
-        "Add_Training_Map" in update_sheets
-        and not update_sheets["Add_Training_Map"].empty
-    ):
-        updates = update_sheets["Add_Training_Map"].dropna(
-            subset=["Employee_ID", "Skill_Code", "Certification_Date"]
-        )
-        updates["Skill_Code"] = updates["Skill_Code"].astype(int)
-
-        valid_training_adds = []
-        current_employee_ids = set(master["Employees"]["Employee_ID"].values)
-        current_skill_codes = set(master["Skills"]["Skill_Code"].astype(int).values)
-
-        for index, row in updates.iterrows():
-            # Validation 1: Employee ID must exist
-            if row["Employee_ID"] not in current_employee_ids:
-                row["Reason"] = "Employee ID does not exist in Master Employees."
-                rejected_records.append(row.to_dict())
-                continue
-            # Validation 2: Skill Code must exist
-            if row["Skill_Code"] not in current_skill_codes:
-                row["Reason"] = "Skill Code does not exist in Master Skills."
-                rejected_records.append(row.to_dict())
-                continue
-
-            # Remove old certification for the same employee/skill pair (UPDATE/OVERWRITE)
-            master["Employee_Skills_Map"] = master["Employee_Skills_Map"][
-                ~(
-                    (master["Employee_Skills_Map"]["Employee_ID"] == row["Employee_ID"])
-                    & (master["Employee_Skills_Map"]["Skill_Code"] == row["Skill_Code"])
-                )
-            ]
-
-            valid_training_adds.append(row)
-
-        if valid_training_adds:
-            updates_to_add = pd.DataFrame(valid_training_adds)
-            master["Employee_Skills_Map"] = pd.concat(
-                [master["Employee_Skills_Map"], updates_to_add], ignore_index=True
-            )
-            print(
-                f"  - Added/Updated {len(updates_to_add)} training records to the map. Rejected {len(updates) - len(updates_to_add)} invalid entries."
-            )
-
-    # --- Step 4: Write Master Data, Archive, and Report Rejections ---
-    print("\n[STEP 4/4] Finalizing changes...")
-
-    # Write Master DataFrames back to the single Master_Database.xlsx (4 sheets)
-    try:
-        with pd.ExcelWriter(MASTER_DB_PATH, engine="openpyxl") as writer:
-            master["Employees"].to_excel(writer, sheet_name="Employees", index=False)
-            master["Team_Data"].to_excel(writer, sheet_name="Team_Data", index=False)
-            master["Skills"].to_excel(writer, sheet_name="Skills", index=False)
-            master["Employee_Skills_Map"].to_excel(
-                writer, sheet_name="Employee_Skills_Map", index=False
-            )
-        print("SUCCESS: Master Database successfully updated (4 sheets).")
-    except Exception as e:
-        print(f"ERROR: Failed to write to Master Database. Check file permissions: {e}")
-        return
-
-    # Handle Rejections
-    if rejected_records:
-        rejected_df = pd.DataFrame(rejected_records)
-        rejected_path = os.path.join(
-            ARCHIVE_DIR,
-            f'REJECTED_updates_{datetime.now().strftime("%Y%m%d_%H%M%S")}.xlsx',
-        )
-        rejected_df.to_excel(rejected_path, index=False)
-        print(
-            f"WARNING: {len(rejected_df)} updates were rejected. See REJECTED file in Archive."
-        )
-
-    # Archive the processed update queue
-    archive_name = f'PROCESSED_updates_{datetime.now().strftime("%Y%m%d_%H%M%S")}.xlsx'
-    os.rename(UPDATE_QUEUE_PATH, os.path.join(ARCHIVE_DIR, archive_name))
-    print(f"SUCCESS: Update Queue archived. ETL process finished.")
+    Validation, cascades and rejections follow MASTER_SCHEMA above; rejected
+    rows go to Archive/rejected_records_<timestamp>/. Returns the run's RunMetrics.
+    """
+    return etl_engine.process_all_updates(UPDATE_QUEUE_PATH)
 
 
 # --- PHASE 2 TESTING FUNCTION ---
@@ -412,19 +299,27 @@ def run_phase_2_test():
 
 
 # --- MAIN EXECUTION BLOCK ---
-if __name__ == "__main__":
+
+
+def main():
+    configure_engine()
+
     # Ensure directories exist
     os.makedirs(DATA_DIR, exist_ok=True)
     os.makedirs(ARCHIVE_DIR, exist_ok=True)
 
     # Forced re-initialization for consistent testing
-    if os.path.exists(MASTER_DB_PATH):
+    if etl_engine.master_store.exists():
         print(
             "\nMaster DB exists. Deleting and re-initializing to ensure 4-sheet structure for test."
         )
-        os.remove(MASTER_DB_PATH)
+        etl_engine.master_store.delete()
 
     initialize_master_database()
 
     # Run the comprehensive test
     run_phase_2_test()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,47 @@
 import pandas as pd
 import os
 from datetime import datetime
+from fnmatch import fnmatch
+
+from commit_journal import CommitJournal, commit_files, fsync_path, staged_path
+from etl_metrics import RunMetrics
+from expiry_index import (
+    expiry_config,
+    expiry_report,
+    expiry_snapshot,
+    expiry_tables,
+    patch_expiry_snapshot,
+)
+from key_index import MasterIndex
+from master_history import MasterHistory
+from master_lock import MasterLock, MasterLockTimeout, StaleMasterError
+from master_schema import (
+    MASTER_SCHEMA,
+    child_references,
+    conform_queue,
+    enforce_schema,
+    queue_tables,
+    reject_invalid_values,
+    restricts_removal,
+    sheet_columns,
+    sheet_tables,
+    table_names,
+    updated_columns,
+)
+from master_store import ChangeSet, LazyMaster, get_master_store, row_keys
+from queue_reader import (
+    QueueChangedError,
+    iter_sheet_chunks,
+    list_queue_sheets,
+    prefetch_queues,
+    queue_signature,
+    read_queue,
+    read_sheet,
+)
+from rejection_report import RejectionWriter
+from skill_matrix import SkillMatrix, matrix_tables
+from update_plan import UpdatePlan
+from workbook_cache import WorkbookCache
 
 # --- CONFIGURATION FOR RELATIVE PATHS ---
 
@@ -18,16 +59,150 @@ archive_dir = os.path.join(project_root, "Archive")
 master_db_path = os.path.join(data_dir, "Master_Database.xlsx")
 update_queue_path = os.path.join(data_dir, "update_queue.xlsx")
 
+# --- MASTER SCHEMA CONFIGURATION ---
+# Tables, keys, dtypes, foreign keys/cascades and the queue sheets of this
+# deployment (see master_schema); demo_etl_engine runs the same engine on its own.
+schema = MASTER_SCHEMA
+
+# --- MASTER STORE CONFIGURATION ---
+# "parquet" keeps one columnar file per master table in Data/Master_Store (primary store).
+# "sqlite" keeps the tables in Master_Database.sqlite with declared keys and cascades.
+# "excel" keeps the legacy single Master_Database.xlsx workbook.
+master_store_backend = "parquet"
+master_store_dir = os.path.join(data_dir, "Master_Store")
+master_sqlite_path = os.path.join(data_dir, "Master_Database.sqlite")
+# Refresh Master_Database.xlsx as a human-readable export after every commit
+export_master_excel = False
+# Keep the key indexes on disk next to the store so the next run skips rebuilding them
+persist_key_index = False
+master_index_path = os.path.join(data_dir, "Master_Index.pkl")
+# Write-ahead journal of the run being committed (see commit_journal); a run
+# that finds one left behind completes or rolls back the interrupted commit
+commit_journal_path = os.path.join(data_dir, "Commit_Journal.json")
+# Advisory lock held from the master load to the commit (see master_lock), so
+# several queue processors can run on this host without losing each other's
+# changes; seconds to wait for it (None = indefinitely, 0 = fail at once)
+master_lock_path = os.path.join(data_dir, "Master_Database.lock")
+master_lock_timeout = 600
+# Rejected queue rows are written as they are found to
+# Archive/rejected_records_<timestamp>/<Sheet>.<format> (see rejection_report),
+# "parquet" or "csv"; optionally also exported as one workbook for Excel users
+rejection_report_format = "parquet"
+rejection_excel_export = False
+# After every run that changes them, the certifications not yet expired are
+# saved with their expiry dates to this Parquet file (None = off; see
+# expiry_index); read_expiry_report() lists the ones expiring within these
+# windows (days) as of the day it is called
+expiry_report_path = os.path.join(data_dir, "Certification_Expiry.parquet")
+expiry_report_days = (30, 60, 90)
+# Export each run's per-phase timings and per-sheet row counts (None = off),
+# e.g. os.path.join(archive_dir, "etl_metrics.jsonl") and a node_exporter
+# textfile-collector path ending in .prom
+metrics_jsonl_path = None
+metrics_prometheus_path = None
+# Batch mode (process_update_batch) picks up every workbook or CSV/Parquet
+# directory in Data/ whose name matches this pattern
+queue_file_pattern = "update_queue*"
+# Archive replay (replay_archived_queues) parses the upcoming archived queues
+# in this many background processes while the current one is applied (0 = none)
+replay_workers = 1
+# Parse workbook sheets in this many worker processes (None = serially). Applies
+# to update queues and to the master when it is kept in Excel; pays off once
+# sheets are large enough that parsing outweighs the worker start-up cost.
+parse_workers = None
+# Excel master only: keep parsed sheets in this directory and reuse them while
+# the workbook is unchanged (None = always reparse); at most this many versions
+workbook_cache_dir = os.path.join(data_dir, "Workbook_Cache")
+workbook_cache_entries = 8
+# Keep every version of the master so it can be read as of any past time
+# (master_as_of; None = off). File stores append per-commit Parquet deltas and
+# a snapshot every `history_snapshot_every` commits of a table here (see
+# master_history); the SQLite store keeps <Table>_History tables instead.
+history_dir = os.path.join(data_dir, "History")
+history_snapshot_every = 20
+
+
+def build_master_store():
+    """Creates the master store described by the configuration above."""
+    cache = None
+    if workbook_cache_dir:
+        cache = WorkbookCache(workbook_cache_dir, workbook_cache_entries)
+    return get_master_store(
+        master_store_backend,
+        master_db_path,
+        master_store_dir,
+        master_sqlite_path,
+        schema=schema,
+        parse_workers=parse_workers,
+        workbook_cache=cache,
+        history=history_dir is not None,
+    )
+
+
+def build_master_history():
+    """The history of a file store (None if off or kept by the store itself)."""
+    if history_dir is None or hasattr(master_store, "as_of"):
+        return None
+    try:
+        import pyarrow  # noqa: F401 -- history files are Parquet
+    except ImportError:
+        print("WARNING: No Parquet engine installed (pyarrow). Master history is off.")
+        return None
+    return MasterHistory(history_dir, schema, history_snapshot_every)
+
+
+master_store = build_master_store()
+master_history = build_master_history()
+
 print(f"Project Base Directory set to :{project_root}")
 print(f"Data Directory set to :{data_dir}")
 print(f"Archive Directory set to :{archive_dir}")
 print(f"Master Database Path set to :{master_db_path}")
-
-
-def initialize_master_database():  # <--- Master Data Base initialization
-    """Creates the master_database.xlsx with all three required sheets and initial data."""
-
-    print("Master Database not found. Creating a template file with initial data...")
+print(f"Master Store backend set to :{type(master_store).__name__}")
+
+
+def configure_paths(root, backend=None, master_schema=None, deployment=None):
+    """Points the engine at another project directory (with Data/ and Archive/ under it).
+
+    Used by tools such as the benchmark that run the ETL against scratch copies,
+    and by other deployments that pass their own schema config. A `deployment`
+    keeps every file of its own (queue, master, lock, key index, parse cache,
+    journal, history, expiry report, archive) in Data/<deployment>/ and
+    Archive/<deployment>/, apart from other deployments sharing the directory.
+    """
+    global project_root, data_dir, archive_dir, master_db_path, update_queue_path
+    global master_store_backend, master_store_dir, master_sqlite_path
+    global master_index_path, workbook_cache_dir, master_store, schema
+    global commit_journal_path, master_lock_path, expiry_report_path, _skill_matrix
+    global history_dir, master_history
+
+    project_root = root
+    data_dir = os.path.join(project_root, "Data")
+    archive_dir = os.path.join(project_root, "Archive")
+    if deployment is not None:
+        data_dir = os.path.join(data_dir, deployment)
+        archive_dir = os.path.join(archive_dir, deployment)
+    master_db_path = os.path.join(data_dir, "Master_Database.xlsx")
+    update_queue_path = os.path.join(data_dir, "update_queue.xlsx")
+    master_store_backend = backend or master_store_backend
+    master_store_dir = os.path.join(data_dir, "Master_Store")
+    master_sqlite_path = os.path.join(data_dir, "Master_Database.sqlite")
+    master_index_path = os.path.join(data_dir, "Master_Index.pkl")
+    commit_journal_path = os.path.join(data_dir, "Commit_Journal.json")
+    master_lock_path = os.path.join(data_dir, "Master_Database.lock")
+    if expiry_report_path is not None:
+        expiry_report_path = os.path.join(data_dir, "Certification_Expiry.parquet")
+    workbook_cache_dir = os.path.join(data_dir, "Workbook_Cache")
+    if history_dir is not None:
+        history_dir = os.path.join(data_dir, "History")
+    schema = master_schema or schema
+    master_store = build_master_store()
+    master_history = build_master_history()
+    _skill_matrix = None
+
+
+def seed_master_tables():
+    """The four master tables with their initial data (the template master)."""
     sheets = []
 
     # 1. Employees Sheet Data
@@ -93,25 +268,35 @@ def initialize_master_database():  # <--- Master Data Base initialization
 
     map_df = pd.DataFrame(map_data)
     sheets.append(("Employee_Skills_Map", map_df))
+    return dict(sheets)
+
+
+def initialize_master_database():  # <--- Master Data Base initialization
+    """Creates the Master Store with all four required tables and initial data."""
 
-    # Write all dataframes to the single excel file.
+    print("Master Database not found. Creating a template file with initial data...")
+
+    # Write all dataframes to the configured master store.
     try:
-        # use openpyxl engine to handle the modern excel format
-        with pd.ExcelWriter(master_db_path, engine="openpyxl") as writer:
-            for name, df in sheets:
-                df.to_excel(writer, sheet_name=name, index=False)
-                print(f"SUCCESS: Master Database created at: {master_db_path}")
+        save_master_data(seed_master_tables())
+        print(f"SUCCESS: Master Database created in: {type(master_store).__name__}")
 
     except Exception as e:
         print(f"ERROR: Failed to write the database file: {e}")
 
 
-def load_master_data():
-    """Loads all 4 sheets from the Master Database for processing."""
+def load_master_data(tables=None, columns=None):
+    """Loads the master tables (all 4 by default) from the Master Store for processing."""
     try:
-        master_dfs = pd.read_excel(
-            master_db_path,
-            sheet_name=["Employees", "Skills", "Teams", "Employee_Skills_Map"],
+        # One-off migration: seed the columnar store from an existing workbook
+        if not master_store.exists() and os.path.exists(master_db_path):
+            print(
+                "Master Store not found. Importing tables from Master_Database.xlsx..."
+            )
+            master_store.import_excel(master_db_path)
+        # Declared dtypes are enforced once here, not re-converted in every step
+        master_dfs = enforce_schema(
+            master_store.load(tables=tables, columns=columns), schema
         )
         return master_dfs
     except FileNotFoundError:
@@ -122,317 +307,1380 @@ def load_master_data():
         return None
 
 
-# --- PHASE 2 CORE ETL LOGIC ---
+def queue_sheet_names(update_sheets):
+    """Sheets of a read queue that hold rows (empty sheets change nothing)."""
+    return [sheet for sheet, df in update_sheets.items() if not df.empty]
 
 
-def process_all_updates():
-    """Reads all update sheets, processes romals first, then additions, and updates the master database."""
-    print("\n--- Processing all updates ---")
+def load_queue_master(sheet_names):
+    """Loads the master tables the queue sheets `sheet_names` need (see queue_tables).
 
-    # 1. Load master and Update Data
-    try:
-        master = load_master_data()
-        # Read all sheets in a Update Queue, even if some are empty
-        update_sheets = pd.read_excel(update_queue_path, sheet_name=None)
-    except FileNotFoundError:
-        print(
-            f"ERROR: Update Queue file not found at {update_queue_path}. Please ensure it exists."
-        )
+    Any other table is loaded only if something asks for it (a LazyMaster),
+    so e.g. applying a queue of team updates never reads the training map.
+    Returns None if the master cannot be loaded.
+    """
+    master = load_master_data(tables=queue_tables(sheet_names, schema))
+    if master is None:
+        return None
+
+    def load(name):
+        return enforce_schema(master_store.load(tables=[name]), schema)[name]
+
+    return LazyMaster(master, load, table_names(schema))
+
+
+def load_key_index(master):
+    """Returns the persisted key index when it still matches the store, else a new one.
+
+    A new index builds each of its indexes from `master` when a step first
+    uses it, so a run only indexes the tables and columns its queue needs.
+    """
+    fingerprint = getattr(master_store, "fingerprint", None)
+    if persist_key_index and fingerprint is not None:
+        index = MasterIndex.load(master_index_path, fingerprint(), master)
+        if index is not None:
+            print("  - Reusing persisted key index.")
+            return index
+    return MasterIndex(schema, master)
+
+
+def save_key_index(master):
+    """Persists a key index matching the row order just written to the store.
+
+    Only runs that loaded every table can build it.
+    """
+    fingerprint = getattr(master_store, "fingerprint", None)
+    if not persist_key_index or fingerprint is None:
         return
-    except Exception as e:
-        print(f"ERROR during initial data load: {e}")
+    if isinstance(master, LazyMaster) and not master.complete:
         return
+    stored = {name: df.reset_index(drop=True) for name, df in master.items()}
+    MasterIndex.build(stored, schema).save(master_index_path, fingerprint())
 
-    # Initialize list to hold rejected records
-    rejected_records = []
 
-    # --- CRITICAL FIX: Initialize removal ID lists ---
-    remove_ids = []  # For Employee ACF2_IDs
-    remove_skills = []  # For Skill Skill_IDs
+def master_lock():
+    """The advisory lock every run holds from the master load to the commit."""
+    return MasterLock(master_lock_path, master_lock_timeout)
 
-    # --------------------------------------------------------------------
-    # Step 2: PROCESS REMOVALS (Prioritized for data hygiene)
-    # --------------------------------------------------------------------
 
-    print("\n[STEP 2/4] Processing REMOVALS...")
-
-    # a. Remove Employees (Requires cascade removal from map)
-    if (
-        master is not None
-        and "Remove_Employee" in update_sheets
-        and not update_sheets["Remove_Employee"].empty
-    ):
-        df_rem_emp = update_sheets["Remove_Employee"].dropna(subset=["ACF2_ID"])
-        remove_ids = df_rem_emp["ACF2_ID"].astype(str).unique()
-        if "Employees" in master:
-            master["Employees"] = master["Employees"][
-                ~master["Employees"]["ACF2_ID"].isin(remove_ids)
-            ]
-        else:
-            print(
-                "ERROR: 'Employees' sheet not found in master database. Skipping employee removal."
+def master_version():
+    """Version of the stored master (None for stores that commit in SQL)."""
+    fingerprint = getattr(master_store, "fingerprint", None)
+    if fingerprint is None or not master_store.exists():
+        return None
+    return fingerprint()
+
+
+def check_master_version(loaded_version):
+    """Raises StaleMasterError if the master was rewritten since it was loaded.
+
+    The lock keeps runs of this engine apart; this catches writers that do not
+    take it (e.g. the workbook saved from Excel) before they are overwritten.
+    """
+    if master_version() != loaded_version:
+        raise StaleMasterError(
+            "Master Database changed on disk since it was loaded; nothing was committed."
+        )
+
+
+def check_queues_unchanged(signatures):
+    """Raises QueueChangedError if a queue was rewritten or replaced since it was read.
+
+    `signatures` maps each queue path to its queue_signature() when read.
+    Checked just before the commit archives the queues, so a queue saved
+    over one being applied stays in Data/ for the next run.
+    """
+    for queue_path, signature in signatures.items():
+        if queue_signature(queue_path) != signature:
+            raise QueueChangedError(
+                f"Update Queue {queue_path} changed since it was read; nothing was committed."
             )
-    elif master is None:
-        print("ERROR: Master data not loaded, cannot process removals.")
-    # Cascade: Remove training records from removed employees
-    master["Employee_Skills_Map"] = master["Employee_Skills_Map"][
-        ~master["Employee_Skills_Map"]["ACF2_ID"].isin(remove_ids)
-    ]
-    print(
-        f"  - Removed {len(remove_ids)} employee(s) and their associated training records."
+
+
+def save_master_data(master, changes=None):
+    """Writes the master tables (only the changed ones with a ChangeSet) to the Master Store."""
+    master_store.save(master, changes)
+    if master_history is not None:
+        master_history.record(master, changes)
+    if export_master_excel:
+        master_store.export_excel(master_db_path)
+
+
+def master_as_of(when, tables=None):
+    """The master tables as they were at `when` (a datetime or date string).
+
+    Reads the history directly: the last snapshot before `when` plus at most
+    `history_snapshot_every` deltas per table, never a replay of every queue.
+    """
+    as_of = getattr(master_store, "as_of", None)
+    if as_of is None:
+        if master_history is None:
+            raise ValueError("Master history is off (history_dir is None).")
+        as_of = master_history.as_of
+    return enforce_schema(as_of(when, tables), schema)
+
+
+# --- PHASE 2 CORE ETL LOGIC ---
+# The queue sheets, their order and their validation rules all come from the
+# schema config (see master_schema): every sheet is one of four generic
+# operations over a master table, so the same code serves every deployment.
+
+
+def record_changes(changes, kind, table, df):
+    """Records the keys of `df` rows as inserted/updated/deleted in `table`."""
+    keys = row_keys(df, schema["tables"][table]["key"])
+    getattr(changes, f"record_{kind}")(table, keys)
+
+
+def table_label(table):
+    return schema["tables"][table]["label"]
+
+
+def contains(index, table, values):
+    """Boolean Series over `values`: does each key exist in `table`?"""
+    return pd.Series(index.contains(table, values), index=values.index)
+
+
+def missing_references(index, table, df, reasons, columns=None):
+    """Masks in the reason of every row whose foreign keys have no parent row.
+
+    Empty foreign-key cells are not checked. The first reference declared for
+    the table wins when several are missing.
+    """
+    references = list(schema["tables"][table].get("references", {}).items())
+    for column, ref in reversed(references):
+        if column not in df or (columns is not None and column not in columns):
+            continue
+        values = df[column]
+        missing = values.notna() & ~contains(index, ref["table"], values)
+        reasons = reasons.mask(missing, ref["missing"])
+    return reasons
+
+
+def remove_rows(master, spec, df, index, changes, log):
+    """Removes rows by key, cascading to (or restricted by) referencing tables.
+
+    Returns (master rows removed, rejected rows).
+    """
+    table = spec["table"]
+    key = schema["tables"][table]["key"][0]
+    keys = df[key].unique()
+    children = child_references(table, schema)
+
+    # Validation: nothing may still reference the rows of a restricted table
+    linked = sum(
+        index.reference_count(child, column, keys)
+        for child, column, ref in children
+        if ref["on_delete"] == "restrict"
     )
+    if linked:
+        log(
+            f"  - WARNING: Cannot remove {len(keys)} {table_label(table)}(s) as {linked} linked row(s) still reference them."
+        )
+        # The whole sheet is skipped; in production you'd reject the transaction
+        return 0, df.iloc[0:0]
+
+    removed = index.drop(master, table, index.labels(table, keys))
+    record_changes(changes, "delete", table, removed)
+    rows_out = len(removed)
+    cascades = []
+    for child, column, ref in children:
+        if ref["on_delete"] != "cascade":
+            continue
+        # CASCADE: also catches orphaned legacy rows whose parent is already gone
+        removed = index.drop(master, child, index.referencing(child, column, keys))
+        record_changes(changes, "delete", child, removed)
+        if len(removed):
+            changes.record_cascade(table, child, len(removed))
+        rows_out += len(removed)
+        cascades.append(f" and their associated {table_label(child)}s")
+    log(f"  - Removed {len(keys)} {table_label(table)}(s){''.join(cascades)}.")
+    return rows_out, df.iloc[0:0]
+
+
+def add_rows(master, spec, df, index, changes, log):
+    """Appends rows with new keys whose foreign keys exist.
+
+    Returns (rows added, rejected rows with their Reason).
+    """
+    table = spec["table"]
+    key_cols = schema["tables"][table]["key"]
+    if len(key_cols) == 1:
+        keys = df[key_cols[0]]
+    else:
+        keys = pd.Series(
+            list(zip(*(df[col].tolist() for col in key_cols))),
+            index=df.index,
+            dtype="object",
+        )
 
-    # b. Remove Skills (Requires cascade removal from map)
-
-    if (
-        master is not None
-        and "Remove_Skill" in update_sheets
-        and not update_sheets["Remove_Skill"].empty
-    ):
-        df_rem_skill = update_sheets["Remove_Skill"].dropna(subset=["Skill_ID"])
-        remove_skills = df_rem_skill["Skill_ID"].astype(str).unique()
-        if "Skills" in master:
-            master["Skills"] = master["Skills"][
-                ~master["Skills"]["Skill_ID"].isin(remove_skills)
-            ]
-        else:
-            print(
-                "ERROR: 'Skills' sheet not found in master database. Skipping skill removal."
-            )
-    elif master is None:
-        print("ERROR: Master data not loaded, cannot process removals.")
+    # Columnar validation: every check is one mask over the whole batch
+    is_existing = contains(index, table, keys)
+    reasons = missing_references(
+        index, table, df, pd.Series(None, index=df.index, dtype="object")
+    )
+    # A repeat of a key that an earlier row of this batch already adds
+    candidate = ~is_existing & reasons.isna()
+    added_earlier = (
+        candidate.astype(int).groupby(pd.factorize(keys)[0]).cumsum() - candidate
+    ) > 0
+    # The duplicate check wins over the reference checks
+    reasons = reasons.mask(is_existing | added_earlier, spec["duplicate"])
+    is_rejected = reasons.notna()
+
+    valid_adds = df[~is_rejected]
+    record_changes(changes, "insert", table, valid_adds)
+    index.append(master, table, valid_adds)
+    log(
+        f"  - Added {len(valid_adds)} new {table_label(table)}(s). Rejected {is_rejected.sum()} duplicates/invalid entries."
+    )
+    return len(valid_adds), df[is_rejected].assign(Reason=reasons[is_rejected])
 
-    # c. Remove Teams
-    if "Remove_Team" in update_sheets and not update_sheets["Remove_Team"].empty:
-        df_rem_team = update_sheets["Remove_Team"].dropna(subset=["Team_ID"])
-        remove_team_ids = df_rem_team["Team_ID"].astype(str).unique()
 
-        # Validation: Check if any active employees belong to these teams
-        active_employees_on_team = master["Employees"][
-            master["Employees"]["Team_ID"].isin(remove_team_ids)
-        ]
+def apply_keyed_updates(master, spec, updates, index, changes, log):
+    """Merges an update sheet into its master table by key.
 
-        if not active_employees_on_team.empty:
-            print(
-                f"  - WARNING: Cannot remove {len(remove_team_ids)} team(s) as {len(active_employees_on_team)} active employees still linked."
-            )
-            # For simplicity, we just won't remove them. In production , you'd reject the transaction
-        else:
-            master["Teams"] = master["Teams"][
-                ~master["Teams"]["Team_ID"].isin(remove_team_ids)
-            ]
-            print(f"   - Removed {len(remove_team_ids)} teams(s).")
-
-    # Cascade: Remove training records for removed skills
-    master["Employee_Skills_Map"] = master["Employee_Skills_Map"][
-        ~master["Employee_Skills_Map"]["Skill_ID"].isin(remove_skills)
+    Only non-null cells overwrite the master, and for repeated keys the last
+    non-null value of each column wins, exactly as applying the rows one by
+    one would. Key columns themselves are never updated; use a removal plus an
+    addition to re-key a row. Returns (rows updated, rejected rows).
+    """
+    table = spec["table"]
+    key = schema["tables"][table]["key"][0]
+    columns = [
+        col for col in spec["columns"] if col in updates and col in master[table]
     ]
-    print(
-        f"  - Removed {len(remove_skills)} skill(s) and their associated training records."
+
+    # A changed foreign key must point at an existing row; an unknown key wins
+    reasons = missing_references(
+        index,
+        table,
+        updates,
+        pd.Series(None, index=updates.index, dtype="object"),
+        columns,
     )
+    reasons = reasons.mask(~contains(index, table, updates[key]), spec["not_found"])
+    is_rejected = reasons.notna()
+    rejected = updates[is_rejected].assign(Reason=reasons[is_rejected])
+
+    valid = updates[~is_rejected]
+    num_updated = 0
+    if not valid.empty and columns:
+        # groupby().last() keeps the last non-null value per column and key
+        patch = valid.groupby(key, sort=False)[columns].last()
+        labels = index.labels(table, patch.index)
+        current = master[table].loc[labels, columns]
+        merged = patch.set_axis(labels).combine_first(current)[columns]
+
+        record_changes(changes, "update", table, current.assign(**{key: patch.index}))
+        index.assign(master, table, labels, merged)
+        num_updated = len(labels)
+    log(
+        f"  - Updated {num_updated} {table_label(table)}(s) with new information. Rejected {len(rejected)} invalid updates."
+    )
+    return num_updated, rejected
 
-    # --------------------------------------------------------------------
-    # Step 3: PROCESS ADDITIONS & UPDATES (Including validation)
-    # --------------------------------------------------------------------
 
-    print("\n[STEP 3/4] Processing ADDITIONS & UPDATES...")
+def upsert_rows(master, spec, df, index, changes, log):
+    """Adds rows whose foreign keys exist, overwriting any row with the same key.
 
-    # a. Add Teams
-    if "Add_Team" in update_sheets and not update_sheets["Add_Team"].empty:
-        new_teams = update_sheets["Add_Team"].dropna(
-            subset=[
-                "Team_ID",
-                "Team_Name",
-            ]
+    Returns (rows added or overwritten, rejected rows with their Reason).
+    """
+    table = spec["table"]
+    key_cols = schema["tables"][table]["key"]
+    # Validate the whole batch against the current keys in one pass
+    reasons = missing_references(
+        index, table, df, pd.Series(None, index=df.index, dtype="object")
+    )
+    is_rejected = reasons.notna()
+
+    # Last row wins for repeated keys within the queue
+    upserts = df[~is_rejected].drop_duplicates(subset=key_cols, keep="last")
+    if not upserts.empty:
+        # Remove the old rows for the same keys (Update/Overwrite) through the
+        # key indexes instead of one full-table mask per row
+        superseded = index.drop(
+            master, table, index.key_labels(table, row_keys(upserts, key_cols))
+        )
+        # Superseded keys net out to updates in the change set
+        record_changes(changes, "delete", table, superseded)
+        record_changes(changes, "insert", table, upserts)
+        index.append(master, table, upserts)
+    log(
+        f"  - Added/Updated {len(upserts)} {table_label(table)}s. Rejected {is_rejected.sum()} invalid entries."
+    )
+    return len(upserts), df[is_rejected].assign(Reason=reasons[is_rejected])
+
+
+SHEET_OPERATIONS = {
+    "remove": remove_rows,
+    "add": add_rows,
+    "update": apply_keyed_updates,
+    "upsert": upsert_rows,
+}
+
+
+def apply_updates_to_master(
+    master, update_sheets, changes=None, verbose=True, index=None, metrics=None
+):
+    """Applies removals first, then additions/updates, to the in-memory master tables.
+
+    The sheets are applied in the schema config's order. `master` is modified
+    in place; the rejected queue rows are returned as {sheet: DataFrame}, with
+    their Reason and indexed by their position in the sheet.
+    Row-level deltas are recorded into `changes` (a ChangeSet) when given.
+    `index` is the MasterIndex kept in step with `master`; pass the same one
+    across calls (e.g. queue chunks) to avoid rebuilding it.
+    `verbose=False` silences the per-step log (used when applying queue chunks).
+    Per-sheet timings and rows in/out/rejected are added to `metrics` (a RunMetrics).
+    """
+    if changes is None:
+        changes = ChangeSet(table_names(schema))
+    if index is None:
+        index = MasterIndex(schema, master)
+    if metrics is None:
+        metrics = RunMetrics()
+    log = print if verbose else (lambda *args, **kwargs: None)
+    metrics.start_lap()
+
+    # Rejected rows of every sheet, kept as DataFrames (see rejection_report)
+    rejections = {}
+
+    # Step 2: PROCESS REMOVALS (Prioritized for data hygiene), then
+    # Step 3: PROCESS ADDITIONS & UPDATES (Including validation)
+    log("\n[STEP 2/4] Processing REMOVALS...")
+    removing = True
+    for spec in schema["sheets"]:
+        if removing and spec["op"] != "remove":
+            log("\n[STEP 3/4] Processing ADDITIONS & UPDATES...")
+            removing = False
+        sheet = spec["sheet"]
+        df = update_sheets.get(sheet)
+        if df is None or df.empty:
+            continue
+        df, invalid = reject_invalid_values(
+            df.dropna(subset=sheet_columns(spec, schema)), spec["table"], schema
         )
-        new_teams["Team_ID"] = new_teams["Team_ID"].astype(str)
-        existing_ids = set(master["Teams"]["Team_ID"].astype(str).values)
-
-        valid_adds = new_teams[~new_teams["Team_ID"].isin(existing_ids)]
-        rejected_records.extend(
-            new_teams[new_teams["Team_ID"].isin(existing_ids)]
-            .assign(Reason="Duplicate Team_ID")
-            .to_dict("records")
+        if not invalid.empty:
+            log(f"  - Rejected {len(invalid)} {sheet} row(s) with invalid values.")
+        # Key columns are typed like the master once per sheet, up front
+        df = conform_queue(df, schema)
+        apply = SHEET_OPERATIONS[spec["op"]]
+        rows_out, rejected = apply(master, spec, df, index, changes, log)
+        if not invalid.empty:
+            rejected = pd.concat([invalid, rejected]).sort_index()
+        if not rejected.empty:
+            rejections[sheet] = rejected
+        # Time since the previous sheet step is charged to this sheet
+        metrics.record_sheet(
+            sheet,
+            len(update_sheets[sheet]),
+            rows_out,
+            len(rejected),
+            updated_columns(spec, df),
         )
 
-        master["Teams"] = pd.concat([master["Teams"], valid_adds], ignore_index=True)
-        print(
-            f"  - Added {len(valid_adds)} new team(s). Rejected {len(new_teams) - len(valid_adds)} duplicates."
+    return rejections
+
+
+def apply_update_queue_in_chunks(
+    queue_path,
+    chunk_size,
+    rejections,
+    master=None,
+    changes=None,
+    index=None,
+    metrics=None,
+    commit_id=None,
+    on_commit=None,
+):
+    """Streams the queue sheet by sheet in bounded chunks and applies each chunk.
+
+    Sheets are visited in the schema config's order, so the final master and
+    the rejections match the batch path. Restricted removals (e.g. Remove_Team)
+    are read whole because their "nothing still linked" check covers the sheet
+    as a unit. Each chunk's rejected rows go straight to `rejections` (a
+    RejectionWriter). With `master=None` the store applies every chunk itself
+    (SQLite), all in one transaction that records `commit_id` and runs
+    `on_commit()` before committing.
+    """
+    present = set(list_queue_sheets(queue_path))
+    totals = {}  # sheet -> [rows streamed, rows rejected]
+
+    def chunks():
+        for spec in schema["sheets"]:
+            sheet = spec["sheet"]
+            if sheet not in present:
+                continue
+            if restricts_removal(spec, schema):
+                sheet_chunks = [read_sheet(queue_path, sheet)]
+            else:
+                sheet_chunks = iter_sheet_chunks(queue_path, sheet, chunk_size)
+            for chunk in sheet_chunks:
+                totals.setdefault(sheet, [0, 0])[0] += len(chunk)
+                yield {sheet: chunk}
+
+    def write(chunk_rejections):
+        rejections.add(chunk_rejections)
+        for sheet, rejected in chunk_rejections.items():
+            totals[sheet][1] += len(rejected)
+
+    if master is None:
+        master_store.apply_update_batch(
+            chunks(),
+            verbose=False,
+            metrics=metrics,
+            commit_id=commit_id,
+            on_commit=on_commit,
+            on_applied=lambda position, chunk_rejections: write(chunk_rejections),
         )
+    else:
+        for update_sheets in chunks():
+            write(
+                apply_updates_to_master(
+                    master,
+                    update_sheets,
+                    changes,
+                    verbose=False,
+                    index=index,
+                    metrics=metrics,
+                )
+            )
+
+    for sheet, (rows, rejected) in totals.items():
+        print(f"  - {sheet}: streamed {rows} row(s), rejected {rejected}.")
+
 
-    # Update Teams (Manager, Team_Name)
-    if "Update_Team" in update_sheets and not update_sheets["Update_Team"].empty:
-        updates = update_sheets["Update_Team"].dropna(subset=["Team_ID"])
-        updates["Team_ID"] = updates["Team_ID"].astype(str)
-
-        # Identify teams that exist in the master and need updating
-        existing_teams_to_update = master["Teams"][
-            master["Teams"]["Team_ID"].isin(updates["Team_ID"])
-        ]
-
-        # Apply updates to the existing teams
-        for index, row in updates.iterrows():
-            team_id = row["Team_ID"]
-            # Update 'Manager' and 'Team_Name' if they are present in the update row
-            if "Manager" in row and pd.notna(row["Manager"]):
-                master["Teams"].loc[
-                    master["Teams"]["Team_ID"] == team_id, "Manager"
-                ] = row["Manager"]
-            if "Team_Name" in row and pd.notna(row["Team_Name"]):
-                master["Teams"].loc[
-                    master["Teams"]["Team_ID"] == team_id, "Team_Name"
-                ] = row["Team_Name"]
-
-        # Identify updates for non-existent teams
-        non_existent_updates = updates[
-            ~updates["Team_ID"].isin(master["Teams"]["Team_ID"])
-        ]
-        rejected_records.extend(
-            non_existent_updates.assign(Reason="Team_ID not found for update").to_dict(
-                "records"
+def export_run_metrics(metrics):
+    """Writes the run metrics to the configured JSON-lines / Prometheus files."""
+    try:
+        if metrics_jsonl_path:
+            metrics.write_jsonl(metrics_jsonl_path)
+        if metrics_prometheus_path:
+            metrics.write_prometheus(metrics_prometheus_path)
+    except Exception as e:
+        print(f"WARNING: Failed to export run metrics: {e}")
+
+
+def write_master_changes(master, changes, native, metrics, committed_at=None):
+    """Stages the dirty master tables/rows (SQLite has already committed),
+    and their history as of `committed_at`."""
+    with metrics.phase("write_master") as record:
+        if native:
+            return
+        if not changes.dirty_tables():
+            print("  - No master table changed. Skipping the master write.")
+            return
+        # Only the dirty tables/rows are written
+        metrics.tables = changes.summary()
+        for name, counts in metrics.tables.items():
+            print(
+                f"  - {name}: {counts['inserted']} inserted, {counts['updated']} updated, {counts['deleted']} deleted."
             )
+            record["rows"] += sum(counts.values())
+        master_store.stage(master, changes)
+        if master_history is not None:
+            master_history.stage(master, changes, committed_at)
+
+
+def rejection_outputs(tag):
+    """Final paths of a run's rejection report and its Excel export (None if off)."""
+    path = unique_archive_path(f"rejected_records_{tag}")
+    excel_path = None
+    if rejection_excel_export:
+        excel_path = unique_archive_path(f"rejected_records_{tag}.xlsx")
+    return path, excel_path
+
+
+def open_rejection_report(path):
+    """A RejectionWriter on the staged path of the report `path`."""
+    return RejectionWriter(staged_path(path), rejection_report_format)
+
+
+def write_rejection_report(rejections, path, excel_path, metrics):
+    """Finishes a staged rejection report (and its Excel export, if configured)."""
+    with metrics.phase("write_rejections") as record:
+        rejections.close()
+        if excel_path and rejections.rows:
+            rejections.export_excel(staged_path(excel_path))
+        record["rows"] += rejections.rows
+    if rejections.rows:
+        print(f"Rejected records written to {path}")
+        print(
+            f"WARNING: {rejections.rows} records were rejected. See Rejected file in Archive."
         )
 
-        # Log the number of updates that actually occurred
-        num_updated = len(existing_teams_to_update)
-        num_rejected = len(updates) - num_updated
+
+def unique_archive_path(name):
+    """Archive/<name>, numbered if a run in the same second already used it.
+
+    Called with the master lock held, so parallel runs cannot pick the same name.
+    """
+    path = os.path.join(archive_dir, name)
+    stem, extension = os.path.splitext(path)
+    number = 1
+    while os.path.exists(path):
+        number += 1
+        path = f"{stem}_{number}{extension}"
+    return path
+
+
+def begin_commit(queues, reports, committed_at):
+    """Journals a run before it applies anything (see commit_journal).
+
+    `queues` are its (queue path, archive path) moves, `reports` the
+    (report, Excel export) paths of rejection_outputs() it may write and
+    `committed_at` the time its history files are recorded under.
+    """
+    outputs = master_store.output_paths()
+    if master_history is not None:
+        outputs += master_history.paths(committed_at)
+    for path, excel_path in reports:
+        outputs += [path] + ([excel_path] if excel_path else [])
+    return CommitJournal(commit_journal_path, outputs, queues).begin()
+
+
+def stage_reports(journal, writers, reports, metrics):
+    """Finishes the staged rejection reports, then marks every output as staged.
+
+    `writers` are the runs' RejectionWriters, in the order of `reports`.
+    """
+    for rejections, (path, excel_path) in zip(writers, reports):
+        write_rejection_report(rejections, path, excel_path, metrics)
+    journal.staged()
+
+
+def finish_commit(journal, master, index, metrics):
+    """Replaces the master files and archives the queues of a staged run."""
+    with metrics.phase("archive"):
+        # None: the store committed the write in its own transaction (replay)
+        if journal is not None:
+            journal.commit()
+            journal.finish()
+    print(f"SUCCESS: Master Database updated in: {type(master_store).__name__}")
+    # Derived files only; all are rebuilt if they go missing or stale
+    if export_master_excel:
+        master_store.export_excel(master_db_path)
+    if master is not None:
+        save_key_index(master)
+    with metrics.phase("expiry_report") as record:
+        try:
+            record["rows"] = write_expiry_report(
+                master, index, changed_columns(metrics.sheets)
+            )
+        except Exception as e:
+            print(f"WARNING: Failed to write the certification expiry report: {e}")
+
+
+def changed_columns(sheets):
+    """{master table: columns} a run changed, from its per-sheet RunMetrics
+    records; the columns are None where rows were added, replaced or removed."""
+    changed = {}
+    for spec in schema["sheets"]:
+        record = sheets.get(spec["sheet"], {})
+        if not record.get("rows_out"):
+            continue
+        for table in sheet_tables(spec, schema):
+            columns = record.get("columns") if table == spec["table"] else None
+            if columns is None or changed.get(table, ()) is None:
+                changed[table] = None
+            else:
+                changed[table] = changed.get(table, set()) | set(columns)
+    return changed
+
+
+def changes_column(changed, table, column):
+    """Did the changed_columns() `changed` touch `column` of `table`?"""
+    return table in changed and (changed[table] is None or column in changed[table])
+
+
+def write_expiry_report(master=None, index=None, changed=None):
+    """Rewrites the stored certification expiry report; returns its row count.
+
+    Uses the run's master and key index, current once it has committed, and
+    loads the master only for runs that kept none in memory (SQLite). With
+    `changed` (see changed_columns), the report is rebuilt only if the run
+    changed the training map. Otherwise a run that moved employees between
+    teams or changed managers patches the Team and Manager of the stored
+    report without reading the map, and any other run leaves it as it is.
+    """
+    config = expiry_config(schema)
+    if not expiry_report_path or config is None:
+        return 0
+    tables = expiry_tables(schema)
+    map_table, employee_table, team_table = tables
+    if changed is not None and map_table not in changed:
+        moved = changes_column(changed, employee_table, config["team"])
+        managed = bool(config.get("manager")) and changes_column(
+            changed, team_table, config["manager"]
+        )
+        if not (moved or managed):
+            return 0
+        if os.path.exists(expiry_report_path):
+            tables = [employee_table, team_table] if moved else [team_table]
+            return patch_expiry_report(master, index, tables, moved)
+    if master is not None and index is not None:
+        for table in tables:
+            master[table]  # a LazyMaster loads what it lacks
+    else:
+        master = load_master_data(tables=list(tables))
+        if master is None:
+            return 0
+        index = MasterIndex.build(master, schema)
+    snapshot = expiry_snapshot(master, index, schema=schema)
+    save_expiry_report(snapshot)
+    due = len(expiry_report(snapshot, expiry_report_days))
+    if due:
         print(
-            f"  - Updated {num_updated} team(s) with new information. Rejected {num_rejected} updates for non-existent teams."
+            f"  - {due} certification(s) expire within {max(expiry_report_days)} days. See read_expiry_report()"
         )
+    return len(snapshot)
+
+
+def patch_expiry_report(master, index, tables, teams):
+    """Joins the stored report's Team (if `teams`) and Manager again to the
+    master `tables`; returns its row count."""
+    if master is None or index is None:
+        master = load_master_data(tables=tables)
+        if master is None:
+            return 0
+        index = MasterIndex(schema, master)
+    snapshot = patch_expiry_snapshot(
+        pd.read_parquet(expiry_report_path), master, index, teams, schema
+    )
+    save_expiry_report(snapshot)
+    return len(snapshot)
 
-    # b. Add New Employees (Validation: Employee ID unique, Team ID exists)
-    if "Add_Employee" in update_sheets and not update_sheets["Add_Employee"].empty:
-        new_employees = update_sheets["Add_Employee"].dropna(
-            subset=["ACF2_ID", "First_Name", "Last_Name", "Team_ID"]
-        )
-        existing_ids = set(master["Employees"]["ACF2_ID"].astype(str).values)
-        current_team_ids = set(master["Teams"]["Team_ID"].astype(str).values)
 
-        valid_adds = []
+def save_expiry_report(snapshot):
+    """Replaces the stored expiry report with `snapshot`, atomically."""
+    os.makedirs(os.path.dirname(expiry_report_path), exist_ok=True)
+    staged = staged_path(expiry_report_path)
+    snapshot.to_parquet(staged, index=False)
+    fsync_path(staged)
+    commit_files([(staged, expiry_report_path)])
 
-        for index, row in new_employees.iterrows():
-            if row["ACF2_ID"] in existing_ids:
-                row["Reason"] = "Duplicate ACF2_ID"
-                rejected_records.append(row.to_dict())
-                continue
-            if row["Team_ID"] not in current_team_ids:
-                row["Reason"] = "Team ID does not exist in Master Teams."
-                rejected_records.append(row.to_dict())
-                continue
-            valid_adds.append(row)
 
-        if valid_adds:
-            df_valid_adds = pd.DataFrame(valid_adds)
-            master["Employees"] = pd.concat(
-                [master["Employees"], df_valid_adds], ignore_index=True
-            )
-            print(f"  - Added {len(df_valid_adds)} new employee(s).")
+def read_expiry_report(today=None):
+    """Certifications expiring within expiry_report_days of `today` (default:
+    now), from the stored expiry report, with their Days_Left and Window_Days."""
+    if not expiry_report_path or not os.path.exists(expiry_report_path):
+        return None
+    snapshot = pd.read_parquet(expiry_report_path)
+    return expiry_report(snapshot, expiry_report_days, today)
+
+
+def abandon_commit(journal, writers=()):
+    """Rolls back a run that failed before its commit point."""
+    for rejections in writers:
+        rejections.close()
+    journal.roll_back()
+    journal.finish()
+
+
+def recover_interrupted_run():
+    """Completes or rolls back a run that stopped mid-commit (e.g. a crash).
+
+    A run past its commit point is rolled forward: its staged files replace
+    the master and its queues are archived. Otherwise its staged files are
+    deleted and its queues stay in Data/ to be applied again. Returns
+    "rolled_forward", "rolled_back", or None if no run was interrupted.
+    """
+    journal = CommitJournal.load(commit_journal_path)
+    if journal is None:
+        return None
+    has_commit = getattr(master_store, "has_commit", None)
+    if has_commit is not None:
+        # Committed in the store's own transaction, together with the journal id
+        committed = has_commit(journal.commit_id)
+    else:
+        committed = journal.state == "staged"
+    if committed:
+        print(f"WARNING: Completing the commit of interrupted run {journal.commit_id}.")
+        journal.commit()
+        outcome = "rolled_forward"
+    else:
+        print(
+            f"WARNING: Rolled back interrupted run {journal.commit_id}; its Update Queue(s) will be applied again."
+        )
+        journal.roll_back()
+        outcome = "rolled_back"
+    journal.finish()
+    return outcome
+
+
+def process_all_updates(queue_path=None, chunk_size=None, metrics=None):
+    """Reads all update sheets, processes romals first, then additions, and updates the master database.
+
+    `queue_path` defaults to Data/update_queue.xlsx; a directory of <Sheet>.csv or
+    <Sheet>.parquet files is accepted too. With `chunk_size` the queue is streamed
+    in chunks of that many rows instead of being read into memory at once.
+    The master, the rejection report and the archived queue are committed
+    together through a write-ahead journal, so a crash at any point leaves the
+    previous master or the new one, never a mix (see commit_journal).
+    Returns the run's RunMetrics (pass one in to attach hooks).
+    """
+    print("\n--- Processing all updates ---")
+    queue_path = queue_path or update_queue_path
+    streaming = chunk_size is not None
+    if metrics is None:
+        metrics = RunMetrics()
+    metrics.store = type(master_store).__name__
+    metrics.queue_path = queue_path
+
+    def failed(error):
+        export_run_metrics(metrics.finish("failed", error))
+        return metrics
+
+    # 1. Read the Update Queue (outside the lock, so parallel runs parse at once)
+    try:
+        if not os.path.exists(queue_path):
+            raise FileNotFoundError(queue_path)
+        update_sheets = signature = None
+        if not streaming:
+            # Read all sheets in a Update Queue, even if some are empty
+            with metrics.phase("read_queue") as record:
+                # Taken first, so a change during the read shows as well
+                signature = queue_signature(queue_path)
+                update_sheets = read_queue(queue_path, workers=parse_workers)
+                record["rows"] = sum(len(df) for df in update_sheets.values())
+    except FileNotFoundError as e:
         print(
-            f"  - Rejected {len(new_employees) - len(valid_adds)} duplicates/invalid entries."
+            f"ERROR: Update Queue file not found at {queue_path}. Please ensure it exists."
         )
+        return failed(e)
+    except Exception as e:
+        print(f"ERROR during initial data load: {e}")
+        return failed(e)
 
-    # c. Add New Skills
-    if "Add_Skill" in update_sheets and not update_sheets["Add_Skill"].empty:
-        new_skills = update_sheets["Add_Skill"].dropna(
-            subset=["Skill_ID", "Skill_Name"]
+    # Everything from the master load to the commit holds the master lock
+    try:
+        lock = master_lock().acquire()
+    except MasterLockTimeout as e:
+        print(f"ERROR: {e}")
+        return failed(e)
+    try:
+        return apply_and_commit_queue(
+            queue_path, update_sheets, chunk_size, metrics, signature
         )
-        new_skills["Skill_ID"] = new_skills["Skill_ID"].astype(
-            str
-        )  # Enforce a string type
-        existing_skills = set(master["Skills"]["Skill_ID"].values)
-
-        valid_adds = new_skills[~new_skills["Skill_ID"].isin(existing_skills)]
-        rejected_records.extend(
-            new_skills[new_skills["Skill_ID"].isin(existing_skills)]
-            .assign(Reason="Duplicate Skill_ID")
-            .to_dict("records")
+    finally:
+        lock.release()
+
+
+def apply_and_commit_queue(
+    queue_path, update_sheets, chunk_size, metrics, signature=None
+):
+    """Loads the master, applies one queue and commits it; the caller holds the lock.
+
+    `update_sheets` is the queue already read (None to stream it in chunks of
+    `chunk_size` rows) and `signature` its queue_signature() when read. A
+    queue that is no longer the one read (another run archived it while this
+    one waited and a new queue took its path) is read again. Returns the
+    run's RunMetrics.
+    """
+    streaming = chunk_size is not None
+    # The SQLite store enforces keys/cascades itself and applies the queue in SQL
+    native = getattr(master_store, "applies_queue_natively", False)
+
+    def failed(error):
+        export_run_metrics(metrics.finish("failed", error))
+        return metrics
+
+    recover_interrupted_run()
+    if not os.path.exists(queue_path):
+        # Another run applied and archived it while this one waited for the lock
+        print(f"ERROR: Update Queue {queue_path} was already processed by another run.")
+        return failed(FileNotFoundError(queue_path))
+    if streaming:
+        # Streamed from here on, under the lock
+        signature = queue_signature(queue_path)
+    elif queue_signature(queue_path) != signature:
+        print(f"  - {queue_path} changed since it was read. Reading it again...")
+        try:
+            with metrics.phase("read_queue") as record:
+                signature = queue_signature(queue_path)
+                update_sheets = read_queue(queue_path, workers=parse_workers)
+                record["rows"] = sum(len(df) for df in update_sheets.values())
+        except Exception as e:
+            print(f"ERROR: Cannot read Update Queue {queue_path}: {e}")
+            return failed(e)
+    master = version = None
+    if not native:
+        if streaming:
+            sheet_names = list_queue_sheets(queue_path)
+        else:
+            sheet_names = queue_sheet_names(update_sheets)
+        try:
+            with metrics.phase("load_master") as record:
+                version = master_version()
+                master = load_queue_master(sheet_names)
+                record["rows"] = sum(len(df) for df in (master or {}).values())
+        except Exception as e:
+            print(f"ERROR during initial data load: {e}")
+            return failed(e)
+        if master is None:
+            print("ERROR: Master data not loaded, cannot process updates.")
+            return failed("Master data not loaded")
+
+    changes = ChangeSet(table_names(schema))
+    # Key indexes are built (or reloaded) once and maintained through every step
+    index = None
+    if not native:
+        with metrics.phase("build_index") as record:
+            index = load_key_index(master)
+            record["rows"] = sum(len(rows) for rows in index.rows.values())
+
+    committed_at = datetime.now()
+    timestamp = committed_at.strftime("%Y%m%d_%H%M%S")
+    extension = os.path.splitext(queue_path)[1]  # "" for a CSV/Parquet directory
+    archive_path = unique_archive_path(f"PROCESSED_updates_{timestamp}{extension}")
+    reports = [rejection_outputs(timestamp)]
+    journal = begin_commit([(queue_path, archive_path)], reports, committed_at)
+    # Rejected rows are written to the staged report as each step produces them
+    writers = [open_rejection_report(reports[0][0])]
+
+    def stage_native():
+        # Runs inside the SQLite transaction, just before it commits
+        check_queues_unchanged({queue_path: signature})
+        stage_reports(journal, writers, reports, metrics)
+
+    if streaming:
+        print(
+            f"\n[STEP 2-3/4] Streaming the Update Queue in chunks of {chunk_size} rows..."
         )
-
-        master["Skills"] = pd.concat([master["Skills"], valid_adds], ignore_index=True)
+        try:
+            with metrics.phase("apply_updates") as record:
+                apply_update_queue_in_chunks(
+                    queue_path,
+                    chunk_size,
+                    writers[0],
+                    master,
+                    changes,
+                    index,
+                    metrics,
+                    commit_id=journal.commit_id,
+                    on_commit=stage_native if native else None,
+                )
+        except Exception as e:
+            print(f"ERROR: Failed while streaming the Update Queue: {e}")
+            abandon_commit(journal, writers)
+            return failed(e)
+    elif native:
         print(
-            f"  - Added {len(valid_adds)} new skill(s). Rejected: {len(new_skills)-len(valid_adds)} duplicate records"
+            "\n[STEP 2-3/4] Applying REMOVALS, ADDITIONS & UPDATES in one transaction..."
         )
+        try:
+            with metrics.phase("apply_updates") as record:
+                master_store.apply_update_batch(
+                    [update_sheets],
+                    metrics=metrics,
+                    commit_id=journal.commit_id,
+                    on_commit=stage_native,
+                    on_applied=lambda position, rejections: writers[0].add(rejections),
+                )
+        except Exception as e:
+            print(f"ERROR: Update Queue rolled back, Master Database unchanged: {e}")
+            abandon_commit(journal, writers)
+            return failed(e)
+    else:
+        try:
+            with metrics.phase("apply_updates") as record:
+                writers[0].add(
+                    apply_updates_to_master(
+                        master, update_sheets, changes, index=index, metrics=metrics
+                    )
+                )
+        except Exception as e:
+            print(f"ERROR: Failed to apply the Update Queue: {e}")
+            abandon_commit(journal, writers)
+            return failed(e)
+    record["rows"] = sum(sheet["rows_in"] for sheet in metrics.sheets.values())
 
-    # d. Add New Training to Map (The Critical Validation step)
-    if (
-        "Add_Training_Map" in update_sheets
-        and not update_sheets["Add_Training_Map"].empty
-    ):
-        updates = update_sheets["Add_Training_Map"].dropna(
-            subset=["ACF2_ID", "Skill_ID", "Proficiency_Level", "Certification_Date"]
-        )
-        updates["Skill_ID"] = updates["Skill_ID"].astype(
-            str
-        )  # Enforces tha data type to be string
+    # --------------------------------------------------------------------
+    # Step 4: WRITE MASTER DATA, REPORT REJECTIONS, AND ARCHIVE
+    # --------------------------------------------------------------------
+    print("\n[STEP 4/4] Finalizing changes...")
 
-        valid_training_adds = []
+    # Stage the Master Store files and the rejection report (nothing replaced yet)
+    if not native:
+        try:
+            check_master_version(version)
+            check_queues_unchanged({queue_path: signature})
+            write_master_changes(master, changes, native, metrics, committed_at)
+            stage_reports(journal, writers, reports, metrics)
+        except (StaleMasterError, QueueChangedError) as e:
+            print(f"ERROR: {e} The Update Queue stays in Data/ to be applied again.")
+            abandon_commit(journal, writers)
+            return failed(e)
+        except Exception as e:
+            print(
+                f"ERROR: Failed to write to Master Database. Check file permissions: {e}"
+            )
+            abandon_commit(journal, writers)
+            return failed(e)
 
-        # Get current IDs/Skills for validation check
-        current_employee_ids = set(master["Employees"]["ACF2_ID"].values)
-        current_skill_ids = set(master["Skills"]["Skill_ID"].astype(str).values)
+    # Commit: atomic renames over the master files, then archive the queue
+    try:
+        finish_commit(journal, master, index, metrics)
+    except Exception as e:
+        print(f"ERROR: Commit interrupted; it is completed on the next run: {e}")
+        return failed(e)
+    print(f"SUCCESS: Update Queue archived. ETL process finished.")
 
-        for index, row in updates.iterrows():
-            # Validation Check 1 Employee ID must exist
-            if row["ACF2_ID"] not in current_employee_ids:
-                row["Reason"] = "Employee ID does not exist"
-                rejected_records.append(row.to_dict())
+    export_run_metrics(metrics.finish("success"))
+    return metrics
+
+
+def discover_queue_files(directory=None):
+    """Pending queue workbooks/directories in Data/, in file name order.
+
+    Name order keeps batches reproducible, so drop files named like
+    update_queue_<YYYYmmdd_HHMMSS>_<team>.xlsx to apply them oldest first.
+    """
+    directory = directory or data_dir
+    queue_paths = []
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        # "~$" files are Excel lock files of a workbook still open for editing
+        if not fnmatch(name, queue_file_pattern) or name.startswith("~$"):
+            continue
+        if os.path.isdir(path) or name.endswith(".xlsx"):
+            queue_paths.append(path)
+    return queue_paths
+
+
+def process_update_batch(
+    queue_paths=None, metrics=None, master=None, index=None, version=None
+):
+    """Applies every pending queue file against one master load and commits once.
+
+    `queue_paths` defaults to discover_queue_files(). The queues are applied
+    in order against the same in-memory master (or one SQLite transaction);
+    each file is then archived with its own rejection report, all committed
+    together through one write-ahead journal. A queue that cannot be read is
+    left in Data/ and skipped. Returns the batch RunMetrics.
+    A resident `master` and its `index` (see etl_service) are updated in place
+    instead of being loaded; discard both if the batch fails. `version` is the
+    master_version() the resident master was loaded at; the batch is not
+    committed if the store has moved on since.
+    """
+    print("\n--- Processing queued update batch ---")
+    queue_paths = discover_queue_files() if queue_paths is None else list(queue_paths)
+    if metrics is None:
+        metrics = RunMetrics()
+    metrics.store = type(master_store).__name__
+    metrics.queue_path = queue_paths
+
+    def failed(error):
+        export_run_metrics(metrics.finish("failed", error))
+        return metrics
+
+    if not queue_paths:
+        print(f"No pending Update Queue files found in {data_dir}.")
+        return metrics.finish("success")
+
+    # 1. Read every Update Queue of the batch (outside the lock)
+    queues, signatures = [], {}
+    with metrics.phase("read_queue") as record:
+        for queue_path in queue_paths:
+            try:
+                signature = queue_signature(queue_path)
+                update_sheets = read_queue(queue_path, workers=parse_workers)
+            except Exception as e:
+                print(f"ERROR: Skipping unreadable Update Queue {queue_path}: {e}")
                 continue
-            # Validation Check 2 Skill ID must exist
-            if row["Skill_ID"] not in current_skill_ids:
-                row["Reason"] = "Skill ID does not exist."
-                rejected_records.append(row.to_dict())
+            queues.append((queue_path, update_sheets))
+            signatures[queue_path] = signature
+            record["rows"] += sum(len(df) for df in update_sheets.values())
+    if not queues:
+        return failed("No readable Update Queue in the batch")
+
+    # Everything from the master load to the commit holds the master lock
+    try:
+        lock = master_lock().acquire()
+    except MasterLockTimeout as e:
+        print(f"ERROR: {e}")
+        return failed(e)
+    try:
+        return apply_and_commit_batch(
+            queues, metrics, master, index, version, signatures
+        )
+    finally:
+        lock.release()
+
+
+def apply_and_commit_batch(
+    queues, metrics, master=None, index=None, version=None, signatures=None
+):
+    """Loads the master once, applies the (queue path, sheets) `queues` in order and commits.
+
+    The caller holds the lock; see process_update_batch for the arguments.
+    `signatures` maps each queue path to its queue_signature() when read
+    (None: as they are now); a queue replaced since is read again.
+    """
+    native = getattr(master_store, "applies_queue_natively", False)
+
+    def failed(error):
+        export_run_metrics(metrics.finish("failed", error))
+        return metrics
+
+    recover_interrupted_run()
+    # Queues another run applied and archived while this one waited for the lock
+    applied = [queue_path for queue_path, _ in queues if not os.path.exists(queue_path)]
+    for queue_path in applied:
+        print(f"  - Skipping {queue_path}: already processed by another run.")
+    queues = [queue for queue in queues if queue[0] not in applied]
+    if signatures is None:
+        signatures = {
+            queue_path: queue_signature(queue_path) for queue_path, _ in queues
+        }
+    current = []
+    for queue_path, update_sheets in queues:
+        if queue_signature(queue_path) != signatures[queue_path]:
+            print(f"  - {queue_path} changed since it was read. Reading it again...")
+            try:
+                with metrics.phase("read_queue") as record:
+                    signatures[queue_path] = queue_signature(queue_path)
+                    update_sheets = read_queue(queue_path, workers=parse_workers)
+                    record["rows"] += sum(len(df) for df in update_sheets.values())
+            except Exception as e:
+                print(f"ERROR: Skipping unreadable Update Queue {queue_path}: {e}")
                 continue
+        current.append((queue_path, update_sheets))
+    queues = current
+    signatures = {queue_path: signatures[queue_path] for queue_path, _ in queues}
+    if not queues:
+        return metrics.finish("success")
+    print(f"Batch of {len(queues)} Update Queue file(s).")
+
+    if not native and master is None:
+        sheet_names = {
+            sheet
+            for _, update_sheets in queues
+            for sheet in queue_sheet_names(update_sheets)
+        }
+        try:
+            with metrics.phase("load_master") as record:
+                version = master_version()
+                master = load_queue_master(sheet_names)
+                record["rows"] = sum(len(df) for df in (master or {}).values())
+        except Exception as e:
+            print(f"ERROR during initial data load: {e}")
+            return failed(e)
+        if master is None:
+            print("ERROR: Master data not loaded, cannot process updates.")
+            return failed("Master data not loaded")
+        index = None
+    elif not native and version is None:
+        # A resident master passed without its version is taken to be current
+        version = master_version()
+    if not native and index is None:
+        with metrics.phase("build_index") as record:
+            index = load_key_index(master)
+            record["rows"] = sum(len(rows) for rows in index.rows.values())
+
+    # Every file gets its own rejection report and archive name
+    committed_at = datetime.now()
+    timestamp = committed_at.strftime("%Y%m%d_%H%M%S")
+    archives, reports = [], []
+    for position, (queue_path, _) in enumerate(queues, start=1):
+        stem, extension = os.path.splitext(os.path.basename(queue_path))
+        # Timestamp then batch position, so archives sort in the order applied
+        tag = f"{timestamp}_{position:03d}_{stem}"
+        archives.append(
+            (queue_path, unique_archive_path(f"PROCESSED_updates_{tag}{extension}"))
+        )
+        reports.append(rejection_outputs(tag))
+    journal = begin_commit(archives, reports, committed_at)
+    writers = [open_rejection_report(path) for path, _ in reports]
 
-            # Remove old certification for the same employee/skill pair (Update/Overwrite)
-            master["Employee_Skills_Map"] = master["Employee_Skills_Map"][
-                ~(
-                    (master["Employee_Skills_Map"]["ACF2_ID"] == row["ACF2_ID"])
-                    & (master["Employee_Skills_Map"]["Skill_ID"] == row["Skill_ID"])
-                )
-            ]
+    def stage_native():
+        # Runs inside the SQLite transaction, just before it commits
+        check_queues_unchanged(signatures)
+        stage_reports(journal, writers, reports, metrics)
 
-            valid_training_adds.append(row)
+    # 2-3. Apply the queues in order; nothing is persisted until all are applied
+    changes = ChangeSet(table_names(schema))
+    try:
+        with metrics.phase("apply_updates") as record:
+            if native:
+                try:
+                    master_store.apply_update_batch(
+                        [update_sheets for _, update_sheets in queues],
+                        metrics=metrics,
+                        commit_id=journal.commit_id,
+                        on_commit=stage_native,
+                        on_applied=lambda position, rejections: writers[position].add(
+                            rejections
+                        ),
+                    )
+                except Exception as e:
+                    print(f"ERROR: Batch rolled back, Master Database unchanged: {e}")
+                    raise
+            else:
+                for (queue_path, update_sheets), rejections in zip(queues, writers):
+                    print(f"\n=== {os.path.basename(queue_path)} ===")
+                    rejections.add(
+                        apply_updates_to_master(
+                            master, update_sheets, changes, index=index, metrics=metrics
+                        )
+                    )
+            record["rows"] = sum(sheet["rows_in"] for sheet in metrics.sheets.values())
+    except Exception as e:
+        abandon_commit(journal, writers)
+        return failed(e)
 
-        if valid_training_adds:
-            updates_to_add = pd.DataFrame(valid_training_adds)
-            master["Employee_Skills_Map"] = pd.concat(
-                [master["Employee_Skills_Map"], updates_to_add], ignore_index=True
-            )
+    # 4. Stage the master and every rejection report, then commit once
+    print("\n[STEP 4/4] Finalizing changes...")
+    if not native:
+        try:
+            check_master_version(version)
+            check_queues_unchanged(signatures)
+            write_master_changes(master, changes, native, metrics, committed_at)
+            stage_reports(journal, writers, reports, metrics)
+        except (StaleMasterError, QueueChangedError) as e:
+            print(f"ERROR: {e} The Update Queues stay in Data/ to be applied again.")
+            abandon_commit(journal, writers)
+            return failed(e)
+        except Exception as e:
             print(
-                f"  - Added/Updated {len(updates_to_add)} training records to the map. Rejected {len(updates) - len(updates_to_add)} invalid entries."
+                f"ERROR: Failed to write to Master Database. Check file permissions: {e}"
             )
+            abandon_commit(journal, writers)
+            return failed(e)
+    try:
+        finish_commit(journal, master, index, metrics)
+    except Exception as e:
+        print(f"ERROR: Commit interrupted; it is completed on the next run: {e}")
+        return failed(e)
+    print(f"SUCCESS: {len(queues)} Update Queue file(s) archived. ETL batch finished.")
+
+    export_run_metrics(metrics.finish("success"))
+    return metrics
+
+
+# --- ARCHIVE REPLAY ---
+# Rebuilds a lost or corrupted master from Archive/: every archived queue is
+# applied again, oldest first, to an in-memory master starting from the
+# template seed (or any `base` tables, such as a backup or master_as_of()),
+# with the validations and cascades of the original runs. Upcoming queues are
+# parsed in background processes while the current one is applied, and the
+# rebuilt master is committed once at the end. The archive is left as it is.
+
+
+def archived_queue_files(directory=None):
+    """Archived queue workbooks/directories (PROCESSED_updates_*), oldest first.
+
+    Archive names start with the run's timestamp (batch files add their
+    position), so name order is the order they were applied in.
+    """
+    directory = directory or archive_dir
+    queue_paths = []
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if not fnmatch(name, "PROCESSED_updates_*"):
+            continue
+        if os.path.isdir(path) or name.endswith(".xlsx"):
+            queue_paths.append(path)
+    return queue_paths
+
+
+def replay_archived_queues(base=None, queue_paths=None, workers=None, metrics=None):
+    """Rebuilds the master by applying the archived queues again; commits once.
+
+    `base` is the master to start from (default: seed_master_tables()) and
+    `queue_paths` the queues to apply (default: archived_queue_files()).
+    `workers` (default replay_workers) background processes parse the next
+    queues. Nothing is written unless every queue is read and applied; rows
+    rejected again are counted but not reported, as the original runs'
+    reports are already in Archive/. Returns the replay's RunMetrics.
+    """
+    print("\n--- Replaying archived update queues ---")
+    if metrics is None:
+        metrics = RunMetrics()
+    metrics.store = type(master_store).__name__
 
-    # --------------------------------------------------------------------
-    # Step 4: WRITE MASTER DATA, ARCHIVE, AND REPORT REJECTIONS
-    # --------------------------------------------------------------------
-    print("\n[STEP 4/4] Finalizing changes...")
-
-    # Write Master DataFrames back to the single Master_Database.xlsx
     try:
-        with pd.ExcelWriter(master_db_path, engine="openpyxl") as writer:
-            for name, df in master.items():
-                df.to_excel(writer, sheet_name=name, index=False)
-        print(f"SUCCESS: Master Database updated at: {master_db_path}")
+        lock = master_lock().acquire()
+    except MasterLockTimeout as e:
+        print(f"ERROR: {e}")
+        export_run_metrics(metrics.finish("failed", e))
+        return metrics
+    try:
+        return replay_and_commit(base, queue_paths, workers, metrics)
+    finally:
+        lock.release()
+
+
+def replay_and_commit(base, queue_paths, workers, metrics):
+    """Applies the queues to `base` and replaces the master; the caller holds the lock."""
+
+    def failed(error):
+        export_run_metrics(metrics.finish("failed", error))
+        return metrics
+
+    # A run interrupted mid-commit may still have a queue to archive
+    recover_interrupted_run()
+    if queue_paths is None:
+        queue_paths = archived_queue_files()
+    metrics.queue_path = list(queue_paths)
+    print(f"  - {len(queue_paths)} archived Update Queue file(s) to apply.")
+
+    base = seed_master_tables() if base is None else base
+    master = enforce_schema({name: df.copy() for name, df in base.items()}, schema)
+    with metrics.phase("build_index") as record:
+        index = MasterIndex.build(master, schema)
+        record["rows"] = sum(len(rows) for rows in index.rows.values())
+
+    changes = ChangeSet(table_names(schema))
+    queues = prefetch_queues(
+        queue_paths, replay_workers if workers is None else workers
+    )
+    rejected = 0
+    try:
+        for _ in queue_paths:
+            # Only the time spent waiting for a queue not parsed yet
+            with metrics.phase("read_queue") as record:
+                queue_path, update_sheets = next(queues)
+                if isinstance(update_sheets, Exception):
+                    raise RuntimeError(
+                        f"Cannot read {queue_path}: {update_sheets}"
+                    ) from update_sheets
+                record["rows"] += sum(len(df) for df in update_sheets.values())
+            print(f"\n=== {os.path.basename(queue_path)} ===")
+            with metrics.phase("apply_updates") as record:
+                rejections = apply_updates_to_master(
+                    master, update_sheets, changes, index=index, metrics=metrics
+                )
+                record["rows"] += sum(len(df) for df in update_sheets.values())
+            rejected += sum(len(df) for df in rejections.values())
+    except Exception as e:
+        print(f"ERROR: Replay stopped, Master Database unchanged: {e}")
+        return failed(e)
+    finally:
+        queues.close()
+
+    # Every table is replaced, in one journaled commit (one transaction for SQLite)
+    print("\n[STEP 4/4] Committing the rebuilt master...")
+    journal = None
+    try:
+        with metrics.phase("write_master") as record:
+            record["rows"] = sum(len(df) for df in master.values())
+            if getattr(master_store, "applies_queue_natively", False):
+                master_store.save(master)
+            else:
+                committed_at = datetime.now()
+                journal = begin_commit([], [], committed_at)
+                master_store.stage(master)
+                if master_history is not None:
+                    master_history.stage(master, None, committed_at)
+                journal.staged()
     except Exception as e:
         print(f"ERROR: Failed to write to Master Database. Check file permissions: {e}")
-        return
+        if journal is not None:
+            abandon_commit(journal)
+        return failed(e)
+    try:
+        finish_commit(journal, master, index, metrics)
+    except Exception as e:
+        print(f"ERROR: Commit interrupted; it is completed on the next run: {e}")
+        return failed(e)
+    if rejected:
+        print(
+            f"  - {rejected} archived row(s) were rejected again, as in the original runs."
+        )
+    print(
+        f"SUCCESS: Master Database rebuilt from {len(queue_paths)} archived queue(s)."
+    )
 
-    # Handle Rejections
+    export_run_metrics(metrics.finish("success"))
+    return metrics
 
-    if rejected_records:
-        rejected_df = pd.DataFrame(rejected_records)
-        rejected_path = os.path.join(archive_dir, "rejected_records.xlsx")
-        rejected_df.to_excel(rejected_path, index=False)
-        print(f"Rejected records written to {rejected_path}")
-        print(
-            f"WARNING: {len(rejected_records)} records were rejected. See Rejected file in Archive."
+
+# --- DRY RUN ---
+
+
+def plan_updates(queue_path=None, master=None, index=None, verbose=False):
+    """Dry run: what applying a queue would change, with nothing written.
+
+    Every validation and cascade of a run is applied to the in-memory master
+    (for SQLite too, whose SQL follows the same rules) and the outcome is
+    returned as an UpdatePlan. The queue stays in Data/, no lock is taken and
+    nothing is written (the Excel store's parse cache aside).
+    A resident `master` and its `index` (see etl_service) are left as they
+    were: only the tables the queue can change are copied. Returns None if
+    the queue or the master cannot be read.
+    """
+    queue_path = queue_path or update_queue_path
+    try:
+        update_sheets = read_queue(queue_path, workers=parse_workers)
+    except Exception as e:
+        print(f"ERROR: Cannot read Update Queue {queue_path}: {e}")
+        return None
+
+    if master is None:
+        # Importing a workbook would write the store; a plan only reads it
+        if not master_store.exists():
+            print("ERROR: Master Store not found, cannot plan the Update Queue.")
+            return None
+        master = load_queue_master(queue_sheet_names(update_sheets))
+        if master is None:
+            return None
+        # Loaded for this plan alone, so it is changed in place
+        index = load_key_index(master)
+    else:
+        touched = {
+            table
+            for spec in schema["sheets"]
+            if not update_sheets.get(spec["sheet"], pd.DataFrame()).empty
+            for table in sheet_tables(spec, schema)
+        }
+        master = {
+            name: df.copy() if name in touched else df for name, df in master.items()
+        }
+        index = (
+            index.copy(touched, master)
+            if index is not None
+            else MasterIndex(schema, master)
         )
 
-    # Archive the processed update queue
+    changes = ChangeSet(table_names(schema))
+    metrics = RunMetrics()
+    try:
+        rejections = apply_updates_to_master(
+            master, update_sheets, changes, verbose, index, metrics
+        )
+    except Exception as e:
+        print(f"ERROR: Failed to plan the Update Queue: {e}")
+        return None
+    return UpdatePlan(queue_path, changes, rejections, metrics.sheets)
 
-    archive_name = f'PROCESSED_updates_{datetime.now().strftime("%Y%m%d_%H%M%S")}.xlsx'
-    os.rename(update_queue_path, os.path.join(archive_dir, archive_name))
-    print(f"SUCCESS: Update Queue archived. ETL process finished.")
+
+# --- SKILL COVERAGE ---
+
+# The SkillMatrix of the stored master: (master version, matrix)
+_skill_matrix = None
+
+
+def load_skill_matrix(master=None):
+    """The SkillMatrix of the stored master, or of a resident `master` (see skill_matrix).
+
+    Only the tables it is built from are loaded, and it is reused until the
+    store's version changes (stores without a version, i.e. SQLite, rebuild
+    it every time). Returns None if the master cannot be loaded.
+    """
+    global _skill_matrix
+    if master is not None:
+        return SkillMatrix.build(master, schema)
+    version = master_version()
+    if version is not None and _skill_matrix and _skill_matrix[0] == version:
+        return _skill_matrix[1]
+    master = load_master_data(tables=list(matrix_tables(schema)))
+    if master is None:
+        return None
+    matrix = SkillMatrix.build(master, schema)
+    _skill_matrix = (version, matrix) if version is not None else None
+    return matrix
 
 
 # --- PHASE TESTING ---
@@ -467,13 +1715,10 @@ def run_phase_1_tests():
         [master_data["Skills"], new_skill_data], ignore_index=True
     ).drop_duplicates(subset=["Skill_ID"], keep="last")
 
-    # Write only the updated Skills sheet back to the Master file
+    # Write only the updated Skills table back to the Master Store
 
     try:
-        with pd.ExcelWriter(
-            master_db_path, engine="openpyxl", mode="a", if_sheet_exists="overlay"
-        ) as writer:
-            updated_skills_df.to_excel(writer, sheet_name="Skills", index=False)
+        save_master_data({"Skills": updated_skills_df})
         print("Skills sheet successfuly updated with a new record Doc Prep")
     except Exception as e:
         print(f"Test WRITE Failed during overwrite{e}")
@@ -561,11 +1806,13 @@ if __name__ == "__main__":
     os.makedirs(archive_dir, exist_ok=True)
 
     # Step 1: Initialization
-    if os.path.exists(master_db_path):
+    if master_store.exists() or os.path.exists(master_db_path):
         print(
             "\nMaster DB exists. Deleting and re-initializing to ensure 4-sheet structure for test."
         )
-        os.remove(master_db_path)
+        master_store.delete()
+        if os.path.exists(master_db_path):
+            os.remove(master_db_path)
 
     initialize_master_database()
 
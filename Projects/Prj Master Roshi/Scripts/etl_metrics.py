@@ -0,0 +1,203 @@
+import contextlib
+import json
+import os
+import time
+from datetime import datetime
+
+# --- ETL RUN METRICS ---
+# process_all_updates fills one RunMetrics per run: wall time and row counts
+# per phase (load, queue read, apply, master write, rejection write, archive),
+# and time plus rows in/out/rejected per queue sheet. Hooks are called as each
+# phase or sheet step finishes, and a finished run can be appended to a
+# JSON-lines log or written as a Prometheus textfile (node_exporter's textfile
+# collector picks up *.prom files from a directory).
+
+SHEET_COUNTS = ["rows_in", "rows_out", "rows_rejected"]
+
+
+class RunMetrics:
+    """Timings and row counts of one ETL run.
+
+    - `phases`: phase name -> {"seconds", "rows"}, in the order phases started
+    - `sheets`: queue sheet -> {"seconds", "rows_in", "rows_out", "rows_rejected"}
+      (rows_out = master rows added, updated or removed, cascades included),
+      plus "columns" for update sheets: the columns their rows set
+    - `tables`: master table -> inserted/updated/deleted row counts
+    - `hooks`: callables run as hook(kind, name, record) when a "phase" or
+      "sheet" step finishes
+    """
+
+    def __init__(self, hooks=()):
+        self.hooks = list(hooks)
+        self.started_at = datetime.now()
+        self.status = "running"
+        self.error = None
+        self.store = None
+        self.queue_path = None
+        self.phases = {}
+        self.sheets = {}
+        self.tables = {}
+        self._lap = time.perf_counter()
+
+    # --- Recording ---
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Times the block as phase `name`; the block may set record["rows"]."""
+        record = self.phases.setdefault(name, {"seconds": 0.0, "rows": 0})
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record["seconds"] += time.perf_counter() - start
+            self._notify("phase", name, record)
+
+    def start_lap(self):
+        """Starts the clock for the next sheet step."""
+        self._lap = time.perf_counter()
+
+    def record_sheet(self, sheet, rows_in, rows_out, rows_rejected=0, columns=None):
+        """Adds one sheet step (or queue chunk) and the time since the last lap."""
+        now = time.perf_counter()
+        record = self.sheets.setdefault(
+            sheet, {"seconds": 0.0, **{count: 0 for count in SHEET_COUNTS}}
+        )
+        record["seconds"] += now - self._lap
+        record["rows_in"] += int(rows_in)
+        record["rows_out"] += int(rows_out)
+        record["rows_rejected"] += int(rows_rejected)
+        if columns is not None:
+            record["columns"] = sorted(set(record.get("columns", [])) | set(columns))
+        self._lap = now
+        self._notify("sheet", sheet, record)
+
+    def finish(self, status, error=None):
+        """Marks the run as "success" or "failed"; returns self for chaining."""
+        self.status = status
+        self.error = str(error) if error is not None else None
+        return self
+
+    def _notify(self, kind, name, record):
+        for hook in self.hooks:
+            try:
+                hook(kind, name, dict(record))
+            except Exception as e:
+                print(f"WARNING: Metrics hook {hook!r} failed: {e}")
+
+    # --- Reporting ---
+
+    @property
+    def total_seconds(self):
+        return sum(record["seconds"] for record in self.phases.values())
+
+    @property
+    def rows_rejected(self):
+        return sum(record["rows_rejected"] for record in self.sheets.values())
+
+    def to_dict(self):
+        """Plain dict of the run, ready for json.dumps."""
+        return {
+            "started_at": self.started_at.isoformat(timespec="seconds"),
+            "status": self.status,
+            "error": self.error,
+            "store": self.store,
+            "queue_path": self.queue_path,
+            "total_seconds": round(self.total_seconds, 6),
+            "phases": {
+                name: {**record, "seconds": round(record["seconds"], 6)}
+                for name, record in self.phases.items()
+            },
+            "sheets": {
+                name: {**record, "seconds": round(record["seconds"], 6)}
+                for name, record in self.sheets.items()
+            },
+            "tables": self.tables,
+        }
+
+    def write_jsonl(self, path):
+        """Appends the run as one JSON line."""
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "a") as handle:
+            handle.write(json.dumps(self.to_dict()) + "\n")
+
+    def to_prometheus(self, prefix="master_roshi_etl"):
+        """Renders the run in the Prometheus text exposition format."""
+        lines = []
+
+        def metric(name, help_text, samples):
+            lines.append(f"# HELP {prefix}_{name} {help_text}")
+            lines.append(f"# TYPE {prefix}_{name} gauge")
+            for labels, value in samples:
+                label_text = ",".join(
+                    f'{key}="{_escape_label(val)}"' for key, val in labels.items()
+                )
+                label_text = f"{{{label_text}}}" if label_text else ""
+                lines.append(f"{prefix}_{name}{label_text} {value}")
+
+        metric(
+            "last_run_timestamp_seconds",
+            "Start time of the last ETL run.",
+            [({}, self.started_at.timestamp())],
+        )
+        metric(
+            "last_run_success",
+            "1 if the last ETL run succeeded, else 0.",
+            [({}, int(self.status == "success"))],
+        )
+        metric(
+            "last_run_seconds",
+            "Wall time of the last ETL run.",
+            [({}, round(self.total_seconds, 6))],
+        )
+        metric(
+            "phase_seconds",
+            "Wall time of each phase of the last ETL run.",
+            [
+                ({"phase": name}, round(r["seconds"], 6))
+                for name, r in self.phases.items()
+            ],
+        )
+        metric(
+            "phase_rows",
+            "Rows handled by each phase of the last ETL run.",
+            [({"phase": name}, r["rows"]) for name, r in self.phases.items()],
+        )
+        metric(
+            "sheet_seconds",
+            "Time spent applying each queue sheet in the last ETL run.",
+            [
+                ({"sheet": name}, round(r["seconds"], 6))
+                for name, r in self.sheets.items()
+            ],
+        )
+        metric(
+            "sheet_rows",
+            "Rows in/out/rejected per queue sheet in the last ETL run.",
+            [
+                ({"sheet": name, "kind": count.removeprefix("rows_")}, r[count])
+                for name, r in self.sheets.items()
+                for count in SHEET_COUNTS
+            ],
+        )
+        metric(
+            "table_rows_changed",
+            "Master rows inserted/updated/deleted per table in the last ETL run.",
+            [
+                ({"table": table, "change": change}, count)
+                for table, counts in self.tables.items()
+                for change, count in counts.items()
+            ],
+        )
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path, prefix="master_roshi_etl"):
+        """Writes the textfile atomically so a scrape never sees half a file."""
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "w") as handle:
+            handle.write(self.to_prometheus(prefix))
+        os.replace(temp_path, path)
+
+
+def _escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
@@ -0,0 +1,239 @@
+import argparse
+import importlib.util
+import os
+import signal
+import threading
+import time
+
+import etl_engine
+from key_index import MasterIndex
+from master_lock import MasterLockTimeout
+
+# --- WATCH-FOLDER SERVICE ---
+# Long-running alternative to running etl_engine.py by hand. The master tables
+# and their key indexes stay in memory between batches, Data/ is watched for
+# new update_queue* files (inotify through the optional `watchdog` package,
+# otherwise polling), and every group of files that is ready is applied with
+# process_update_batch and committed before the next one is picked up.
+# Unlike etl_engine's __main__ block, the service never re-initializes the
+# master database.
+
+
+def watchdog_available():
+    """True if the optional `watchdog` package (inotify on Linux) is installed."""
+    return importlib.util.find_spec("watchdog") is not None
+
+
+class UpdateQueueWatcher:
+    """Applies queue files dropped into Data/ as they arrive.
+
+    A file is picked up once its size and mtime have not changed for
+    `debounce_seconds` (it may still be being copied or saved); all files that
+    are ready together form one batch. A file that fails is not retried until
+    it changes.
+    """
+
+    def __init__(self, poll_seconds=2.0, debounce_seconds=5.0):
+        self.poll_seconds = poll_seconds
+        self.debounce_seconds = debounce_seconds
+        self.native = getattr(etl_engine.master_store, "applies_queue_natively", False)
+        self.master = None
+        self.index = None
+        self.fingerprint = None
+        self.pending = {}  # queue path -> (signature, monotonic time first seen)
+        self.failed = {}  # queue path -> signature it failed with
+        self.batches = 0
+        self.wake = threading.Event()
+        self.stopping = threading.Event()
+
+    # --- Resident master ---
+
+    def load(self):
+        """(Re)loads the master tables and builds their key indexes."""
+        if self.native:
+            # The SQLite store applies queues in SQL; nothing to keep in memory
+            return
+        print("Loading Master Database into memory...")
+        # Taken first: a write racing the load then shows up as a stale master
+        self.fingerprint = etl_engine.master_version()
+        self.master = etl_engine.load_master_data()
+        if self.master is None:
+            raise RuntimeError("Master data not loaded")
+        self.index = MasterIndex.build(self.master, etl_engine.schema)
+        rows = sum(len(df) for df in self.master.values())
+        print(f"  - {rows} master rows resident.")
+
+    def _is_stale(self):
+        # Another process (e.g. a manual etl_engine run) rewrote the store
+        return self.master is None or etl_engine.master_version() != self.fingerprint
+
+    # --- Watching ---
+
+    @staticmethod
+    def _signature(path):
+        if os.path.isdir(path):
+            return tuple(
+                (entry.name, entry.stat().st_size, entry.stat().st_mtime_ns)
+                for entry in sorted(os.scandir(path), key=lambda entry: entry.name)
+            )
+        stat = os.stat(path)
+        return (stat.st_size, stat.st_mtime_ns)
+
+    def ready_files(self):
+        """Queue files that have been stable for the debounce period, in name order."""
+        now = time.monotonic()
+        pending = {}
+        for path in etl_engine.discover_queue_files():
+            try:
+                signature = self._signature(path)
+            except FileNotFoundError:
+                continue
+            if self.failed.get(path) == signature:
+                continue
+            previous = self.pending.get(path)
+            if previous is not None and previous[0] == signature:
+                pending[path] = previous
+            else:
+                pending[path] = (signature, now)
+        self.pending = pending
+        return [
+            path
+            for path, (_, since) in pending.items()
+            if now - since >= self.debounce_seconds
+        ]
+
+    def _next_wait(self):
+        if not self.pending:
+            return self.poll_seconds
+        now = time.monotonic()
+        due = min(since for _, since in self.pending.values()) + self.debounce_seconds
+        return max(0.1, min(self.poll_seconds, due - now))
+
+    def _start_observer(self):
+        if not watchdog_available():
+            print(f"  - Polling every {self.poll_seconds}s (watchdog not installed).")
+            return None
+        from watchdog.events import FileSystemEventHandler
+        from watchdog.observers import Observer
+
+        wake = self.wake
+
+        class WakeOnChange(FileSystemEventHandler):
+            def on_any_event(self, event):
+                wake.set()
+
+        observer = Observer()
+        observer.schedule(WakeOnChange(), etl_engine.data_dir, recursive=False)
+        observer.start()
+        print("  - Watching with filesystem events (watchdog).")
+        return observer
+
+    # --- Processing ---
+
+    def process(self, queue_paths):
+        """Applies one batch against the resident master; returns its RunMetrics."""
+        metrics = None
+        try:
+            # Other queue processors may share the master: hold its lock from the
+            # staleness check to the commit (the batch re-enters it)
+            with etl_engine.master_lock():
+                # Finish a commit left behind by a crash first; it changes the store
+                etl_engine.recover_interrupted_run()
+                if not self.native and self._is_stale():
+                    self.load()
+                metrics = etl_engine.process_update_batch(
+                    queue_paths,
+                    master=self.master,
+                    index=self.index,
+                    version=self.fingerprint,
+                )
+                if metrics.status == "success":
+                    self.fingerprint = etl_engine.master_version()
+                # A failed batch whose master changed under it is retried as is
+                moved = etl_engine.master_version() != self.fingerprint
+        except MasterLockTimeout as e:
+            # Nothing was applied; the files stay pending and are retried
+            print(f"WARNING: {e}")
+            return None
+        except Exception as e:
+            print(f"ERROR: Update batch failed: {e}")
+            moved = False
+        if metrics is not None and metrics.status == "success":
+            self.batches += 1
+        else:
+            # The resident tables may hold a half-applied batch: reload next time
+            self.master = self.index = None
+        # Anything still in Data/ was skipped or failed; wait for it to change
+        for path in queue_paths:
+            self.pending.pop(path, None)
+            if os.path.exists(path) and not moved:
+                self.failed[path] = self._signature(path)
+        return metrics
+
+    def plan(self, queue_path):
+        """Dry run of one queue against the resident master; returns its UpdatePlan.
+
+        Cheap enough to check every upload before it is picked up.
+        """
+        if not self.native and self._is_stale():
+            self.load()
+        return etl_engine.plan_updates(queue_path, master=self.master, index=self.index)
+
+    def stop(self, *args):
+        """Asks the watch loop to finish after the current batch."""
+        self.stopping.set()
+        self.wake.set()
+
+    def run(self, once=False):
+        """Watches Data/ until stopped; with `once`, exits when no file is pending."""
+        os.makedirs(etl_engine.data_dir, exist_ok=True)
+        os.makedirs(etl_engine.archive_dir, exist_ok=True)
+        with etl_engine.master_lock():
+            if not etl_engine.master_store.exists() and not os.path.exists(
+                etl_engine.master_db_path
+            ):
+                etl_engine.initialize_master_database()
+            etl_engine.recover_interrupted_run()
+            self.load()
+
+        print(f"\n--- Watching {etl_engine.data_dir} for update queues ---")
+        observer = self._start_observer()
+        try:
+            while not self.stopping.is_set():
+                ready = self.ready_files()
+                if ready:
+                    self.process(ready)
+                    continue
+                if once and not self.pending:
+                    break
+                self.wake.wait(self._next_wait())
+                self.wake.clear()
+        finally:
+            if observer is not None:
+                observer.stop()
+                observer.join()
+        print(f"Service stopped after {self.batches} batch(es).")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Apply update queues dropped into Data/ as they arrive."
+    )
+    parser.add_argument("--poll-seconds", type=float, default=2.0)
+    parser.add_argument(
+        "--debounce-seconds",
+        type=float,
+        default=5.0,
+        help="How long a queue file must stay unchanged before it is applied.",
+    )
+    parser.add_argument(
+        "--once",
+        action="store_true",
+        help="Apply the queues already in Data/, then exit.",
+    )
+    args = parser.parse_args()
+
+    watcher = UpdateQueueWatcher(args.poll_seconds, args.debounce_seconds)
+    signal.signal(signal.SIGINT, watcher.stop)
+    signal.signal(signal.SIGTERM, watcher.stop)
+    watcher.run(once=args.once)
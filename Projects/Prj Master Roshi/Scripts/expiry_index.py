@@ -0,0 +1,211 @@
+import numpy as np
+import pandas as pd
+
+from master_schema import MASTER_SCHEMA
+
+# --- CERTIFICATION EXPIRY INDEX ---
+# Training map rows sorted by the date their certification expires: either
+# the map's own expiry column or its certification date plus a fixed validity
+# (the schema config's "skill_matrix" entry says which). The dates and row
+# labels are two parallel numpy arrays kept in date order, so "what expires
+# between two dates" is two binary searches and one slice, O(log n) plus the
+# rows returned. The MasterIndex owns one and feeds it every batch of map
+# rows it adds or removes, so upserts and cascade removals keep it current
+# without a rebuild; rows without a date are not indexed.
+#
+# The stored expiry report (expiry_snapshot) keeps each certification's
+# Expires date, not its days left: expiry_report() works those out when the
+# report is read, so a report written days ago is still right today.
+
+REPORT_COLUMNS = ["Window_Days", "Expires", "Days_Left", "Team", "Manager"]
+
+
+def expiry_config(schema=MASTER_SCHEMA):
+    """The "skill_matrix" entry if it dates certifications, else None."""
+    config = schema.get("skill_matrix")
+    if config and (config.get("expires") or config.get("certified")):
+        return config
+    return None
+
+
+def expiry_tables(schema=MASTER_SCHEMA):
+    """(map, employee, team) tables an expiry report reads."""
+    config = expiry_config(schema)
+    tables = schema["tables"]
+    references = tables[config["table"]]["references"]
+    employee_table = references[config["employee"]]["table"]
+    team_table = tables[employee_table]["references"][config["team"]]["table"]
+    return config["table"], employee_table, team_table
+
+
+class ExpiryIndex:
+    """Labels of the training map rows, sorted by expiry date.
+
+    - `dates`: expiry dates as int64 nanoseconds, ascending
+    - `labels`: the map row label at the same position
+    Every batch replaces both arrays instead of changing them, so a shallow
+    copy of the index is independent of it.
+    """
+
+    def __init__(self, schema=MASTER_SCHEMA):
+        config = expiry_config(schema)
+        self.table = config["table"]
+        self.expires = config.get("expires")
+        self.certified = config.get("certified")
+        self.valid_days = config.get("valid_days")
+        self.dates = np.zeros(0, dtype=np.int64)
+        self.labels = np.zeros(0, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.dates)
+
+    def expiry_dates(self, df):
+        """Expiry date of every row of a map DataFrame (NaT if it has none)."""
+        if self.expires:
+            return pd.to_datetime(df[self.expires])
+        return pd.to_datetime(df[self.certified]) + pd.Timedelta(days=self.valid_days)
+
+    # --- Maintenance ---
+
+    def add(self, df):
+        """Indexes a batch of map rows under their labels."""
+        dates = self.expiry_dates(df)
+        dated = dates.notna().to_numpy()
+        if not dated.any():
+            return
+        new_dates = dates.to_numpy(dtype="datetime64[ns]")[dated].astype(np.int64)
+        new_labels = np.asarray(df.index)[dated].astype(np.int64)
+        order = np.argsort(new_dates, kind="stable")
+        new_dates, new_labels = new_dates[order], new_labels[order]
+        # One merge per batch: O(n + k log k) instead of k separate inserts
+        positions = np.searchsorted(self.dates, new_dates, side="right")
+        self.dates = np.insert(self.dates, positions, new_dates)
+        self.labels = np.insert(self.labels, positions, new_labels)
+
+    def remove(self, labels):
+        """Drops the rows with these labels (e.g. superseded or cascaded rows)."""
+        if not len(labels) or not len(self.labels):
+            return
+        keep = ~np.isin(self.labels, np.asarray(labels, dtype=np.int64))
+        self.dates, self.labels = self.dates[keep], self.labels[keep]
+
+    # --- Queries ---
+
+    def between(self, start, end):
+        """Labels of the rows expiring in [start, end), earliest first."""
+        low, high = np.searchsorted(
+            self.dates,
+            [pd.Timestamp(start).value, pd.Timestamp(end).value],
+            side="left",
+        )
+        return self.labels[low:high]
+
+
+# --- EXPIRY QUERIES ---
+# Teams and managers are joined through the key indexes: O(1) per row
+
+
+def _teams(master, index, employees, schema=MASTER_SCHEMA):
+    """Team of each employee key in the Series `employees`."""
+    config = expiry_config(schema)
+    _, employee_table, _ = expiry_tables(schema)
+    employee_rows = index.rows[employee_table]
+    labels = [employee_rows.get(key) for key in employees]
+    return pd.Series(
+        master[employee_table][config["team"]].reindex(labels).to_numpy(),
+        index=employees.index,
+        dtype="object",
+    )
+
+
+def _managers(master, index, teams, schema=MASTER_SCHEMA):
+    """Manager of each team key in the Series `teams` (None without managers)."""
+    config = expiry_config(schema)
+    _, _, team_table = expiry_tables(schema)
+    managers = pd.Series(None, index=teams.index, dtype="object")
+    if config.get("manager"):
+        team_rows = index.rows[team_table]
+        labels = [team_rows.get(key) for key in teams]
+        managers[:] = master[team_table][config["manager"]].reindex(labels).to_numpy()
+    return managers
+
+
+def expiring(
+    master,
+    index,
+    within_days=None,
+    today=None,
+    team=None,
+    skill=None,
+    manager=None,
+    schema=MASTER_SCHEMA,
+):
+    """Certifications expiring within `within_days` of `today`, earliest first
+    (every one not yet expired if `within_days` is None).
+
+    `index` is the MasterIndex (with its ExpiryIndex) kept in step with
+    `master`. The date range is found by binary search; only the rows in it
+    are joined to their employee's team and manager and filtered by `team`,
+    `skill` and `manager`. Returns the map rows plus Expires, Days_Left, Team
+    and Manager.
+    """
+    config = expiry_config(schema)
+    today = pd.Timestamp(today or pd.Timestamp.now()).normalize()
+    end = pd.Timestamp.max
+    if within_days is not None:
+        end = today + pd.Timedelta(days=within_days + 1)
+    labels = index.expiry.between(today, end)
+    rows = master[config["table"]].loc[labels]
+    if skill is not None:
+        rows = rows[rows[config["skill"]] == skill]
+
+    teams = _teams(master, index, rows[config["employee"]], schema)
+    managers = _managers(master, index, teams, schema)
+    expires = index.expiry.expiry_dates(rows)
+    report = rows.assign(
+        Expires=expires,
+        Days_Left=(expires - today).dt.days,
+        Team=teams,
+        Manager=managers,
+    )
+    if team is not None:
+        report = report[report["Team"] == team]
+    if manager is not None:
+        report = report[report["Manager"] == manager]
+    return report.reset_index(drop=True)
+
+
+def expiry_snapshot(master, index, today=None, schema=MASTER_SCHEMA):
+    """What the expiry report stores: every certification not yet expired
+    with its Expires date, Team and Manager (no Days_Left), earliest first."""
+    return expiring(master, index, None, today, schema=schema).drop(columns="Days_Left")
+
+
+def patch_expiry_snapshot(snapshot, master, index, teams=True, schema=MASTER_SCHEMA):
+    """A stored expiry_snapshot() with its Team (if `teams`) and Manager joined
+    again to the current employee and team tables, without the training map."""
+    config = expiry_config(schema)
+    team = snapshot["Team"].astype("object")
+    if teams:
+        team = _teams(master, index, snapshot[config["employee"]], schema)
+    return snapshot.assign(Team=team, Manager=_managers(master, index, team, schema))
+
+
+def expiry_report(snapshot, windows=(30, 60, 90), today=None):
+    """Certifications of an expiry_snapshot() expiring within the largest
+    window of `today`, with their Days_Left and the smallest window they fall
+    in (Window_Days)."""
+    today = pd.Timestamp(today or pd.Timestamp.now()).normalize()
+    expires = pd.to_datetime(snapshot["Expires"])
+    report = snapshot[
+        (expires >= today) & (expires < today + pd.Timedelta(days=max(windows) + 1))
+    ]
+    days_left = (pd.to_datetime(report["Expires"]) - today).dt.days
+    bounds = sorted(windows)
+    report = report.assign(
+        Days_Left=days_left,
+        Window_Days=np.asarray(bounds)[np.searchsorted(bounds, days_left, side="left")],
+    )
+    return report[
+        REPORT_COLUMNS + [c for c in report.columns if c not in REPORT_COLUMNS]
+    ].reset_index(drop=True)
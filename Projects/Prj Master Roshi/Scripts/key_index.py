@@ -0,0 +1,284 @@
+import copy
+import os
+import pickle
+
+import pandas as pd
+
+from expiry_index import ExpiryIndex, expiry_config
+from master_schema import MASTER_SCHEMA, conform_rows, foreign_keys, table_keys
+
+# --- KEY INDEXES OVER THE MASTER TABLES ---
+# Every master DataFrame keeps unique, stable row labels (new rows get fresh
+# labels instead of ignore_index=True), so the dicts below can point straight
+# at rows. Lookups are O(1) per key and cascades are O(k) in the rows touched
+# instead of a full-column `.isin` scan. Which tables, keys and foreign keys
+# are indexed comes from the schema config; key columns are expected to be
+# typed per that schema already, so no conversion is done.
+#
+# Building an index is a Python pass over its table, so each one (a table's
+# keys, one foreign-key column, the expiry dates) is built from the current
+# master table the first time it is used, and a run pays only for the ones
+# its queue sheets need. Indexes not built yet are not maintained either.
+
+INDEX_VERSION = 4
+
+
+class _OnFirstUse(dict):
+    """A dict whose missing entries are built by `build(key)` when first read."""
+
+    def __init__(self, build):
+        super().__init__()
+        self.build = build
+
+    def __missing__(self, key):
+        value = self[key] = self.build(key)
+        return value
+
+
+class MasterIndex:
+    """Primary-key and reverse indexes for the master tables of a schema config.
+
+    - `rows[table]`: key -> row label (a tuple key for composite keys)
+    - `refs[(table, column)]`: for every foreign-key column, the referenced
+      key -> set of labels of the rows in `table` that hold it
+    - `expiry`: the training map rows by expiry date (see expiry_index), if
+      the schema config dates certifications
+    Each is built from `master` when first read; `rows` and `refs` hold only
+    the ones built so far.
+    """
+
+    def __init__(self, schema=MASTER_SCHEMA, master=None):
+        self.schema = schema
+        self.master = master
+        self.keys = table_keys(schema)
+        self.foreign = [(table, column) for table, column, _ in foreign_keys(schema)]
+        self.rows = _OnFirstUse(self._build_rows)
+        self.refs = _OnFirstUse(self._build_refs)
+        self.next_label = {}
+        config = expiry_config(schema)
+        self.expiry_table = config["table"] if config else None
+        self._expiry = None
+
+    @classmethod
+    def build(cls, master, schema=MASTER_SCHEMA):
+        """Builds all indexes from freshly loaded master tables.
+
+        Tables not in `master` (see LazyMaster) are indexed when first used.
+        """
+        index = cls(schema, master)
+        for table in index.keys:
+            if table in master:
+                index.add_table(table, master[table])
+        return index
+
+    def add_table(self, table, df):
+        """Indexes a whole freshly loaded table."""
+        self.next_label[table] = int(df.index.max()) + 1 if len(df) else 0
+        self.rows[table] = self._build_rows(table, df)
+        for ref in self.foreign:
+            if ref[0] == table:
+                self.refs[ref] = self._build_refs(ref, df)
+        if table == self.expiry_table:
+            self._expiry = self._build_expiry(df)
+
+    @property
+    def expiry(self):
+        if self._expiry is None and self.expiry_table is not None:
+            self._expiry = self._build_expiry(self.master[self.expiry_table])
+        return self._expiry
+
+    # --- Building ---
+
+    def _build_rows(self, table, df=None):
+        if df is None:
+            df = self.master[table]
+        return dict(zip(self._keys(table, df), df.index))
+
+    def _build_refs(self, ref, df=None):
+        table, column = ref
+        if df is None:
+            df = self.master[table]
+        by_key = {}
+        for label, value in zip(df.index, df[column].tolist()):
+            by_key.setdefault(value, set()).add(label)
+        return by_key
+
+    def _build_expiry(self, df):
+        expiry = ExpiryIndex(self.schema)
+        expiry.add(df)
+        return expiry
+
+    # --- Lookups ---
+
+    def contains(self, table, keys):
+        """Returns a boolean list: is each key present in `table`?"""
+        rows = self.rows[table]
+        return [key in rows for key in keys]
+
+    def labels(self, table, keys):
+        """Row labels of the given keys that exist in `table`."""
+        rows = self.rows[table]
+        return [rows[key] for key in keys if key in rows]
+
+    def referencing(self, table, column, keys):
+        """Labels of the `table` rows whose foreign key `column` is any of `keys`."""
+        by_key = self.refs[(table, column)]
+        labels = set()
+        for key in keys:
+            labels |= by_key.get(key, set())
+        return sorted(labels)
+
+    def reference_count(self, table, column, keys):
+        """Number of `table` rows whose foreign key `column` is any of `keys`."""
+        by_key = self.refs[(table, column)]
+        return sum(len(by_key.get(key, ())) for key in keys)
+
+    def key_labels(self, table, keys):
+        """Labels of every row holding one of `keys`, repeats in legacy tables included.
+
+        Composite keys made of foreign keys are resolved through the reverse
+        indexes, which keep every row of a repeated key.
+        """
+        columns = self.keys[table]
+        if len(columns) == 1 or any((table, c) not in self.foreign for c in columns):
+            return sorted(self.labels(table, keys))
+        by_column = [self.refs[(table, column)] for column in columns]
+        labels = set()
+        for key in keys:
+            found = by_column[0].get(key[0], set())
+            for by_key, part in zip(by_column[1:], key[1:]):
+                found = found & by_key.get(part, set())
+            labels |= found
+        return sorted(labels)
+
+    def copy(self, tables, master):
+        """An index over copies of `tables` that can change without changing this one.
+
+        Only the entries of `tables` are copied; the rest stay shared, so the
+        copy must not be used to change any other table. Indexes not built
+        yet are built for the copy from `master` (the copied tables).
+        """
+        index = type(self)(self.schema, master)
+        for table, rows in self.rows.items():
+            index.rows[table] = dict(rows) if table in tables else rows
+        for (table, column), by_key in self.refs.items():
+            index.refs[(table, column)] = (
+                {key: set(labels) for key, labels in by_key.items()}
+                if table in tables
+                else by_key
+            )
+        index.next_label = dict(self.next_label)
+        index._expiry = copy.copy(self._expiry)
+        return index
+
+    # --- Maintenance ---
+
+    def _keys(self, table, df):
+        columns = self.keys[table]
+        if len(columns) > 1:
+            return list(zip(*(df[column].tolist() for column in columns)))
+        return df[columns[0]].tolist()
+
+    def _references(self, table, df):
+        for (ref_table, column), by_key in self.refs.items():
+            if ref_table == table and column in df:
+                yield by_key, df[column].tolist()
+
+    def _next_label(self, master, table):
+        if table not in self.next_label:
+            df = master[table]
+            self.next_label[table] = int(df.index.max()) + 1 if len(df) else 0
+        return self.next_label[table]
+
+    def _add(self, table, df):
+        rows = self.rows.get(table)
+        if rows is not None:
+            rows.update(zip(self._keys(table, df), df.index))
+        for by_key, values in self._references(table, df):
+            for label, value in zip(df.index, values):
+                by_key.setdefault(value, set()).add(label)
+        if self._expiry is not None and table == self.expiry_table:
+            self._expiry.add(df)
+
+    def _remove(self, table, df):
+        rows = self.rows.get(table)
+        if rows is not None:
+            for label, key in zip(df.index, self._keys(table, df)):
+                if rows.get(key) == label:
+                    del rows[key]
+        for by_key, values in self._references(table, df):
+            for label, value in zip(df.index, values):
+                by_key.get(value, set()).discard(label)
+        if self._expiry is not None and table == self.expiry_table:
+            self._expiry.remove(df.index)
+
+    def append(self, master, table, df):
+        """Appends rows to `master[table]` under fresh labels and indexes them."""
+        if df.empty:
+            return
+        start = self._next_label(master, table)
+        df = df.set_axis(pd.RangeIndex(start, start + len(df)))
+        self.next_label[table] = start + len(df)
+        # Same dtypes on both sides keep categorical columns categorical
+        master[table], df = conform_rows(master[table], df, table, self.schema)
+        master[table] = pd.concat([master[table], df])
+        self._add(table, df)
+
+    def drop(self, master, table, labels):
+        """Drops rows by label from `master[table]`; returns the dropped rows."""
+        if not len(labels):
+            return master[table].iloc[0:0]
+        self._next_label(master, table)  # dropped labels are not handed out again
+        dropped = master[table].loc[labels]
+        master[table] = master[table].drop(index=labels)
+        self._remove(table, dropped)
+        return dropped
+
+    def assign(self, master, table, labels, values):
+        """Overwrites columns of existing rows and re-indexes them (e.g. a new Team_ID)."""
+        if not len(labels):
+            return
+        self._remove(table, master[table].loc[labels])
+        master[table], values = conform_rows(master[table], values, table, self.schema)
+        for column in values.columns:
+            master[table].loc[labels, column] = values[column].to_numpy()
+        self._add(table, master[table].loc[labels])
+
+    # --- Persistence ---
+
+    def __getstate__(self):
+        # The master is not pickled; the indexes built so far are
+        return {
+            **self.__dict__,
+            "master": None,
+            "rows": dict(self.rows),
+            "refs": dict(self.refs),
+        }
+
+    def __setstate__(self, state):
+        rows, refs = state.pop("rows"), state.pop("refs")
+        self.__dict__.update(state)
+        self.rows = _OnFirstUse(self._build_rows)
+        self.rows.update(rows)
+        self.refs = _OnFirstUse(self._build_refs)
+        self.refs.update(refs)
+
+    def save(self, path, fingerprint):
+        """Pickles the index next to the master store, tagged with its fingerprint."""
+        with open(path, "wb") as handle:
+            pickle.dump((INDEX_VERSION, fingerprint, self), handle)
+
+    @classmethod
+    def load(cls, path, fingerprint, master=None):
+        """Returns the persisted index of `master` if it matches `fingerprint`, else None."""
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "rb") as handle:
+                version, saved_fingerprint, index = pickle.load(handle)
+        except Exception:
+            return None
+        if version != INDEX_VERSION or saved_fingerprint != fingerprint:
+            return None
+        index.master = master
+        return index
@@ -0,0 +1,175 @@
+import os
+from datetime import datetime
+
+import pandas as pd
+
+from commit_journal import commit_files, fsync_path, staged_path
+from master_schema import MASTER_SCHEMA, enforce_schema, table_keys
+from master_store import row_keys
+
+# --- POINT-IN-TIME HISTORY ---
+# Every commit appends what it changed to Data/History/<Table>/, one Parquet
+# file per table it touched, named after the commit time:
+# - <time>.delta.parquet: the new version of every inserted or updated row,
+#   and the key of every deleted row (Deleted = True);
+# - <time>.snapshot.parquet: the whole table, written instead of a delta
+#   every `snapshot_every` commits of that table and by full saves (e.g.
+#   initialize_master_database), so the history starts from the seed.
+# The files are never rewritten. A table as of a past time is its last
+# snapshot up to then plus the deltas after it, last version per key wins:
+# at most `snapshot_every` files, however long the history. Commits write
+# their files through the run's journal with the master (see commit_journal).
+# The SQLite store keeps its history in its own tables instead.
+
+HISTORY_FILE_KINDS = ("snapshot", "delta")
+TIME_FORMAT = "%Y%m%dT%H%M%S_%f"
+
+
+class MasterHistory:
+    """Append-only history of the master tables: snapshots plus deltas."""
+
+    def __init__(self, directory, schema=MASTER_SCHEMA, snapshot_every=20):
+        self.directory = directory
+        self.schema = schema
+        self.keys = table_keys(schema)
+        self.snapshot_every = snapshot_every
+
+    def table_dir(self, table):
+        return os.path.join(self.directory, table)
+
+    def path(self, table, committed_at, kind):
+        name = f"{committed_at.strftime(TIME_FORMAT)}.{kind}.parquet"
+        return os.path.join(self.table_dir(table), name)
+
+    def files(self, table):
+        """(commit time, kind, path) of the committed files of `table`, oldest first."""
+        directory = self.table_dir(table)
+        if not os.path.isdir(directory):
+            return []
+        files = []
+        for name in sorted(os.listdir(directory)):
+            parts = name.split(".")
+            # Staged files of an uncommitted run have an extra ".staged" part
+            if len(parts) != 3 or parts[1] not in HISTORY_FILE_KINDS:
+                continue
+            committed_at = datetime.strptime(parts[0], TIME_FORMAT)
+            files.append((committed_at, parts[1], os.path.join(directory, name)))
+        return files
+
+    # --- Recording ---
+
+    def next_kinds(self):
+        """{table: "snapshot" or "delta"}: what the next commit of each table writes.
+
+        A table gets a snapshot when it has none yet or its last one is
+        followed by `snapshot_every` - 1 deltas.
+        """
+        next_kinds = {}
+        for table in self.keys:
+            kinds = [kind for _, kind, _ in self.files(table)]
+            since = kinds[::-1].index("snapshot") if "snapshot" in kinds else None
+            due = since is None or since >= self.snapshot_every - 1
+            next_kinds[table] = "snapshot" if due else "delta"
+        return next_kinds
+
+    def paths(self, committed_at):
+        """Every file a commit at `committed_at` may write (for its journal)."""
+        return [
+            self.path(table, committed_at, kind)
+            for table in self.keys
+            for kind in HISTORY_FILE_KINDS
+        ]
+
+    def stage(self, master, changes, committed_at):
+        """Writes the history files of a commit to their staged paths.
+
+        With a ChangeSet its dirty tables are recorded as planned by
+        next_kinds(), plus a first snapshot of any table with no history yet
+        (history switched on for an existing master); without one every table
+        of `master` is recorded as a snapshot. Returns the [(staged, final)]
+        pairs to commit.
+        """
+        if changes is None:
+            tables = {table: "snapshot" for table in master}
+        else:
+            dirty = changes.dirty_tables()
+            tables = {
+                table: kind
+                for table, kind in self.next_kinds().items()
+                if table in dirty or (table in master and not self.files(table))
+            }
+        files = []
+        for table, kind in tables.items():
+            df = master[table]
+            if kind == "delta":
+                df = self._delta(table, df, changes, committed_at)
+            final = self.path(table, committed_at, kind)
+            os.makedirs(os.path.dirname(final), exist_ok=True)
+            staged = staged_path(final)
+            df.to_parquet(staged, index=False)
+            fsync_path(staged)
+            files.append((staged, final))
+        return files
+
+    def record(self, master, changes=None, committed_at=None):
+        """Stages and commits the history of a write made outside a journaled run."""
+        commit_files(self.stage(master, changes, committed_at or datetime.now()))
+
+    def _delta(self, table, df, changes, committed_at):
+        key_cols = self.keys[table]
+        written = changes.inserted.get(table, set()) | changes.updated.get(table, set())
+        keys = pd.Series(row_keys(df, key_cols), index=df.index, dtype="object")
+        delta = df[keys.isin(written)].assign(Deleted=False)
+        deleted = changes.deleted.get(table, set())
+        if deleted:
+            tombstones = pd.DataFrame(
+                [key if isinstance(key, tuple) else (key,) for key in deleted],
+                columns=key_cols,
+            )
+            # ChangeSet keys are strings; the file keeps the declared dtypes
+            tombstones = enforce_schema({table: tombstones}, self.schema)[table]
+            delta = pd.concat([delta, tombstones.assign(Deleted=True)])
+        return delta.assign(Valid_From=pd.Timestamp(committed_at))
+
+    # --- Queries ---
+
+    def as_of(self, when, tables=None):
+        """The tables as they were at `when`: {table: DataFrame}.
+
+        A table with no history up to `when` comes back empty.
+        """
+        when = pd.Timestamp(when)
+        master = {}
+        for table in tables or list(self.keys):
+            files = [entry for entry in self.files(table) if entry[0] <= when]
+            snapshots = [
+                i for i, (_, kind, _) in enumerate(files) if kind == "snapshot"
+            ]
+            if not snapshots:
+                master[table] = pd.DataFrame(
+                    columns=list(self.schema["tables"][table]["dtypes"])
+                )
+                continue
+            start = snapshots[-1]
+            df = pd.read_parquet(files[start][2])
+            if start + 1 < len(files):
+                df = self._replay(
+                    table, df, [path for _, _, path in files[start + 1 :]]
+                )
+            master[table] = df.reset_index(drop=True)
+        return master
+
+    def _replay(self, table, snapshot, delta_paths):
+        """Applies deltas to a snapshot: the last version of every key they touch wins."""
+        key_cols = self.keys[table]
+        deltas = pd.concat([pd.read_parquet(path) for path in delta_paths])
+        latest = deltas.drop_duplicates(subset=key_cols, keep="last")
+        latest = latest[~latest["Deleted"].astype(bool)]
+        touched = set(row_keys(deltas, key_cols))
+        replaced = pd.Series(row_keys(snapshot, key_cols), dtype="object").isin(touched)
+        return pd.concat(
+            [
+                snapshot[~replaced.to_numpy()],
+                latest.drop(columns=["Deleted", "Valid_From"]),
+            ]
+        )
@@ -0,0 +1,119 @@
+import os
+import time
+from datetime import datetime
+
+if os.name == "nt":
+    import msvcrt
+else:
+    import fcntl
+
+# --- MASTER DATABASE LOCK ---
+# Several queue processors may run against the same master on one host. Each
+# holds an advisory lock on a small lock file from the master load to the
+# commit (fcntl.flock on Linux/macOS, msvcrt.locking on Windows), so they take
+# turns instead of the last writer discarding the other's changes. The OS
+# releases the lock when its process dies, so a crash never leaves it held.
+# The lock only binds processes that take it; anything that rewrites the master
+# without it is caught by the version check made before a run commits.
+
+
+class MasterLockTimeout(TimeoutError):
+    """The master lock was not acquired within the configured wait."""
+
+
+class StaleMasterError(RuntimeError):
+    """The master changed on disk after it was loaded; the run must not commit."""
+
+
+class MasterLock:
+    """Exclusive advisory lock on `path`, re-entrant within a process.
+
+    `timeout` is how long acquire() waits, in seconds (None = indefinitely,
+    0 = fail at once if another process holds it).
+    """
+
+    _held = {}  # lock path -> [file descriptor, depth] held by this process
+
+    def __init__(self, path, timeout=None, poll_seconds=0.1):
+        self.path = os.path.abspath(path)
+        self.timeout = timeout
+        self.poll_seconds = poll_seconds
+
+    @staticmethod
+    def _try_lock(fd):
+        try:
+            if os.name == "nt":
+                os.lseek(fd, 0, os.SEEK_SET)
+                msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+            else:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            return False
+        return True
+
+    @staticmethod
+    def _unlock(fd):
+        if os.name == "nt":
+            os.lseek(fd, 0, os.SEEK_SET)
+            msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+        else:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+
+    def holder(self):
+        """The current holder as it recorded itself ("pid <n> since <time>")."""
+        try:
+            with open(self.path) as handle:
+                return handle.read().strip() or "unknown"
+        except OSError:
+            return "unknown"
+
+    def acquire(self):
+        """Waits for the lock; raises MasterLockTimeout after `timeout` seconds."""
+        held = self._held.get(self.path)
+        if held is not None:
+            held[1] += 1
+            return self
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o666)
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        waited = False
+        while not self._try_lock(fd):
+            if deadline is not None and time.monotonic() >= deadline:
+                os.close(fd)
+                raise MasterLockTimeout(
+                    f"Master Database is locked by {self.holder()} ({self.path}); "
+                    f"gave up after {self.timeout}s."
+                )
+            if not waited:
+                print(
+                    f"Waiting for the Master Database lock held by {self.holder()}..."
+                )
+                waited = True
+            time.sleep(self.poll_seconds)
+        # Who holds it, for the message of whoever waits next
+        os.ftruncate(fd, 0)
+        os.lseek(fd, 0, os.SEEK_SET)
+        os.write(
+            fd,
+            f"pid {os.getpid()} since {datetime.now().isoformat(timespec='seconds')}".encode(),
+        )
+        self._held[self.path] = [fd, 1]
+        return self
+
+    def release(self):
+        """Releases one acquire(); the lock is freed when the outermost one is."""
+        held = self._held[self.path]
+        held[1] -= 1
+        if held[1]:
+            return
+        del self._held[self.path]
+        try:
+            self._unlock(held[0])
+        finally:
+            os.close(held[0])
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, *exc_info):
+        self.release()
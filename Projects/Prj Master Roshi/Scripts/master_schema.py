@@ -0,0 +1,370 @@
+import numpy as np
+import pandas as pd
+
+# --- MASTER SCHEMA CONFIGURATION ---
+# A deployment of the ETL engine is described by one schema config, so the
+# pipeline, key indexes and stores are written once for every deployment:
+# - "tables": master table -> {
+#       "key": primary key column(s),
+#       "label": what a row is called in the log,
+#       "dtypes": column dtypes, enforced once at load so the pipeline never
+#                 re-converts them (strings, categoricals for repeated labels,
+#                 small nullable integers, datetime64),
+#       "not_null": columns the database refuses to leave empty,
+#       "references": foreign-key column -> {"table": parent table,
+#                     "on_delete": "cascade" or "restrict",
+#                     "missing": rejection reason when the parent is unknown},
+#   }
+# - "sheets": the update queue sheets, in the order they are applied. Each
+#   names a master table and one generic operation:
+#   "remove" (by key, cascading or restricted per the references),
+#   "add" (new keys only, "duplicate" is the rejection reason),
+#   "update" (non-null "columns" of existing keys, else "not_found"),
+#   "upsert" (insert or overwrite by key, last row wins).
+#   "required" lists the columns a row must fill to be applied at all.
+# - "skill_matrix" (optional): the parts of the skill matrix and coverage
+#   reports (see skill_matrix): "table" (the training map), its "employee"
+#   and "skill" foreign-key columns, its proficiency "level" column (None if
+#   not kept: every row is level 1), the employee's "team" foreign key, the
+#   team table's "manager" column, the skill's owning "skill_team" column
+#   (None if skills have no owner), and the employee "status" column whose
+#   "inactive" values leave an employee out of the coverage. Certifications
+#   expire on the map's "expires" date column, or "valid_days" after its
+#   "certified" date column (see expiry_index).
+# Columns missing from "dtypes" keep whatever dtype the store returns.
+
+MASTER_SCHEMA = {
+    "tables": {
+        "Employees": {
+            "key": ["ACF2_ID"],
+            "label": "employee",
+            "dtypes": {
+                "ACF2_ID": "str",
+                "First_Name": "str",
+                "Last_Name": "str",
+                "Team_ID": "category",
+                "Status": "category",
+            },
+            "not_null": ["First_Name", "Last_Name", "Team_ID"],
+            "references": {
+                "Team_ID": {
+                    "table": "Teams",
+                    "on_delete": "restrict",
+                    "missing": "Team ID does not exist in Master Teams.",
+                },
+            },
+        },
+        "Skills": {
+            "key": ["Skill_ID"],
+            "label": "skill",
+            "dtypes": {"Skill_ID": "str", "Skill_Name": "str", "Team_ID": "category"},
+            "not_null": ["Skill_Name"],
+        },
+        "Teams": {
+            "key": ["Team_ID"],
+            "label": "team",
+            "dtypes": {"Team_ID": "str", "Team_Name": "str", "Manager": "str"},
+            "not_null": ["Team_Name"],
+        },
+        "Employee_Skills_Map": {
+            "key": ["ACF2_ID", "Skill_ID"],
+            "label": "training record",
+            "dtypes": {
+                "ACF2_ID": "category",
+                "Skill_ID": "category",
+                "Proficiency_Level": "Int8",
+                "Certification_Date": "datetime64[ns]",
+            },
+            "not_null": ["ACF2_ID", "Skill_ID"],
+            "references": {
+                "ACF2_ID": {
+                    "table": "Employees",
+                    "on_delete": "cascade",
+                    "missing": "Employee ID does not exist",
+                },
+                "Skill_ID": {
+                    "table": "Skills",
+                    "on_delete": "cascade",
+                    "missing": "Skill ID does not exist.",
+                },
+            },
+        },
+    },
+    "sheets": [
+        {"sheet": "Remove_Employee", "op": "remove", "table": "Employees"},
+        {"sheet": "Remove_Skill", "op": "remove", "table": "Skills"},
+        {"sheet": "Remove_Team", "op": "remove", "table": "Teams"},
+        {
+            "sheet": "Add_Team",
+            "op": "add",
+            "table": "Teams",
+            "required": ["Team_ID", "Team_Name"],
+            "duplicate": "Duplicate Team_ID",
+        },
+        {
+            "sheet": "Update_Team",
+            "op": "update",
+            "table": "Teams",
+            "columns": ["Team_Name", "Manager"],
+            "not_found": "Team_ID not found for update",
+        },
+        {
+            "sheet": "Add_Employee",
+            "op": "add",
+            "table": "Employees",
+            "required": ["ACF2_ID", "First_Name", "Last_Name", "Team_ID"],
+            "duplicate": "Duplicate ACF2_ID",
+        },
+        {
+            "sheet": "Update_Employee",
+            "op": "update",
+            "table": "Employees",
+            "columns": ["First_Name", "Last_Name", "Team_ID", "Status"],
+            "not_found": "ACF2_ID not found for update",
+        },
+        {
+            "sheet": "Add_Skill",
+            "op": "add",
+            "table": "Skills",
+            "required": ["Skill_ID", "Skill_Name"],
+            "duplicate": "Duplicate Skill_ID",
+        },
+        {
+            "sheet": "Update_Skill",
+            "op": "update",
+            "table": "Skills",
+            "columns": ["Skill_Name", "Team_ID"],
+            "not_found": "Skill_ID not found for update",
+        },
+        {
+            "sheet": "Add_Training_Map",
+            "op": "upsert",
+            "table": "Employee_Skills_Map",
+            "required": [
+                "ACF2_ID",
+                "Skill_ID",
+                "Proficiency_Level",
+                "Certification_Date",
+            ],
+        },
+    ],
+    "skill_matrix": {
+        "table": "Employee_Skills_Map",
+        "employee": "ACF2_ID",
+        "skill": "Skill_ID",
+        "level": "Proficiency_Level",
+        "team": "Team_ID",
+        "manager": "Manager",
+        "skill_team": "Team_ID",
+        "status": "Status",
+        "inactive": ["Inactive"],
+        "certified": "Certification_Date",
+        "valid_days": 365,
+    },
+}
+
+
+# --- Schema lookups ---
+
+
+def table_names(schema=MASTER_SCHEMA):
+    """Master table names in declaration order."""
+    return list(schema["tables"])
+
+
+def table_keys(schema=MASTER_SCHEMA):
+    """Primary key column(s) of every master table."""
+    return {name: table["key"] for name, table in schema["tables"].items()}
+
+
+def foreign_keys(schema=MASTER_SCHEMA):
+    """(table, column, reference) of every foreign-key column."""
+    return [
+        (name, column, reference)
+        for name, table in schema["tables"].items()
+        for column, reference in table.get("references", {}).items()
+    ]
+
+
+def child_references(table, schema=MASTER_SCHEMA):
+    """(child table, column, reference) of the foreign keys pointing at `table`."""
+    return [ref for ref in foreign_keys(schema) if ref[2]["table"] == table]
+
+
+def sheet_columns(spec, schema=MASTER_SCHEMA):
+    """Columns a row of the queue sheet `spec` must fill to be applied."""
+    if spec["op"] in ("remove", "update"):
+        return schema["tables"][spec["table"]]["key"]
+    return spec["required"]
+
+
+def updated_columns(spec, df):
+    """Columns the rows `df` of an update sheet `spec` set (None for other sheets).
+
+    Only non-null cells overwrite the master, so a column left empty in every
+    row is not updated.
+    """
+    if spec["op"] != "update":
+        return None
+    return [col for col in spec["columns"] if col in df and df[col].notna().any()]
+
+
+def sheet_tables(spec, schema=MASTER_SCHEMA):
+    """Master tables applying the queue sheet `spec` can change, cascades included."""
+    tables = [spec["table"]]
+    if spec["op"] == "remove":
+        tables += [
+            child
+            for child, _, ref in child_references(spec["table"], schema)
+            if ref["on_delete"] == "cascade"
+        ]
+    return tables
+
+
+def queue_tables(sheet_names, schema=MASTER_SCHEMA):
+    """Master tables that applying the queue sheets `sheet_names` needs.
+
+    That is the tables the sheets change (cascades included), the parents
+    their rows are validated against and, for removals, every table that
+    references the removed rows. Returned in the schema's table order.
+    """
+    needed = set()
+    for spec in schema["sheets"]:
+        if spec["sheet"] not in sheet_names:
+            continue
+        table = spec["table"]
+        needed.update(sheet_tables(spec, schema))
+        if spec["op"] == "remove":
+            needed.update(child for child, _, _ in child_references(table, schema))
+        else:
+            references = schema["tables"][table].get("references", {})
+            needed.update(ref["table"] for ref in references.values())
+    return [table for table in table_names(schema) if table in needed]
+
+
+def restricts_removal(spec, schema=MASTER_SCHEMA):
+    """True for removals that are refused while rows still reference the table."""
+    return spec["op"] == "remove" and any(
+        ref["on_delete"] == "restrict"
+        for _, _, ref in child_references(spec["table"], schema)
+    )
+
+
+# --- Dtype enforcement ---
+
+
+def cast_column(series, dtype):
+    """Casts one column to a schema dtype (no copy if it already matches)."""
+    if dtype == "category":
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            return series
+        # Category labels are strings, like the keys they point to
+        return series.astype("str").astype("category")
+    if dtype.startswith("datetime64"):
+        if series.dtype == dtype:
+            return series
+        return pd.to_datetime(series, errors="coerce").astype(dtype)
+    if series.dtype == dtype:
+        return series
+    return series.astype(dtype)
+
+
+def enforce_schema(master, schema=MASTER_SCHEMA):
+    """Casts the loaded master tables to `schema` in place and returns them.
+
+    Categories left over from removed rows are dropped on the way.
+    """
+    for name, df in master.items():
+        dtypes = schema["tables"].get(name, {}).get("dtypes", {})
+        for column, dtype in dtypes.items():
+            if column not in df:
+                continue
+            series = cast_column(df[column], dtype)
+            if dtype == "category":
+                series = series.cat.remove_unused_categories()
+            df[column] = series
+    return master
+
+
+def conform_rows(table_df, rows, table, schema=MASTER_SCHEMA):
+    """Prepares `rows` for concat into / assignment onto `table_df`.
+
+    Returns (table_df, rows): the rows cast to the table's schema dtypes, and
+    the table with every categorical column widened to the rows' new labels,
+    so pandas keeps the columns categorical instead of falling back to object.
+    """
+    rows = rows.copy()
+    dtypes = schema["tables"][table].get("dtypes", {})
+    for column, dtype in dtypes.items():
+        if column not in rows or column not in table_df:
+            continue
+        values = cast_column(rows[column], dtype)
+        if dtype == "category":
+            current = table_df[column].cat.categories
+            new_labels = values.cat.categories.difference(current)
+            if len(new_labels):
+                table_df[column] = table_df[column].cat.add_categories(new_labels)
+            values = values.astype(table_df[column].dtype)
+        rows[column] = values
+    return table_df, rows
+
+
+def reject_invalid_values(df, table, schema=MASTER_SCHEMA):
+    """Splits a queue sheet into rows `table` can hold and rows it cannot.
+
+    Every integer column of the table is coerced to numbers; a cell holding
+    text, a fraction or a number outside the dtype's range rejects its row
+    (instead of failing the cast, and with it the run). Empty cells pass.
+    Returns (valid rows, rejected rows with their Reason).
+    """
+    reasons = pd.Series(None, index=df.index, dtype="object")
+    dtypes = schema["tables"][table].get("dtypes", {})
+    # Rejected rows are reported with the values as they were in the queue
+    queued = df
+    for column, dtype in dtypes.items():
+        if column not in df or not dtype.lower().startswith(("int", "uint")):
+            continue
+        values = pd.to_numeric(df[column], errors="coerce")
+        bounds = np.iinfo(np.dtype(dtype.lower()))
+        whole = values.notna() & (values % 1 == 0)
+        invalid = df[column].notna() & ~(whole & values.between(bounds.min, bounds.max))
+        reasons = reasons.mask(
+            invalid & reasons.isna(),
+            f"{column} must be a whole number from {bounds.min} to {bounds.max}.",
+        )
+        df = df.assign(**{column: values})
+    is_rejected = reasons.notna()
+    return df[~is_rejected], queued[is_rejected].assign(Reason=reasons[is_rejected])
+
+
+def queue_key_dtypes(schema=MASTER_SCHEMA):
+    """Queue column -> dtype for every column that holds a master key.
+
+    String and categorical keys are plain strings in the queue; integer keys
+    use the nullable integer dtype so empty cells survive until dropna.
+    """
+    dtypes = {}
+    for table in schema["tables"].values():
+        for column in [*table["key"], *table.get("references", {})]:
+            dtype = table["dtypes"].get(column, "str")
+            if dtype in ("str", "category"):
+                dtype = "str"
+            elif dtype.startswith("int"):
+                dtype = dtype.capitalize()
+            dtypes.setdefault(column, dtype)
+    return dtypes
+
+
+def conform_queue(df, schema=MASTER_SCHEMA):
+    """Types the key columns of a queue sheet (or chunk) like the master, once."""
+    for column, dtype in queue_key_dtypes(schema).items():
+        if column not in df:
+            continue
+        if dtype == "str":
+            if not isinstance(df[column].dtype, pd.StringDtype):
+                df[column] = df[column].where(
+                    df[column].isna(), df[column].astype("str")
+                )
+        elif df[column].dtype != dtype:
+            df[column] = df[column].astype(dtype)
+    return df
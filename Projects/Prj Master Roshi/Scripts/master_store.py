@@ -0,0 +1,980 @@
+import importlib.util
+import os
+import shutil
+import sqlite3
+from datetime import date
+
+import pandas as pd
+
+from commit_journal import commit_files, fsync_path, staged_path
+from etl_metrics import RunMetrics
+from master_schema import (
+    MASTER_SCHEMA,
+    child_references,
+    conform_queue,
+    reject_invalid_values,
+    sheet_columns,
+    table_keys,
+    table_names,
+    updated_columns,
+)
+from queue_reader import read_sheets_parallel
+
+# --- MASTER STORE BACKENDS ---
+# The master tables (Employees, Skills, Teams, Employee_Skills_Map by default,
+# or whatever a schema config declares) used to live only in
+# Master_Database.xlsx. Every backend below exposes the same small
+# interface (exists / load / save / delete / export_excel) so the ETL engine
+# does not care where the tables are kept. File stores never write in place:
+# `stage` writes the next version of each file next to it (see commit_journal)
+# and `save` commits the staged files with atomic renames. Stores that set
+# `applies_queue_natively` can also apply an update queue themselves.
+
+MASTER_TABLES = table_names(MASTER_SCHEMA)
+
+
+def row_keys(df, key_cols):
+    """Returns the key of every row: a string, or a tuple of strings for composite keys."""
+    if len(key_cols) == 1:
+        return df[key_cols[0]].astype(str).tolist()
+    return list(zip(*(df[col].astype(str) for col in key_cols)))
+
+
+# --- CHANGE TRACKING ---
+
+
+class ChangeSet:
+    """Row-level deltas recorded while an update queue is applied.
+
+    Keys are tracked per table as inserted / updated / deleted, netting out
+    within the run (insert then delete is no change, delete then insert is an
+    update). Stores use it to write only the tables and rows that changed.
+    `cascaded` counts the rows each table's removals took from the tables
+    referencing it: {table: {child table: rows}}.
+    """
+
+    def __init__(self, tables=MASTER_TABLES):
+        self.tables = list(tables)
+        self.inserted = {}
+        self.updated = {}
+        self.deleted = {}
+        self.cascaded = {}
+
+    def _keys(self, kind, table):
+        return getattr(self, kind).setdefault(table, set())
+
+    def record_insert(self, table, keys):
+        inserted, updated, deleted = (
+            self._keys(k, table) for k in ("inserted", "updated", "deleted")
+        )
+        for key in keys:
+            if key in deleted:
+                deleted.discard(key)
+                updated.add(key)
+            else:
+                inserted.add(key)
+
+    def record_update(self, table, keys):
+        inserted, updated = self._keys("inserted", table), self._keys("updated", table)
+        updated.update(key for key in keys if key not in inserted)
+
+    def record_delete(self, table, keys):
+        inserted, updated, deleted = (
+            self._keys(k, table) for k in ("inserted", "updated", "deleted")
+        )
+        for key in keys:
+            if key in inserted:
+                inserted.discard(key)
+            else:
+                updated.discard(key)
+                deleted.add(key)
+
+    def record_cascade(self, table, child, rows):
+        children = self.cascaded.setdefault(table, {})
+        children[child] = children.get(child, 0) + rows
+
+    def is_dirty(self, table):
+        return any(
+            getattr(self, kind).get(table)
+            for kind in ("inserted", "updated", "deleted")
+        )
+
+    def dirty_tables(self):
+        tables = set(self.inserted) | set(self.updated) | set(self.deleted)
+        return [
+            table for table in self.tables if table in tables and self.is_dirty(table)
+        ]
+
+    def summary(self):
+        """Returns {table: {"inserted": n, "updated": n, "deleted": n}} for dirty tables."""
+        return {
+            table: {
+                kind: len(getattr(self, kind).get(table, ()))
+                for kind in ("inserted", "updated", "deleted")
+            }
+            for table in self.dirty_tables()
+        }
+
+
+class LazyMaster(dict):
+    """The master tables loaded so far; any other table is loaded on first access.
+
+    `master[name]` loads a table not read yet through `load(name)`, while
+    `in`, iteration and `get` only see the tables loaded so far, so a run
+    never reads a table it does not use.
+    """
+
+    def __init__(self, tables, load, names):
+        super().__init__(tables)
+        self.load = load
+        self.names = list(names)
+
+    @property
+    def complete(self):
+        return all(name in self for name in self.names)
+
+    def __missing__(self, name):
+        if name not in self.names:
+            raise KeyError(name)
+        df = self[name] = self.load(name)
+        return df
+
+
+def parquet_available():
+    """Returns True when a Parquet engine (pyarrow or fastparquet) is installed."""
+    return any(
+        importlib.util.find_spec(engine) is not None
+        for engine in ("pyarrow", "fastparquet")
+    )
+
+
+class ExcelMasterStore:
+    """Legacy store: one workbook with one sheet per master table.
+
+    With `workers` > 1 the sheets are parsed concurrently in a process pool;
+    with a `cache` (WorkbookCache) an unchanged workbook is not reparsed.
+    """
+
+    def __init__(self, path, tables=MASTER_TABLES, workers=None, cache=None):
+        self.path = path
+        self.tables = list(tables)
+        self.workers = workers
+        self.cache = cache
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def fingerprint(self):
+        """Changes whenever the workbook is rewritten (used to validate cached indexes)."""
+        stat = os.stat(self.path)
+        return (stat.st_size, stat.st_mtime_ns)
+
+    def load(self, tables=None, columns=None):
+        """Reads the requested sheets (all tables by default) into DataFrames."""
+        tables = list(tables or self.tables)
+        if self.cache is not None and self.exists():
+            master = self.cache.load(self.path, tables, self._parse)
+        else:
+            master = self._parse(tables)
+        if columns:
+            for name, cols in columns.items():
+                if name in master:
+                    master[name] = master[name][cols]
+        return master
+
+    def _parse(self, tables):
+        if self.workers and self.workers > 1:
+            return read_sheets_parallel(self.path, tables, self.workers)
+        return pd.read_excel(self.path, sheet_name=tables)
+
+    def output_paths(self):
+        return [self.path]
+
+    def stage(self, master, changes=None):
+        """Writes the next workbook to its staged path; returns [(staged, final)].
+
+        A subset of the tables replaces only those sheets of a copy of the
+        current workbook.
+        """
+        if changes is not None:
+            master = {name: master[name] for name in changes.dirty_tables()}
+            if not master:
+                return []
+        staged = staged_path(self.path)
+        if self.exists() and set(master) != set(self.tables):
+            shutil.copyfile(self.path, staged)
+            writer = pd.ExcelWriter(
+                staged, engine="openpyxl", mode="a", if_sheet_exists="replace"
+            )
+        else:
+            writer = pd.ExcelWriter(staged, engine="openpyxl")
+        with writer:
+            for name, df in master.items():
+                df.to_excel(writer, sheet_name=name, index=False)
+        fsync_path(staged)
+        if self.cache is not None:
+            self.cache.invalidate(self.path)
+        return [(staged, self.path)]
+
+    def save(self, master, changes=None):
+        """Writes the given tables; a subset replaces only those sheets."""
+        commit_files(self.stage(master, changes))
+
+    def delete(self):
+        if self.exists():
+            os.remove(self.path)
+        if self.cache is not None:
+            self.cache.invalidate(self.path)
+
+    def export_excel(self, path):
+        if os.path.abspath(path) != os.path.abspath(self.path):
+            shutil.copyfile(self.path, staged_path(path))
+            commit_files([(staged_path(path), path)])
+
+
+class ParquetMasterStore:
+    """Columnar store: one Parquet file per master table inside a directory.
+
+    Loading a subset of tables or columns only reads those files/columns, and
+    saving a table rewrites that table's file alone.
+    """
+
+    def __init__(self, directory, tables=MASTER_TABLES):
+        self.directory = directory
+        self.tables = list(tables)
+
+    def table_path(self, name):
+        return os.path.join(self.directory, f"{name}.parquet")
+
+    def exists(self):
+        return all(os.path.exists(self.table_path(name)) for name in self.tables)
+
+    def fingerprint(self):
+        """Changes whenever any table file is rewritten (used to validate cached indexes)."""
+        return tuple(
+            (
+                name,
+                os.stat(self.table_path(name)).st_size,
+                os.stat(self.table_path(name)).st_mtime_ns,
+            )
+            for name in self.tables
+        )
+
+    def load(self, tables=None, columns=None):
+        """Reads the requested tables; `columns` maps table name -> column list."""
+        columns = columns or {}
+        return {
+            name: pd.read_parquet(self.table_path(name), columns=columns.get(name))
+            for name in (tables or self.tables)
+        }
+
+    def output_paths(self):
+        return [self.table_path(name) for name in self.tables]
+
+    def stage(self, master, changes=None):
+        """Writes the given tables (only the dirty ones with `changes`) to staged files.
+
+        Returns the [(staged, final)] pairs to commit.
+        """
+        if changes is not None:
+            master = {name: master[name] for name in changes.dirty_tables()}
+        os.makedirs(self.directory, exist_ok=True)
+        files = []
+        for name, df in master.items():
+            staged = staged_path(self.table_path(name))
+            df.to_parquet(staged, index=False)
+            fsync_path(staged)
+            files.append((staged, self.table_path(name)))
+        return files
+
+    def save(self, master, changes=None):
+        """Rewrites the files of the given tables (only the dirty ones with `changes`)."""
+        commit_files(self.stage(master, changes))
+
+    def delete(self):
+        if os.path.isdir(self.directory):
+            shutil.rmtree(self.directory)
+
+    def export_excel(self, path):
+        """Writes a human-readable copy of every table to a single workbook."""
+        master = self.load()
+        with pd.ExcelWriter(staged_path(path), engine="openpyxl") as writer:
+            for name, df in master.items():
+                df.to_excel(writer, sheet_name=name, index=False)
+        commit_files([(staged_path(path), path)])
+
+    def import_excel(self, path):
+        """One-off migration of an existing Master_Database.xlsx into Parquet."""
+        self.save(ExcelMasterStore(path, self.tables).load())
+
+
+# --- SQLITE BACKEND ---
+# Keys, indexes and cascades from the schema config are declared in the
+# database so it enforces the integrity rules the pandas pipeline implements
+# with its key indexes.
+
+
+def _sql_type(dtype):
+    if dtype.lower().startswith("int"):
+        return "INTEGER"
+    if dtype.startswith("float"):
+        return "REAL"
+    if dtype.startswith("datetime64"):
+        return "TIMESTAMP"
+    return "TEXT"
+
+
+def sqlite_ddl(schema=MASTER_SCHEMA):
+    """CREATE TABLE/INDEX statements for the tables of a schema config.
+
+    Referenced tables are created first; every foreign-key column that does
+    not lead the primary key gets an index for cascades and existence checks.
+    """
+    tables = schema["tables"]
+    ordered = []
+
+    def visit(name):
+        if name in ordered:
+            return
+        for reference in tables[name].get("references", {}).values():
+            if reference["table"] != name:
+                visit(reference["table"])
+        ordered.append(name)
+
+    for name in tables:
+        visit(name)
+
+    statements = []
+    for name in ordered:
+        table = tables[name]
+        key, references = table["key"], table.get("references", {})
+        not_null = set(table.get("not_null", ()))
+        lines = []
+        for column, dtype in table["dtypes"].items():
+            line = f"{_quote(column)} {_sql_type(dtype)}"
+            if key == [column]:
+                line += " PRIMARY KEY"
+            elif column in not_null:
+                line += " NOT NULL"
+            if column in references:
+                reference = references[column]
+                parent_key = tables[reference["table"]]["key"][0]
+                line += (
+                    f" REFERENCES {_quote(reference['table'])} ({_quote(parent_key)})"
+                    f" ON DELETE {reference['on_delete'].upper()}"
+                )
+            lines.append(line)
+        if len(key) > 1:
+            lines.append(f"PRIMARY KEY ({', '.join(_quote(c) for c in key)})")
+        statements.append(
+            f"CREATE TABLE IF NOT EXISTS {_quote(name)} (\n    "
+            + ",\n    ".join(lines)
+            + "\n);"
+        )
+        for column in references:
+            if key[0] != column:
+                statements.append(
+                    f"CREATE INDEX IF NOT EXISTS "
+                    f"{_quote(f'idx_{name}_{column}'.lower())} "
+                    f"ON {_quote(name)} ({_quote(column)});"
+                )
+    return "\n".join(statements)
+
+
+def _quote(name):
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def _to_sql_value(value):
+    """Converts pandas/numpy scalars into values the sqlite3 module accepts."""
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return None
+    if isinstance(value, date):
+        # One fixed format so TIMESTAMP columns parse back consistently
+        return pd.Timestamp(value).strftime("%Y-%m-%d %H:%M:%S.%f")
+    if hasattr(value, "item"):
+        return value.item()
+    return value
+
+
+def _sql_rows(df, columns):
+    """Yields one parameter tuple per DataFrame row for executemany."""
+    for row in df[columns].itertuples(index=False, name=None):
+        yield tuple(_to_sql_value(value) for value in row)
+
+
+class SQLiteMasterStore:
+    """Relational store: the master tables in one SQLite file with declared keys.
+
+    Besides the common load/save interface it can apply an update queue
+    directly (`apply_updates`), turning each queue sheet into one batched
+    `executemany` inside a single transaction.
+    With `history`, every version of every row is kept in a <Table>_History
+    table with its Valid_From/Valid_To times, written by triggers in the same
+    transaction as the change (cascades included), and `as_of` reads the
+    tables as they were at any past time.
+    """
+
+    applies_queue_natively = True
+
+    def __init__(self, path, schema=MASTER_SCHEMA, history=False):
+        self.path = path
+        self.schema = schema
+        self.tables = table_names(schema)
+        self.keys = table_keys(schema)
+        self.ddl = sqlite_ddl(schema)
+        self.history = history
+
+    def connect(self):
+        conn = sqlite3.connect(self.path)
+        conn.execute("PRAGMA foreign_keys = ON")
+        conn.executescript(self.ddl)
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS Commit_Log "
+            "(Commit_ID TEXT PRIMARY KEY, Committed_At TIMESTAMP)"
+        )
+        if self.history:
+            self._create_history(conn)
+        return conn
+
+    # --- Point-in-time history ---
+
+    @staticmethod
+    def _history_table(name):
+        return f"{name}_History"
+
+    def _create_history(self, conn):
+        """Creates missing history tables (seeded with the current rows) and columns."""
+        found = {name for (name,) in conn.execute("SELECT name FROM sqlite_master")}
+        now = _to_sql_value(pd.Timestamp.now())
+        with conn:
+            for name in self.tables:
+                history = self._history_table(name)
+                columns = self._columns(conn, name)
+                if history not in found:
+                    types = {
+                        row[1]: row[2]
+                        for row in conn.execute(f"PRAGMA table_info({_quote(name)})")
+                    }
+                    conn.execute(
+                        f"CREATE TABLE {_quote(history)} ("
+                        + ", ".join(f"{_quote(c)} {types[c]}" for c in columns)
+                        + ", Valid_From TIMESTAMP NOT NULL, Valid_To TIMESTAMP)"
+                    )
+                    conn.execute(
+                        f"CREATE INDEX {_quote(f'idx_{history}_key'.lower())} ON "
+                        f"{_quote(history)} ({', '.join(_quote(c) for c in self.keys[name])})"
+                    )
+                    # History starts with the rows already there
+                    select = ", ".join(_quote(c) for c in columns)
+                    conn.execute(
+                        f"INSERT INTO {_quote(history)} ({select}, Valid_From) "
+                        f"SELECT {select}, ? FROM {_quote(name)}",
+                        (now,),
+                    )
+                    continue
+                # Columns added to the table since (see save) are versioned too
+                for column in columns:
+                    if column not in self._columns(conn, history):
+                        conn.execute(
+                            f"ALTER TABLE {_quote(history)} ADD COLUMN {_quote(column)}"
+                        )
+
+    def _track_history(self, conn, changed_at):
+        """Installs this connection's triggers versioning every change at `changed_at`.
+
+        A row changed twice in one transaction keeps one version for it; its
+        triggers are TEMP, so only writes made through this store are tracked.
+        """
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS history_clock (ts TIMESTAMP)")
+        conn.execute("DELETE FROM temp.history_clock")
+        conn.execute(
+            "INSERT INTO temp.history_clock VALUES (?)", (_to_sql_value(changed_at),)
+        )
+        clock = "(SELECT ts FROM history_clock)"
+        for name in self.tables:
+            history = _quote(self._history_table(name))
+            columns = self._columns(conn, name)
+
+            def close(row):
+                match = " AND ".join(
+                    f"{_quote(c)} = {row}.{_quote(c)}" for c in self.keys[name]
+                )
+                # A version opened by this same transaction is dropped, not closed
+                return (
+                    f"DELETE FROM {history} WHERE {match} AND Valid_To IS NULL "
+                    f"AND Valid_From = {clock}; "
+                    f"UPDATE {history} SET Valid_To = {clock} "
+                    f"WHERE {match} AND Valid_To IS NULL; "
+                )
+
+            open_version = (
+                f"INSERT INTO {history} ({', '.join(_quote(c) for c in columns)}, Valid_From) "
+                f"VALUES ({', '.join(f'NEW.{_quote(c)}' for c in columns)}, {clock}); "
+            )
+            for event, body in (
+                ("INSERT", close("NEW") + open_version),
+                ("UPDATE", close("OLD") + open_version),
+                ("DELETE", close("OLD")),
+            ):
+                trigger = _quote(f"history_{name}_{event}".lower())
+                conn.execute(
+                    f"CREATE TEMP TRIGGER IF NOT EXISTS {trigger} AFTER {event} "
+                    f"ON main.{_quote(name)} BEGIN {body} END"
+                )
+
+    def as_of(self, when, tables=None):
+        """The tables as they were at `when`, read from their history tables."""
+        if not self.history:
+            raise ValueError("This SQLite master store keeps no history.")
+        when = _to_sql_value(pd.Timestamp(when))
+        conn = self.connect()
+        try:
+            master = {}
+            for name in tables or self.tables:
+                columns = self._columns(conn, name)
+                master[name] = pd.read_sql_query(
+                    f"SELECT {', '.join(_quote(c) for c in columns)} "
+                    f"FROM {_quote(self._history_table(name))} "
+                    "WHERE Valid_From <= ? AND (Valid_To IS NULL OR Valid_To > ?)",
+                    conn,
+                    params=(when, when),
+                    parse_dates=self._date_columns(conn, name),
+                )
+            return master
+        finally:
+            conn.close()
+
+    def output_paths(self):
+        # Changes are committed by SQLite's own transaction, not by file renames
+        return []
+
+    def has_commit(self, commit_id):
+        """True if the run journaled as `commit_id` committed its transaction."""
+        if not os.path.exists(self.path):
+            return False
+        conn = self.connect()
+        try:
+            row = conn.execute(
+                "SELECT 1 FROM Commit_Log WHERE Commit_ID = ?", (commit_id,)
+            ).fetchone()
+        finally:
+            conn.close()
+        return row is not None
+
+    def exists(self):
+        if not os.path.exists(self.path):
+            return False
+        with sqlite3.connect(self.path) as conn:
+            found = {
+                name
+                for (name,) in conn.execute(
+                    "SELECT name FROM sqlite_master WHERE type = 'table'"
+                )
+            }
+        return set(self.tables) <= found
+
+    def _columns(self, conn, name):
+        return [row[1] for row in conn.execute(f"PRAGMA table_info({_quote(name)})")]
+
+    def _date_columns(self, conn, name):
+        return [
+            row[1]
+            for row in conn.execute(f"PRAGMA table_info({_quote(name)})")
+            if row[2].upper() == "TIMESTAMP"
+        ]
+
+    def load(self, tables=None, columns=None):
+        columns = columns or {}
+        conn = self.connect()
+        try:
+            master = {}
+            for name in tables or self.tables:
+                cols = columns.get(name) or self._columns(conn, name)
+                select = ", ".join(_quote(c) for c in cols)
+                master[name] = pd.read_sql_query(
+                    f"SELECT {select} FROM {_quote(name)}",
+                    conn,
+                    parse_dates=[
+                        c for c in self._date_columns(conn, name) if c in cols
+                    ],
+                )
+            return master
+        finally:
+            conn.close()
+
+    def save(self, master, changes=None):
+        """Replaces the given tables wholesale, or patches only the changed rows.
+
+        Foreign keys are switched off for the bulk copy because legacy workbooks
+        may hold orphaned map rows; they are enforced again for queue updates.
+        """
+        conn = self.connect()
+        try:
+            conn.execute("PRAGMA foreign_keys = OFF")
+            with conn:
+                if self.history:
+                    self._track_history(conn, pd.Timestamp.now())
+                tables = changes.dirty_tables() if changes is not None else list(master)
+                for name in tables:
+                    df = master[name]
+                    known = self._columns(conn, name)
+                    for col in df.columns:
+                        if col not in known:
+                            conn.execute(
+                                f"ALTER TABLE {_quote(name)} ADD COLUMN {_quote(col)}"
+                            )
+                    if changes is None:
+                        conn.execute(f"DELETE FROM {_quote(name)}")
+                    else:
+                        df = self._patch(conn, name, df, changes)
+                    self._insert(conn, name, df, verb="INSERT OR REPLACE")
+        finally:
+            conn.close()
+
+    def _patch(self, conn, name, df, changes):
+        """Deletes removed keys; returns only the inserted/updated rows to upsert."""
+        key_cols = self.keys[name]
+        where = " AND ".join(f"{_quote(c)} = ?" for c in key_cols)
+        deleted = changes.deleted.get(name, set())
+        conn.executemany(
+            f"DELETE FROM {_quote(name)} WHERE {where}",
+            (key if isinstance(key, tuple) else (key,) for key in deleted),
+        )
+        upserts = changes.inserted.get(name, set()) | changes.updated.get(name, set())
+        keys = pd.Series(row_keys(df, key_cols), index=df.index, dtype="object")
+        return df[keys.isin(upserts)]
+
+    def delete(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def export_excel(self, path):
+        master = self.load()
+        with pd.ExcelWriter(staged_path(path), engine="openpyxl") as writer:
+            for name, df in master.items():
+                df.to_excel(writer, sheet_name=name, index=False)
+        commit_files([(staged_path(path), path)])
+
+    def import_excel(self, path):
+        self.save(ExcelMasterStore(path, self.tables).load())
+
+    # --- Queue application ---
+
+    def _stage(self, conn, df, key_cols):
+        """Copies a queue sheet into an indexed temp table keyed by row position."""
+        conn.execute("DROP TABLE IF EXISTS temp.stage")
+        cols = list(df.columns)
+        conn.execute(
+            "CREATE TEMP TABLE stage (row_id INTEGER PRIMARY KEY, "
+            + ", ".join(_quote(c) for c in cols)
+            + ")"
+        )
+        conn.executemany(
+            f"INSERT INTO temp.stage VALUES (?, {', '.join('?' for _ in cols)})",
+            ((row_id,) + values for row_id, values in enumerate(_sql_rows(df, cols))),
+        )
+        conn.execute(
+            "CREATE INDEX temp.idx_stage_key ON stage ("
+            + ", ".join(_quote(c) for c in key_cols)
+            + ")"
+        )
+
+    def _reject(self, conn, df, reason_sql):
+        """Runs a CASE expression over the staged sheet; returns (valid, rejected)."""
+        reasons = pd.Series(
+            dict(conn.execute(f"SELECT row_id, {reason_sql} FROM temp.stage s"))
+        ).reindex(range(len(df)))
+        is_rejected = reasons.notna().to_numpy()
+        rejected = df[is_rejected].assign(Reason=reasons[is_rejected].to_numpy())
+        return df[~is_rejected], rejected
+
+    def _insert(self, conn, name, df, verb="INSERT"):
+        cols = [c for c in df.columns if c in self._columns(conn, name)]
+        conn.executemany(
+            f"{verb} INTO {_quote(name)} ({', '.join(_quote(c) for c in cols)}) "
+            f"VALUES ({', '.join('?' for _ in cols)})",
+            _sql_rows(df, cols),
+        )
+
+    def apply_updates(
+        self, update_sheets, verbose=True, metrics=None, commit_id=None, on_commit=None
+    ):
+        """Applies every queue sheet in one transaction.
+
+        Returns the rejected rows as {sheet: DataFrame} (see apply_update_batch).
+        Per-sheet timings and rows in/out/rejected are added to `metrics`.
+        """
+        return self.apply_update_batch(
+            [update_sheets], verbose, metrics, commit_id, on_commit
+        )[0]
+
+    def apply_update_batch(
+        self,
+        batches,
+        verbose=True,
+        metrics=None,
+        commit_id=None,
+        on_commit=None,
+        on_applied=None,
+    ):
+        """Applies several queues (any iterable, e.g. of chunks) in order in one transaction.
+
+        Returns the rejected rows of each queue as {sheet: DataFrame}, in the
+        order given; with `on_applied(position, rejections)` they are handed
+        over as each queue is applied instead (e.g. to a RejectionWriter) and
+        not kept. Nothing is committed if any queue fails. `commit_id` (a
+        CommitJournal id) is recorded in the same transaction, and
+        `on_commit()` runs just before the commit; if it raises, everything is
+        rolled back.
+        """
+        log = print if verbose else (lambda *args, **kwargs: None)
+        if metrics is None:
+            metrics = RunMetrics()
+
+        conn = self.connect()
+        try:
+            with conn:
+                # Opened explicitly: sqlite3 does not open one before a SAVEPOINT,
+                # whose RELEASE would then commit the removals on their own
+                conn.execute("BEGIN")
+                if self.history:
+                    self._track_history(conn, pd.Timestamp.now())
+                results = []
+                for position, update_sheets in enumerate(batches):
+                    rejections = self._apply_queue(conn, update_sheets, log, metrics)
+                    if on_applied is None:
+                        results.append(rejections)
+                    else:
+                        on_applied(position, rejections)
+                conn.execute("DROP TABLE IF EXISTS temp.stage")
+                if commit_id is not None:
+                    conn.execute(
+                        "INSERT INTO Commit_Log VALUES (?, ?)",
+                        (commit_id, _to_sql_value(pd.Timestamp.now())),
+                    )
+                if on_commit is not None:
+                    on_commit()
+        finally:
+            conn.close()
+        return results
+
+    def _apply_queue(self, conn, update_sheets, log, metrics):
+        """Applies one queue's sheets on an open transaction; returns its rejections.
+
+        Rejected rows keep their position in the queue sheet as index.
+        """
+        rejections = {}
+        metrics.start_lap()
+        for spec in self.schema["sheets"]:
+            name = spec["sheet"]
+            df = update_sheets.get(name)
+            if df is None or df.empty:
+                continue
+            df, invalid = reject_invalid_values(
+                df.dropna(subset=sheet_columns(spec, self.schema)),
+                spec["table"],
+                self.schema,
+            )
+            if not invalid.empty:
+                log(f"  - Rejected {len(invalid)} {name} row(s) with invalid values.")
+            # The operations work by position; the sheet positions are put back after
+            positions = df.index
+            df = conform_queue(df.reset_index(drop=True), self.schema)
+            apply = getattr(self, f"_{spec['op']}_rows")
+            rows_out, bad = apply(conn, spec, df, log)
+            bad = bad.set_axis(positions[bad.index])
+            if not invalid.empty:
+                bad = pd.concat([invalid, bad]).sort_index()
+            if not bad.empty:
+                rejections[name] = bad
+            metrics.record_sheet(
+                name,
+                len(update_sheets[name]),
+                rows_out,
+                len(bad),
+                updated_columns(spec, df),
+            )
+        return rejections
+
+    # --- Generic sheet operations (see master_schema) ---
+    # Each returns (master rows changed, rejected rows with their Reason).
+
+    def _label(self, table):
+        return self.schema["tables"][table]["label"]
+
+    def _reference_checks(self, table, alias, columns=None):
+        """CASE branches rejecting rows whose foreign keys have no parent row."""
+        branches = []
+        for column, ref in self.schema["tables"][table].get("references", {}).items():
+            if columns is not None and column not in columns:
+                continue
+            parent_key = self.keys[ref["table"]][0]
+            reason = ref["missing"].replace("'", "''")
+            branches.append(f"""WHEN {alias}.{_quote(column)} IS NOT NULL
+                       AND NOT EXISTS (SELECT 1 FROM {_quote(ref['table'])} r
+                                       WHERE r.{_quote(parent_key)} = {alias}.{_quote(column)})
+                     THEN '{reason}'""")
+        return branches
+
+    def _remove_rows(self, conn, spec, df, log):
+        """Deletes by key; a restricted reference rolls the whole sheet back."""
+        table = spec["table"]
+        key = self.keys[table][0]
+        ids = [(_to_sql_value(i),) for i in df[key].unique()]
+        children = child_references(table, self.schema)
+        cascades = [
+            (child, column)
+            for child, column, ref in children
+            if ref["on_delete"] == "cascade"
+        ]
+        # Rows removed by cascades are counted up front: rowcount leaves out
+        # foreign-key actions, and total_changes also counts history triggers
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS remove_keys (key)")
+        conn.execute("DELETE FROM temp.remove_keys")
+        conn.executemany("INSERT INTO temp.remove_keys VALUES (?)", ids)
+        cascaded = sum(
+            conn.execute(
+                f"SELECT COUNT(*) FROM {_quote(child)} "
+                f"WHERE {_quote(column)} IN (SELECT key FROM temp.remove_keys)"
+            ).fetchone()[0]
+            for child, column in cascades
+        )
+        conn.execute("SAVEPOINT remove_rows")
+        try:
+            removed = conn.executemany(
+                f"DELETE FROM {_quote(table)} WHERE {_quote(key)} = ?", ids
+            ).rowcount
+            conn.execute("RELEASE remove_rows")
+        except sqlite3.IntegrityError:
+            conn.execute("ROLLBACK TO remove_rows")
+            conn.execute("RELEASE remove_rows")
+            linked = 0
+            for child, column, ref in children:
+                if ref["on_delete"] == "restrict":
+                    linked += conn.execute(
+                        f"SELECT COUNT(*) FROM {_quote(child)} WHERE {_quote(column)} IN "
+                        f"({', '.join('?' for _ in ids)})",
+                        [i for (i,) in ids],
+                    ).fetchone()[0]
+            log(
+                f"  - WARNING: Cannot remove {len(ids)} {self._label(table)}(s) as {linked} linked row(s) still reference them."
+            )
+            return 0, df.iloc[0:0]
+
+        for child, column in cascades:
+            # Orphaned legacy rows have no parent row to cascade from
+            conn.executemany(
+                f"DELETE FROM {_quote(child)} WHERE {_quote(column)} = ?", ids
+            )
+        log(
+            f"  - Removed {len(ids)} {self._label(table)}(s)"
+            + "".join(
+                f" and their associated {self._label(child)}s" for child, _ in cascades
+            )
+            + "."
+        )
+        return removed + cascaded, df.iloc[0:0]
+
+    def _add_rows(self, conn, spec, df, log):
+        """Inserts rows with new keys; existing and repeated keys are duplicates."""
+        table = spec["table"]
+        key = self.keys[table]
+        self._stage(conn, df, key)
+        match = " AND ".join(f"{_quote(c)} = s.{_quote(c)}" for c in key)
+        earlier = " AND ".join(f"p.{_quote(c)} = s.{_quote(c)}" for c in key)
+        # Only an earlier row that passes the reference checks is really added
+        joins = "".join(
+            f" JOIN {_quote(ref['table'])} r{i} ON r{i}.{_quote(self.keys[ref['table']][0])} = p.{_quote(column)}"
+            for i, (column, ref) in enumerate(
+                self.schema["tables"][table].get("references", {}).items()
+            )
+        )
+        duplicate = spec["duplicate"].replace("'", "''")
+        valid, bad = self._reject(
+            conn,
+            df,
+            f"""CASE WHEN EXISTS (SELECT 1 FROM {_quote(table)} WHERE {match})
+                          OR EXISTS (SELECT 1 FROM temp.stage p{joins}
+                                     WHERE {earlier} AND p.row_id < s.row_id)
+                     THEN '{duplicate}'
+                     {" ".join(self._reference_checks(table, "s"))} END""",
+        )
+        self._insert(conn, table, valid)
+        log(
+            f"  - Added {len(valid)} new {self._label(table)}(s). Rejected {len(bad)} duplicates/invalid entries."
+        )
+        return len(valid), bad
+
+    def _update_rows(self, conn, spec, df, log):
+        """UPDATE ... SET col = COALESCE(?, col) per row, so null cells keep the old value."""
+        table = spec["table"]
+        key = self.keys[table][0]
+        columns = [col for col in spec["columns"] if col in df]
+        self._stage(conn, df, [key])
+        valid, bad = self._reject(
+            conn,
+            df,
+            f"""CASE WHEN NOT EXISTS (SELECT 1 FROM {_quote(table)} t
+                                      WHERE t.{_quote(key)} = s.{_quote(key)})
+                     THEN '{spec["not_found"].replace("'", "''")}'
+                     {" ".join(self._reference_checks(table, "s", columns))} END""",
+        )
+        if columns:
+            assignments = ", ".join(
+                f"{_quote(c)} = COALESCE(?, {_quote(c)})" for c in columns
+            )
+            conn.executemany(
+                f"UPDATE {_quote(table)} SET {assignments} WHERE {_quote(key)} = ?",
+                _sql_rows(valid, columns + [key]),
+            )
+        updated = valid[key].nunique()
+        log(
+            f"  - Updated {updated} {self._label(table)}(s) with new information. Rejected {len(bad)} invalid updates."
+        )
+        return updated, bad
+
+    def _upsert_rows(self, conn, spec, df, log):
+        """Inserts or overwrites rows by key (last row wins)."""
+        table = spec["table"]
+        key = self.keys[table]
+        self._stage(conn, df, key)
+        checks = self._reference_checks(table, "s")
+        reasons = f"CASE {' '.join(checks)} END" if checks else "NULL"
+        valid, bad = self._reject(conn, df, reasons)
+        valid = valid.drop_duplicates(subset=key, keep="last")
+        self._insert(conn, table, valid, verb="INSERT OR REPLACE")
+        log(
+            f"  - Added/Updated {len(valid)} {self._label(table)}s. Rejected {len(bad)} invalid entries."
+        )
+        return len(valid), bad
+
+
+def get_master_store(
+    backend,
+    excel_path,
+    store_dir,
+    sqlite_path=None,
+    schema=MASTER_SCHEMA,
+    parse_workers=None,
+    workbook_cache=None,
+    history=False,
+):
+    """Builds the configured store, falling back to Excel if Parquet is unavailable.
+
+    `schema` is the deployment's schema config (see master_schema).
+    `parse_workers` (process-pool sheet parsing) and `workbook_cache` (a
+    WorkbookCache of parsed sheets) apply to the Excel store, `history`
+    (keep <Table>_History tables) to the SQLite store.
+    """
+    tables = table_names(schema)
+    if backend == "parquet":
+        if parquet_available():
+            return ParquetMasterStore(store_dir, tables)
+        print("WARNING: No Parquet engine installed (pyarrow). Falling back to Excel.")
+        return ExcelMasterStore(excel_path, tables, parse_workers, workbook_cache)
+    if backend == "sqlite":
+        return SQLiteMasterStore(sqlite_path, schema, history)
+    if backend == "excel":
+        return ExcelMasterStore(excel_path, tables, parse_workers, workbook_cache)
+    raise ValueError(f"Unknown master store backend: {backend!r}")
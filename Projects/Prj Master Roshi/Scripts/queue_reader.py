@@ -0,0 +1,222 @@
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+from openpyxl import load_workbook
+
+# --- UPDATE QUEUE READERS ---
+# An update queue is either the usual update_queue.xlsx workbook (one sheet per
+# transaction type) or a directory holding one <Sheet>.csv / <Sheet>.parquet
+# file per transaction type. The chunk readers below never hold more than
+# `chunk_size` rows of a sheet in memory at once.
+#
+# openpyxl parsing is CPU-bound and single-threaded, so whole-queue and
+# whole-workbook reads can opt into parsing one sheet per worker process
+# (`workers`); wall time then drops to about that of the largest sheet.
+# Runs over many queues (the archive replay) instead read whole queues ahead in
+# worker processes while the current one is applied (`prefetch_queues`).
+
+
+class QueueChangedError(RuntimeError):
+    """A queue was rewritten or replaced after it was read; the run must not archive it."""
+
+
+def queue_signature(queue_path):
+    """(st_mtime_ns, st_size, st_ino) of a queue workbook, or of a queue directory
+    and every file in it (None if it is gone).
+
+    Changes when the queue is rewritten, or replaced by another queue at the
+    same path, between reading and archiving it.
+    """
+
+    def signature(path):
+        stat = os.stat(path)
+        return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+    try:
+        if not os.path.isdir(queue_path):
+            return signature(queue_path)
+        return (signature(queue_path),) + tuple(
+            (name, signature(os.path.join(queue_path, name)))
+            for name in sorted(os.listdir(queue_path))
+        )
+    except FileNotFoundError:
+        return None
+
+
+def list_queue_sheets(queue_path):
+    """Returns the transaction sheet names present in a queue workbook or directory."""
+    if os.path.isdir(queue_path):
+        return [
+            os.path.splitext(name)[0]
+            for name in sorted(os.listdir(queue_path))
+            if name.endswith((".csv", ".parquet"))
+        ]
+    workbook = load_workbook(queue_path, read_only=True)
+    try:
+        return list(workbook.sheetnames)
+    finally:
+        workbook.close()
+
+
+def _parse_dates(chunk):
+    """CSV carries no types: parse *_Date columns like read_excel would."""
+    for col in chunk.columns:
+        if str(col).endswith("_Date"):
+            chunk[col] = pd.to_datetime(chunk[col], errors="coerce")
+    return chunk
+
+
+def _iter_excel_chunks(queue_path, sheet_name, chunk_size):
+    """Yields the sheet's rows as read_excel would parse them, `chunk_size` at a time.
+
+    Blank rows are kept (as all-null rows) so row positions, and with them
+    Source_Row, still match the workbook; trailing ones are dropped, as
+    read_excel drops them. Columns without a header are named "Unnamed: <n>".
+    """
+    workbook = load_workbook(queue_path, read_only=True)
+    try:
+        rows = workbook[sheet_name].iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        header = list(header)
+        while header and header[-1] is None:
+            header.pop()
+        columns = [
+            f"Unnamed: {position}" if col is None else col
+            for position, col in enumerate(header)
+        ]
+        blank_row = (None,) * len(columns)
+        buffer = []
+        blanks = 0  # blank rows not yet known to be followed by data
+        for row in rows:
+            if all(value is None for value in row):
+                blanks += 1
+                continue
+            for values in [blank_row] * blanks + [row[: len(columns)]]:
+                buffer.append(values)
+                if len(buffer) >= chunk_size:
+                    yield pd.DataFrame(buffer, columns=columns)
+                    buffer = []
+            blanks = 0
+        if buffer:
+            yield pd.DataFrame(buffer, columns=columns)
+    finally:
+        workbook.close()
+
+
+def _iter_parquet_chunks(path, chunk_size):
+    import pyarrow.parquet as pq
+
+    for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_size):
+        yield batch.to_pandas()
+
+
+def _iter_raw_chunks(queue_path, sheet_name, chunk_size):
+    if not os.path.isdir(queue_path):
+        yield from _iter_excel_chunks(queue_path, sheet_name, chunk_size)
+        return
+    csv_path = os.path.join(queue_path, f"{sheet_name}.csv")
+    if os.path.exists(csv_path):
+        for chunk in pd.read_csv(csv_path, chunksize=chunk_size):
+            yield _parse_dates(chunk)
+        return
+    parquet_path = os.path.join(queue_path, f"{sheet_name}.parquet")
+    if os.path.exists(parquet_path):
+        yield from _iter_parquet_chunks(parquet_path, chunk_size)
+
+
+def iter_sheet_chunks(queue_path, sheet_name, chunk_size=50_000):
+    """Yields DataFrames of at most `chunk_size` rows for one queue sheet.
+
+    Each chunk is indexed by its rows' positions in the whole sheet, so
+    rejections can point back at the source row.
+    """
+    start = 0
+    for chunk in _iter_raw_chunks(queue_path, sheet_name, chunk_size):
+        yield chunk.set_axis(pd.RangeIndex(start, start + len(chunk)))
+        start += len(chunk)
+
+
+def read_sheet(queue_path, sheet_name):
+    """Reads one whole queue sheet into a DataFrame."""
+    chunks = list(iter_sheet_chunks(queue_path, sheet_name))
+    return pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame()
+
+
+def _parse_sheet(path, sheet_name):
+    """Worker task: parses one sheet exactly as the serial readers would."""
+    if os.path.isdir(path):
+        return read_sheet(path, sheet_name)
+    return pd.read_excel(path, sheet_name=sheet_name)
+
+
+def read_sheets_parallel(path, sheet_names, workers):
+    """Parses the given sheets of a workbook (or queue directory) in a process pool.
+
+    Returns {sheet_name: DataFrame} in the order of `sheet_names`. Falls back to
+    parsing serially when only one core (or one sheet) is available.
+    """
+    sheet_names = list(sheet_names)
+    workers = min(workers, len(sheet_names), os.cpu_count() or 1)
+    if workers <= 1:
+        if os.path.isdir(path):
+            return {sheet: read_sheet(path, sheet) for sheet in sheet_names}
+        return pd.read_excel(path, sheet_name=sheet_names)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        frames = pool.map(_parse_sheet, [path] * len(sheet_names), sheet_names)
+        return dict(zip(sheet_names, frames))
+
+
+def read_queue(queue_path, workers=None):
+    """Reads a whole queue into {sheet_name: DataFrame}, like read_excel(sheet_name=None).
+
+    With `workers` > 1 the sheets are parsed concurrently in that many processes.
+    """
+    if workers and workers > 1:
+        return read_sheets_parallel(queue_path, list_queue_sheets(queue_path), workers)
+    if not os.path.isdir(queue_path):
+        return pd.read_excel(queue_path, sheet_name=None)
+    return {
+        sheet: read_sheet(queue_path, sheet) for sheet in list_queue_sheets(queue_path)
+    }
+
+
+def prefetch_queues(queue_paths, workers=1, ahead=None):
+    """Yields (queue path, {sheet_name: DataFrame}) for each queue, in order.
+
+    The next `ahead` queues (2 per worker by default) are parsed in `workers`
+    background processes while the caller works on the current one, which
+    also bounds how many parsed queues are held in memory. A queue that
+    cannot be read yields its exception instead of its sheets. With no
+    `workers` each queue is read when it is reached.
+    """
+    if not workers:
+        for queue_path in queue_paths:
+            try:
+                yield queue_path, read_queue(queue_path)
+            except Exception as e:
+                yield queue_path, e
+        return
+    remaining = iter(queue_paths)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+
+        def submit_next():
+            queue_path = next(remaining, None)
+            if queue_path is not None:
+                pending.append((queue_path, pool.submit(read_queue, queue_path)))
+
+        for _ in range(ahead or 2 * workers):
+            submit_next()
+        while pending:
+            queue_path, future = pending.popleft()
+            # Keep the workers busy while this queue is being applied
+            submit_next()
+            try:
+                update_sheets = future.result()
+            except Exception as e:
+                update_sheets = e
+            yield queue_path, update_sheets
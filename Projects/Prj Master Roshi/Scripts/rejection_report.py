@@ -0,0 +1,126 @@
+import os
+
+import pandas as pd
+
+from commit_journal import fsync_path
+
+# --- REJECTION REPORTS ---
+# The apply steps return their rejected queue rows as one DataFrame per queue
+# sheet: the rows as submitted, indexed by their position in the sheet, plus a
+# Reason. A RejectionWriter appends each batch of them to the run's report as
+# soon as it is produced, so a run never turns rejections into Python dicts or
+# holds them all at once. A report is a directory
+# Archive/rejected_records_<timestamp>/ with one <Sheet>.parquet (or .csv)
+# file per queue sheet (the layout of a queue directory, so corrected rows can
+# be dropped back into Data/ as a queue), optionally exported as one workbook.
+# Every row leads with Source_Sheet, Source_Row (its row number in the queue
+# sheet, the header being row 1) and Reason. Queue values are written as text,
+# so the report shows exactly what was submitted, even values that do not fit
+# the master's dtypes.
+
+REPORT_FORMATS = ("parquet", "csv")
+
+
+def report_frame(sheet, rejected):
+    """The report rows for rejected rows of `sheet` (source columns first)."""
+    values = rejected.drop(columns="Reason")
+    values = values.astype("str").where(values.notna())
+    report = pd.DataFrame(
+        {
+            "Source_Sheet": sheet,
+            # Positions are 0-based data rows; row 1 of the sheet is its header
+            "Source_Row": (rejected.index.to_numpy() + 2).astype("int64"),
+            "Reason": rejected["Reason"].astype("str").to_numpy(),
+        }
+    )
+    return pd.concat([report, values.reset_index(drop=True)], axis=1)
+
+
+class RejectionWriter:
+    """Appends rejected rows to a report directory, one file per queue sheet.
+
+    Nothing is created until the first rejection. close() flushes and fsyncs
+    every file; the writer can then export the report to Excel.
+    """
+
+    def __init__(self, path, file_format="parquet"):
+        if file_format not in REPORT_FORMATS:
+            raise ValueError(
+                f"Unknown rejection report format {file_format!r}; use one of {REPORT_FORMATS}"
+            )
+        self.path = path
+        self.file_format = file_format
+        self.counts = {}  # sheet -> rows written
+        self._columns = {}  # sheet -> report columns of its file
+        self._parquet = {}  # sheet -> open pyarrow ParquetWriter
+
+    @property
+    def rows(self):
+        return sum(self.counts.values())
+
+    def sheet_path(self, sheet):
+        return os.path.join(self.path, f"{sheet}.{self.file_format}")
+
+    def add(self, rejections):
+        """Appends a {sheet: rejected DataFrame} batch (e.g. one queue chunk's)."""
+        for sheet, rejected in rejections.items():
+            if rejected.empty:
+                continue
+            report = report_frame(sheet, rejected)
+            if sheet in self._columns:
+                # Chunks of one sheet share its header; keep the file's columns
+                report = report.reindex(columns=self._columns[sheet])
+            else:
+                os.makedirs(self.path, exist_ok=True)
+                self._columns[sheet] = list(report.columns)
+            if self.file_format == "parquet":
+                self._write_parquet(sheet, report)
+            else:
+                report.to_csv(
+                    self.sheet_path(sheet),
+                    mode="a",
+                    header=sheet not in self.counts,
+                    index=False,
+                )
+            self.counts[sheet] = self.counts.get(sheet, 0) + len(report)
+
+    def _write_parquet(self, sheet, report):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        writer = self._parquet.get(sheet)
+        if writer is None:
+            # Fixed per-sheet schema: every chunk is appended as a row group
+            schema = pa.schema(
+                [
+                    (column, pa.int64() if column == "Source_Row" else pa.string())
+                    for column in report.columns
+                ]
+            )
+            writer = pq.ParquetWriter(self.sheet_path(sheet), schema)
+            self._parquet[sheet] = writer
+        writer.write_table(
+            pa.Table.from_pandas(report, schema=writer.schema, preserve_index=False)
+        )
+
+    def close(self):
+        """Finishes every file and flushes it to disk."""
+        for writer in self._parquet.values():
+            writer.close()
+        self._parquet = {}
+        for sheet in self.counts:
+            fsync_path(self.sheet_path(sheet))
+        if self.counts:
+            fsync_path(self.path)
+
+    def export_excel(self, path):
+        """Writes the closed report as one workbook, a sheet per queue sheet."""
+        with pd.ExcelWriter(path, engine="openpyxl") as writer:
+            for sheet in self.counts:
+                if self.file_format == "parquet":
+                    report = pd.read_parquet(self.sheet_path(sheet))
+                else:
+                    report = pd.read_csv(self.sheet_path(sheet), dtype="str")
+                    report["Source_Row"] = report["Source_Row"].astype("int64")
+                report.to_excel(writer, sheet_name=sheet, index=False)
+        fsync_path(path)
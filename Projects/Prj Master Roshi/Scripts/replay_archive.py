@@ -0,0 +1,41 @@
+import argparse
+import os
+import sys
+
+import etl_engine
+
+# --- ARCHIVE REPLAY COMMAND ---
+# Recovery tool for a lost or corrupted master: rebuilds it from the template
+# seed by applying every Archive/PROCESSED_updates_* queue again, oldest
+# first, and commits the result once (see etl_engine.replay_archived_queues).
+# Queues still waiting in Data/ are not part of the archive; apply them
+# afterwards as usual. The master is replaced only if the whole replay worked.
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Rebuild the master database from the archived update queues."
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=etl_engine.replay_workers,
+        help="Background processes parsing the upcoming queues (0 = none).",
+    )
+    parser.add_argument(
+        "--list",
+        action="store_true",
+        help="Only list the archived queues that would be applied, in order.",
+    )
+    args = parser.parse_args()
+
+    if args.list:
+        for queue_path in etl_engine.archived_queue_files():
+            print(os.path.basename(queue_path))
+        return 0
+    metrics = etl_engine.replay_archived_queues(workers=args.workers)
+    return 0 if metrics.status == "success" else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,261 @@
+import numpy as np
+import pandas as pd
+
+from master_schema import MASTER_SCHEMA
+
+# --- SKILL MATRIX AND COVERAGE ---
+# The master exists to answer "who on team X holds skill Y at level N or
+# above". A SkillMatrix turns the training map into a sparse employee x skill
+# matrix of proficiency levels, kept column-compressed with plain numpy (the
+# CSC layout of scipy.sparse): the holders of a skill are one contiguous
+# slice, and every coverage figure is a count over integer codes instead of
+# a merge of the four tables. Team x skill figures are counted over the
+# (team, skill) pairs that occur only, never a dense teams x skills array. Build it once per master version
+# (etl_engine.load_skill_matrix caches it) and query it as often as needed.
+# Which tables and columns play which part comes from the schema config's
+# "skill_matrix" entry (see master_schema). Inactive employees hold no skills.
+
+
+def matrix_tables(schema=MASTER_SCHEMA):
+    """(map, employee, skill, team) tables a SkillMatrix is built from."""
+    config = schema["skill_matrix"]
+    tables = schema["tables"]
+    references = tables[config["table"]]["references"]
+    employee_table = references[config["employee"]]["table"]
+    skill_table = references[config["skill"]]["table"]
+    team_table = tables[employee_table]["references"][config["team"]]["table"]
+    return config["table"], employee_table, skill_table, team_table
+
+
+def _codes(keys, values):
+    """Position of every value in the `keys` Index (-1 where it is not one)."""
+    return keys.get_indexer(values)
+
+
+class SkillMatrix:
+    """Employee x skill proficiency levels of one master, with coverage queries.
+
+    - `employees`: the active employees, row i being matrix row (code) i,
+      and `employee_keys` their keys
+    - `skills`, `teams`: the skill and team keys, position = code
+    - `employee_team`: team code of every employee (-1 if its team is unknown)
+    - `indptr`, `indices`, `levels`: the matrix; the holders of skill code s
+      are `indices[indptr[s]:indptr[s + 1]]`, at `levels[indptr[s]:indptr[s + 1]]`
+    - `entry_skill`: the skill code of every entry (the expanded `indptr`)
+    """
+
+    def __init__(
+        self, schema, employees, employee_keys, skills, teams, employee_team, skill_team
+    ):
+        config = schema["skill_matrix"]
+        self.level_column = config.get("level") or "Level"
+        self.employees = employees
+        self.employee_keys = employee_keys
+        self.skills = skills
+        self.teams = teams
+        self.employee_team = employee_team
+        self.skill_team = skill_team  # owning team code per skill (None if not kept)
+        self.managers = None
+        self.indptr = np.zeros(len(skills) + 1, dtype=np.int64)
+        self.indices = np.zeros(0, dtype=np.int64)
+        self.levels = np.zeros(0, dtype=np.int16)
+        self.entry_skill = np.zeros(0, dtype=np.int64)
+
+    @classmethod
+    def build(cls, master, schema=MASTER_SCHEMA):
+        """Builds the matrix from the master tables named by matrix_tables()."""
+        config = schema["skill_matrix"]
+        map_table, employee_table, skill_table, team_table = matrix_tables(schema)
+        key = {name: table["key"][0] for name, table in schema["tables"].items()}
+
+        employees = master[employee_table]
+        status = config.get("status")
+        if status:
+            employees = employees[~employees[status].isin(config.get("inactive", []))]
+        employees = employees.reset_index(drop=True)
+        employee_keys = pd.Index(employees[key[employee_table]])
+        skills = pd.Index(master[skill_table][key[skill_table]])
+        team_df = master[team_table]
+        teams = pd.Index(team_df[key[team_table]])
+        skill_team = None
+        if config.get("skill_team"):
+            skill_team = _codes(teams, master[skill_table][config["skill_team"]])
+        matrix = cls(
+            schema,
+            employees,
+            employee_keys,
+            skills,
+            teams,
+            _codes(teams, employees[config["team"]]),
+            skill_team,
+        )
+        if config.get("manager"):
+            matrix.managers = team_df[config["manager"]].to_numpy()
+
+        # Map rows as (skill, employee, level) codes; rows of inactive or
+        # unknown employees and skills drop out here
+        rows = master[map_table]
+        employee = _codes(employee_keys, rows[config["employee"]])
+        skill = _codes(skills, rows[config["skill"]])
+        if config.get("level"):
+            level = rows[config["level"]].fillna(0).to_numpy(dtype=np.int16)
+        else:
+            # No levels kept: every certification counts as level 1
+            level = np.ones(len(rows), dtype=np.int16)
+        known = (employee >= 0) & (skill >= 0)
+        employee, skill, level = employee[known], skill[known], level[known]
+
+        # Sort by skill, then employee; a pair repeated in a legacy table keeps
+        # its highest level
+        order = np.lexsort((level, employee, skill))
+        employee, skill, level = employee[order], skill[order], level[order]
+        last = np.ones(len(skill), dtype=bool)
+        last[:-1] = (skill[1:] != skill[:-1]) | (employee[1:] != employee[:-1])
+        employee, skill, level = employee[last], skill[last], level[last]
+
+        matrix.indptr[1:] = np.cumsum(np.bincount(skill, minlength=len(skills)))
+        matrix.indices = employee
+        matrix.levels = level
+        matrix.entry_skill = skill
+        return matrix
+
+    # --- Lookups ---
+
+    def _qualified(self, min_level, team=None):
+        """(employee codes, skill codes, levels) of the entries at `min_level`+."""
+        keep = self.levels >= min_level
+        if team is not None:
+            keep &= self.employee_team[self.indices] == self.teams.get_loc(team)
+        return self.indices[keep], self.entry_skill[keep], self.levels[keep]
+
+    def _rows(self, employee, level, **columns):
+        """Employee rows for the codes `employee`, with the extra `columns` first."""
+        rows = self.employees.iloc[employee].reset_index(drop=True)
+        for position, (name, values) in enumerate(columns.items()):
+            rows.insert(position, name, values)
+        rows[self.level_column] = level
+        return rows
+
+    def holders(self, skill, team=None, min_level=1):
+        """Employees holding `skill` at `min_level` or above (of `team` if given), best first."""
+        code = self.skills.get_loc(skill)
+        span = slice(self.indptr[code], self.indptr[code + 1])
+        employee, level = self.indices[span], self.levels[span]
+        keep = level >= min_level
+        if team is not None:
+            keep &= self.employee_team[employee] == self.teams.get_loc(team)
+        order = np.argsort(-level[keep], kind="stable")
+        return self._rows(employee[keep][order], level[keep][order])
+
+    def skills_of(self, employee):
+        """{skill: level} held by one employee (a row scan; the matrix is by skill)."""
+        code = self.employee_keys.get_loc(employee)
+        held = self.indices == code
+        return dict(
+            zip(self.skills[self.entry_skill[held]], self.levels[held].tolist())
+        )
+
+    # --- Coverage ---
+
+    def _team_skill_counts(self, min_level):
+        """(pair codes, holders) of every (team, skill) pair held at `min_level`+.
+
+        A pair code is team code * number of skills + skill code; the codes
+        come back sorted and only pairs with at least one holder are listed.
+        """
+        employee, skill, _ = self._qualified(min_level)
+        team = self.employee_team[employee]
+        on_team = team >= 0
+        return np.unique(
+            team[on_team] * len(self.skills) + skill[on_team], return_counts=True
+        )
+
+    def coverage(self, min_level=1):
+        """How many employees of each team hold each skill, one row per
+        (Team, Skill) pair with at least one holder (long format)."""
+        pairs, holders = self._team_skill_counts(min_level)
+        team, skill = np.divmod(pairs, len(self.skills))
+        return pd.DataFrame(
+            {
+                "Team": self.teams[team],
+                "Skill": self.skills[skill],
+                "Holders": holders,
+            }
+        )
+
+    def bench_depth(self, min_level=1, team=None):
+        """Holders of every skill at `min_level`+ (within `team` if given), thinnest first."""
+        _, skill, _ = self._qualified(min_level, team)
+        depth = pd.Series(
+            np.bincount(skill, minlength=len(self.skills)),
+            index=self.skills,
+            name="Bench_Depth",
+        )
+        return depth.sort_values(kind="stable")
+
+    def single_points_of_failure(self, min_level=1, by_team=False):
+        """Skills held at `min_level`+ by exactly one employee, with that employee.
+
+        With `by_team`, per team: the skills exactly one member of a team holds.
+        """
+        employee, skill, level = self._qualified(min_level)
+        group = skill
+        if by_team:
+            team = self.employee_team[employee]
+            on_team = team >= 0
+            employee, skill, level, team = (
+                employee[on_team],
+                skill[on_team],
+                level[on_team],
+                team[on_team],
+            )
+            group = team * len(self.skills) + skill
+        # Holders per group over the groups that occur (the team x skill
+        # pair codes are too sparse to bincount)
+        _, group, holders = np.unique(group, return_inverse=True, return_counts=True)
+        single = holders[group] == 1
+        columns = {"Skill": self.skills[skill[single]]}
+        if by_team:
+            columns = {"Team": self.teams[team[single]], **columns}
+        return self._rows(employee[single], level[single], **columns)
+
+    def team_coverage(self, min_level=1):
+        """Per team: active employees, skills held, skills with a single holder,
+        and (when skills have an owning team) the share of its own skills covered.
+        """
+        pairs, holders = self._team_skill_counts(min_level)
+        pair_team = pairs // len(self.skills)
+        summary = pd.DataFrame(index=self.teams)
+        if self.managers is not None:
+            summary["Manager"] = self.managers
+        on_team = self.employee_team[self.employee_team >= 0]
+        summary["Employees"] = np.bincount(on_team, minlength=len(self.teams))
+        summary["Skills_Held"] = np.bincount(pair_team, minlength=len(self.teams))
+        summary["Single_Holder_Skills"] = np.bincount(
+            pair_team[holders == 1], minlength=len(self.teams)
+        )
+        if self.skill_team is not None:
+            owned = self.skill_team >= 0
+            owner = self.skill_team[owned]
+            own_pairs = owner * len(self.skills) + np.flatnonzero(owned)
+            covered = np.isin(own_pairs, pairs, assume_unique=True)
+            summary["Skills_Owned"] = np.bincount(owner, minlength=len(self.teams))
+            summary["Owned_Covered"] = np.bincount(
+                owner[covered], minlength=len(self.teams)
+            )
+            summary["Coverage"] = (
+                summary["Owned_Covered"] / summary["Skills_Owned"].replace(0, np.nan)
+            ).round(3)
+        return summary
+
+    def export_excel(self, path, min_level=1):
+        """Writes the coverage reports as one workbook."""
+        with pd.ExcelWriter(path, engine="openpyxl") as writer:
+            self.team_coverage(min_level).to_excel(writer, sheet_name="Team_Coverage")
+            self.bench_depth(min_level).to_excel(writer, sheet_name="Bench_Depth")
+            self.single_points_of_failure(min_level).to_excel(
+                writer, sheet_name="Single_Points", index=False
+            )
+            self.coverage(min_level).to_excel(
+                writer, sheet_name="Coverage", index=False
+            )
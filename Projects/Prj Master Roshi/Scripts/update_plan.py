@@ -0,0 +1,99 @@
+# --- DRY-RUN PLANS ---
+# etl_engine.plan_updates applies an update queue to the in-memory master with
+# every validation and cascade of a real run, then throws the result away: no
+# master file, report or archive is written and the queue stays in Data/. What
+# the run would have done is kept as an UpdatePlan, built from the same
+# ChangeSet a real run stages, so the master keys are netted out the same way
+# (e.g. a row removed and added back is one update).
+
+
+class UpdatePlan:
+    """What applying one update queue would change, computed without writing.
+
+    - `tables`: master table -> {"added", "updated", "removed"}: sets of keys
+      (tuples for composite keys), for the tables that would change
+    - `cascades`: table -> {child table: rows removed along with its rows}
+    - `rejections`: queue sheet -> its rejected rows, with their Reason
+    - `sheets`: queue sheet -> rows in/out/rejected (as in RunMetrics)
+    """
+
+    def __init__(self, queue_path, changes, rejections, sheets):
+        self.queue_path = queue_path
+        self.tables = {
+            table: {
+                "added": changes.inserted.get(table, set()),
+                "updated": changes.updated.get(table, set()),
+                "removed": changes.deleted.get(table, set()),
+            }
+            for table in changes.dirty_tables()
+        }
+        self.cascades = {
+            table: dict(children) for table, children in changes.cascaded.items()
+        }
+        self.rejections = rejections
+        self.sheets = {
+            sheet: {count: record[count] for count in record if count != "seconds"}
+            for sheet, record in sheets.items()
+        }
+
+    @property
+    def changes_master(self):
+        return bool(self.tables)
+
+    @property
+    def rows_rejected(self):
+        return sum(len(rejected) for rejected in self.rejections.values())
+
+    def counts(self):
+        """Returns {table: {"added": n, "updated": n, "removed": n}}."""
+        return {
+            table: {kind: len(keys) for kind, keys in diff.items()}
+            for table, diff in self.tables.items()
+        }
+
+    def rejection_reasons(self):
+        """Returns {sheet: {reason: rows}} of the rejected rows."""
+        return {
+            sheet: rejected["Reason"].value_counts(sort=False).to_dict()
+            for sheet, rejected in self.rejections.items()
+        }
+
+    def to_dict(self, keys=False):
+        """Plain dict of the plan, ready for json.dumps (with the keys if `keys`)."""
+        if keys:
+            tables = {
+                table: {
+                    kind: sorted(
+                        (list(key) if isinstance(key, tuple) else key for key in found),
+                        key=str,
+                    )
+                    for kind, found in diff.items()
+                }
+                for table, diff in self.tables.items()
+            }
+        else:
+            tables = self.counts()
+        return {
+            "queue_path": self.queue_path,
+            "tables": tables,
+            "cascades": self.cascades,
+            "sheets": self.sheets,
+            "rejections": self.rejection_reasons(),
+        }
+
+    def print_report(self):
+        """Prints the plan in the same terms as a run's log."""
+        print(f"\n--- Plan for {self.queue_path} (nothing written) ---")
+        if not self.changes_master:
+            print("  - No master table would change.")
+        for table, counts in self.counts().items():
+            print(
+                f"  - {table}: {counts['added']} added, {counts['updated']} updated, {counts['removed']} removed."
+            )
+            for child, rows in self.cascades.get(table, {}).items():
+                print(f"      cascades to {rows} {child} row(s).")
+        for sheet, reasons in self.rejection_reasons().items():
+            for reason, rows in reasons.items():
+                print(f"  - {sheet}: {rows} row(s) would be rejected: {reason}")
+        if self.rows_rejected:
+            print(f"WARNING: {self.rows_rejected} records would be rejected.")
@@ -0,0 +1,134 @@
+import hashlib
+import json
+import os
+import pickle
+import shutil
+
+# --- PARSED-WORKBOOK CACHE ---
+# Parsing Master_Database.xlsx with openpyxl dominates an Excel-backed load.
+# The cache keeps each parsed sheet as a pickled DataFrame in a directory named
+# after the workbook's fingerprint (size, mtime and SHA-256 of the content),
+# so an unchanged workbook is served without reparsing. A workbook's entries
+# are dropped when it is rewritten or a newer fingerprint of it is cached, and
+# the cache directory keeps at most `max_entries` fingerprints (least recently
+# used evicted first).
+
+CACHE_VERSION = 1
+
+
+def file_fingerprint(path):
+    """(size, mtime_ns, sha256 hex digest) of a file."""
+    stat = os.stat(path)
+    digest = hashlib.sha256()
+    with open(path, "rb") as handle:
+        for block in iter(lambda: handle.read(1 << 20), b""):
+            digest.update(block)
+    return stat.st_size, stat.st_mtime_ns, digest.hexdigest()
+
+
+class WorkbookCache:
+    """Parsed-sheet cache for workbooks, keyed by file fingerprint."""
+
+    def __init__(self, cache_dir, max_entries=8):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+
+    def _entry_dir(self, fingerprint):
+        size, mtime_ns, digest = fingerprint
+        return os.path.join(self.cache_dir, f"{digest[:32]}_{size}_{mtime_ns}")
+
+    @staticmethod
+    def _sheet_path(entry, sheet):
+        return os.path.join(entry, f"{sheet.replace(os.sep, '_')}.pkl")
+
+    def _entries(self):
+        """[(entry directory, meta dict)] of every valid cache entry."""
+        if not os.path.isdir(self.cache_dir):
+            return []
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            entry = os.path.join(self.cache_dir, name)
+            try:
+                with open(os.path.join(entry, "meta.json")) as handle:
+                    meta = json.load(handle)
+            except (OSError, ValueError):
+                continue
+            if meta.get("version") == CACHE_VERSION:
+                entries.append((entry, meta))
+        return entries
+
+    # --- Lookups ---
+
+    def load(self, path, sheets, parse):
+        """Returns {sheet: DataFrame} for `path`, parsing only uncached sheets.
+
+        `parse(sheet_names)` must return {sheet: DataFrame} for the given sheets;
+        its result is stored unless the workbook changed while it was parsed.
+        """
+        fingerprint = file_fingerprint(path)
+        entry = self._entry_dir(fingerprint)
+        frames, missing = {}, []
+        for sheet in sheets:
+            try:
+                with open(self._sheet_path(entry, sheet), "rb") as handle:
+                    frames[sheet] = pickle.load(handle)
+            except Exception:
+                missing.append(sheet)
+
+        if missing:
+            parsed = parse(missing)
+            frames.update(parsed)
+            stat = os.stat(path)
+            if (stat.st_size, stat.st_mtime_ns) == fingerprint[:2]:
+                self._store(path, fingerprint, entry, parsed)
+        else:
+            # Touch the entry so eviction sees it as recently used
+            try:
+                os.utime(os.path.join(entry, "meta.json"))
+            except OSError:
+                pass
+        return {sheet: frames[sheet] for sheet in sheets}
+
+    # --- Maintenance ---
+
+    def _store(self, path, fingerprint, entry, frames):
+        source = os.path.abspath(path)
+        # Older fingerprints of the same workbook can never be served again
+        for other, meta in self._entries():
+            if meta["source"] == source and other != entry:
+                shutil.rmtree(other, ignore_errors=True)
+
+        os.makedirs(entry, exist_ok=True)
+        for sheet, df in frames.items():
+            sheet_path = self._sheet_path(entry, sheet)
+            with open(f"{sheet_path}.tmp", "wb") as handle:
+                pickle.dump(df, handle, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(f"{sheet_path}.tmp", sheet_path)
+        with open(os.path.join(entry, "meta.json"), "w") as handle:
+            json.dump(
+                {
+                    "version": CACHE_VERSION,
+                    "source": source,
+                    "fingerprint": list(fingerprint),
+                },
+                handle,
+            )
+        self.evict()
+
+    def evict(self):
+        """Drops the least recently used entries beyond `max_entries`."""
+        entries = self._entries()
+        if len(entries) <= self.max_entries:
+            return
+        entries.sort(
+            key=lambda item: os.path.getmtime(os.path.join(item[0], "meta.json"))
+        )
+        for entry, _ in entries[: len(entries) - self.max_entries]:
+            shutil.rmtree(entry, ignore_errors=True)
+
+    def invalidate(self, path):
+        """Drops every cached fingerprint of `path` (call after rewriting it)."""
+        source = os.path.abspath(path)
+        for entry, meta in self._entries():
+            if meta["source"] == source:
+                shutil.rmtree(entry, ignore_errors=True)